@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+"""\
+Measure how long it takes to simulate restriction digests of many plasmids.
+
+Usage:
+    bench_digest.py [<n>...] [-e <enzymes>] [-c]
+
+Arguments:
+    <n>
+        The numbers of plasmids to digest.  By default: 100, 200, ..., 500.
+
+Options:
+    -e --enzymes <list>         [default: EcoRI,HindIII,BsaI-HFv2]
+        The enzymes to digest each plasmid with.
+
+    -c --check
+        Exit with a nonzero status if the time per plasmid for the largest
+        number of plasmids is more than 50% greater than for the smallest,
+        i.e. if the digests don't scale linearly.
+
+Each plasmid is a random 5 kb sequence with a site for each enzyme inserted
+every 1 kb, so every digest produces several fragments.  The "uncached" column
+looks up the enzymes for each plasmid, which is what `calc_digest_products()`
+did before enzyme batches were cached.
+"""
+
+import os
+import docopt
+import stepwise
+import random
+import time
+
+from stepwise_mol_bio.digest import (
+        calc_digest_products, calc_digest_products_batch,
+        get_restriction_batch,
+)
+
+SITES = {
+        'EcoRI': 'GAATTC',
+        'HindIII': 'AAGCTT',
+        'BsaI': 'GGTCTC',
+}
+
+def make_plasmids(n, enzymes):
+    rng = random.Random(0)
+    sites = [SITES.get(x.removesuffix('-HFv2').removesuffix('-HF'), '') for x in enzymes]
+    plasmids = []
+
+    for i in range(n):
+        seq = ''
+        for site in sites * 2:
+            seq += ''.join(rng.choices('ACGT', k=1000 - len(site))) + site
+        plasmids.append(seq[:5000])
+
+    return plasmids
+
+def time_batch(seqs, enzymes):
+    t0 = time.perf_counter()
+    calc_digest_products_batch(seqs, enzymes, is_circular=True)
+    return time.perf_counter() - t0
+
+def time_uncached(seqs, enzymes):
+    t0 = time.perf_counter()
+    for seq in seqs:
+        get_restriction_batch.cache_clear()
+        calc_digest_products(seq, enzymes, is_circular=True)
+    return time.perf_counter() - t0
+
+if __name__ == '__main__':
+    args = docopt.docopt(__doc__)
+
+    # Measure the searches themselves, not the site index.
+    os.environ['STEPWISE_MOL_BIO_NO_CACHE'] = '1'
+    ns = [int(x) for x in args['<n>']] or [100, 200, 300, 400, 500]
+    enzymes = args['--enzymes'].split(',')
+
+    # Warm up the imports and the enzyme cache, so the first measurement
+    # isn't an outlier.
+    time_batch(make_plasmids(1, enzymes), enzymes)
+
+    rows = []
+    per_seq = []
+
+    for n in ns:
+        seqs = make_plasmids(n, enzymes)
+        t_batch = time_batch(seqs, enzymes)
+        t_uncached = time_uncached(seqs, enzymes)
+        per_seq.append(t_batch / n)
+
+        rows.append([
+                n,
+                f'{t_batch:.3f}',
+                f'{1e6 * t_batch / n:.0f}',
+                f'{t_uncached:.3f}',
+                f'{t_uncached / t_batch:.1f}x',
+        ])
+
+    header = ['plasmids', 'batch (s)', 'µs/plasmid', 'uncached (s)', 'speedup']
+    print(stepwise.tabulate(rows, header, align='>>>>>'))
+
+    if args['--check'] and per_seq[-1] > 1.5 * per_seq[0]:
+        raise SystemExit(1)
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+"""\
+Compare the time needed to group samples by equality and by fingerprint.
+
+Usage:
+    bench_group_by.py [<n>...]
+
+Each sample is grouped on a dictionary of attributes (like `group_by_attrs()`
+does), and one in every ten samples has a distinct set of attributes.
+"""
+
+import docopt
+import stepwise
+
+from freezerbox import group_by_identity
+from stepwise_mol_bio import group_by_fingerprint
+from types import SimpleNamespace
+from timeit import Timer
+
+def make_samples(n):
+    return [
+            SimpleNamespace(
+                preset='q5',
+                volume_uL=i % max(n // 10, 1),
+                primers=['o1', 'o2'],
+            )
+            for i in range(n)
+    ]
+
+def by_attrs(sample):
+    return {
+            'preset': sample.preset,
+            'volume_uL': sample.volume_uL,
+            'primers': sample.primers,
+    }
+
+def time_grouping(group_by, samples):
+    timer = Timer(lambda: list(group_by(samples, key=by_attrs)))
+    n, t = timer.autorange()
+    return t / n
+
+if __name__ == '__main__':
+    args = docopt.docopt(__doc__)
+    ns = [int(x) for x in args['<n>']] or [10, 100, 1000, 10000]
+
+    rows = []
+    for n in ns:
+        samples = make_samples(n)
+        t_eq = time_grouping(group_by_identity, samples)
+        t_fp = time_grouping(group_by_fingerprint, samples)
+        rows.append([
+                n,
+                f'{1e3 * t_eq:.3f}',
+                f'{1e3 * t_fp:.3f}',
+                f'{t_eq / t_fp:.1f}x',
+        ])
+
+    header = ['samples', 'equality (ms)', 'fingerprint (ms)', 'speedup']
+    print(stepwise.tabulate(rows, header, align='>>>>'))
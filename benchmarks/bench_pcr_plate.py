@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+"""\
+Measure the time and memory needed to generate PCR protocols for whole plates.
+
+Usage:
+    bench_pcr_plate.py [<n>...] [-c] [-l <path>]
+
+Options:
+    -c --check
+        Exit with a nonzero status if any measurement exceeds its budget.
+
+    -l --log <path>
+        Append the measurements to the given TSV file, along with the date and
+        the current git revision, so that performance can be tracked over time.
+
+Each amplicon has its own 1 kb plasmid template and its own pair of primers,
+which is the worst case for the amount of work that has to be done per well.
+The budgets are deliberately generous (roughly 2x the measured values), so
+that only real regressions are flagged.
+"""
+
+import docopt
+import stepwise
+import random
+import subprocess
+import inform
+import time
+import tracemalloc
+
+from freezerbox import Database, Plasmid, Oligo
+from stepwise_mol_bio import Pcr
+from Bio.Seq import reverse_complement
+from datetime import datetime
+from pathlib import Path
+
+# Number of amplicons: (seconds, peak MiB)
+BUDGETS = {
+        96: (0.4, 10),
+        384: (1.5, 20),
+        1536: (5, 60),
+}
+
+def make_app(n):
+    rng = random.Random(0)
+    db = Database({})
+    amplicons = []
+
+    for i in range(n):
+        seq = ''.join(rng.choices('ACGT', k=1000))
+        db[f'p{i}'] = Plasmid(seq=seq, circular=True)
+        db[f'o{2*i}'] = Oligo(seq=seq[100:120])
+        db[f'o{2*i+1}'] = Oligo(seq=reverse_complement(seq[600:620]))
+
+        amplicons.append(
+                Pcr.Amplicon.from_tags(f'p{i}', f'o{2*i}', f'o{2*i+1}'),
+        )
+
+    app = Pcr(amplicons)
+    app.db = db
+    return app
+
+def measure(n):
+    # Tracing memory allocations slows everything down several-fold, so 
+    # measure the time and the memory in separate runs.  The apps are made 
+    # from scratch each time, because all the intermediate results are cached.
+    app = make_app(n)
+    t0 = time.perf_counter()
+    app.protocol.format_text()
+    t = time.perf_counter() - t0
+
+    app = make_app(n)
+    tracemalloc.start()
+    app.protocol.format_text()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return t, peak / 2**20
+
+def get_git_revision():
+    try:
+        return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=Path(__file__).parent,
+                capture_output=True,
+                text=True,
+                check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+if __name__ == '__main__':
+    args = docopt.docopt(__doc__)
+    ns = [int(x) for x in args['<n>']] or list(BUDGETS)
+
+    # Don't let warnings about the synthetic primers clutter the output.
+    inform.Inform(mute=True)
+
+    rows = []
+    over_budget = False
+
+    for n in ns:
+        t, mem = measure(n)
+        t_max, mem_max = BUDGETS.get(n, (None, None))
+        ok = (t_max is None or t <= t_max) and \
+             (mem_max is None or mem <= mem_max)
+        over_budget |= not ok
+
+        rows.append([
+                n,
+                f'{t:.2f}',
+                f'{t_max:g}' if t_max else '',
+                f'{mem:.1f}',
+                f'{mem_max:.0f}' if mem_max else '',
+                '' if ok else 'OVER',
+        ])
+
+    header = ['amplicons', 'time (s)', 'budget', 'peak (MiB)', 'budget', '']
+    print(stepwise.tabulate(rows, header, align='>>>>><'))
+
+    if path := args['--log']:
+        path = Path(path)
+        date = datetime.now().isoformat(timespec='seconds')
+        rev = get_git_revision()
+
+        with path.open('a') as f:
+            if path.stat().st_size == 0:
+                f.write('date\trevision\tamplicons\ttime_s\tpeak_MiB\n')
+            for n, t, _, mem, *_ in rows:
+                f.write(f'{date}\t{rev}\t{n}\t{t}\t{mem}\n')
+
+    if args['--check'] and over_budget:
+        raise SystemExit(1)
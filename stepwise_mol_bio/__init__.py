@@ -6,50 +6,93 @@ Protocols relating to molecular biology, e.g. PCR.
 
 __version__ = '1.24.0'
 
-from ._utils import *
-from ._sample_utils import *
-from ._assembly import Assembly
-from .aliquot import Aliquot
-from .anneal import Anneal
-from .autoclave import Autoclave
-from .digest import RestrictionDigest
-from .direct_dilution import DirectDilution
-from .ethanol_precipitation import EthanolPrecipitation
-from .gels.gel import Gel, Ladder
-from .gels.laser_scanner import LaserScanner
-from .gels.stain import Stain
-from .gels.transilluminator import Transilluminator
-from .gibson import Gibson
-from .golden_gate import GoldenGate
-from .grow import Grow
-from .ivt import Ivt
-from .ivtt import Ivtt
-from .kld import Kld
-from .ligate import Ligate
-from .lyophilize import Lyophilize
-from .miniprep import Miniprep
-from .pcr import Pcr
-from .serial_dilution import SerialDilution
-from .sequence import Sequence
-from .spin_cleanup import SpinCleanup
-from .thermocycler import Thermocycler
-from .transform import Transform
-from .trizol import Trizol
-
-# Avoid circular imports
-from .invpcr import InversePcr
-from .qpcr import Qpcr
-from .page_purify import PagePurify
-from .dnase import Dnase
-from .reverse_transcribe import ReverseTranscribe, ReverseTranscribeCli
-
-import stepwise
-from pathlib import Path
-
-class Plugin:
-    protocol_dir = Path(__file__).parent
-    config_path = protocol_dir / 'conf.toml'
-    priority = stepwise.Builtins.priority + 10
-
-del stepwise
-del Path
+# Everything is imported lazily, i.e. the first time it's accessed as an 
+# attribute of this package.  Most invocations of stepwise only need one 
+# protocol (or just the `Plugin` class), and importing all of them up front 
+# (along with dependencies like `requests`) would account for a significant 
+# fraction of the time it takes to run a single command.  Even the helpers in 
+# `_utils` are deferred, so that lightweight tools (e.g. the client in 
+# `_server`) can be imported without paying for `stepwise` and `freezerbox`.  
+# A nice side effect is that the protocols can import each other from this 
+# package without having to worry about the order they're listed in.
+
+_LAZY_IMPORTS = {
+        'Aliquot': '.aliquot',
+        'Anneal': '.anneal',
+        'Assembly': '._assembly',
+        'Autoclave': '.autoclave',
+        'Dnase': '.dnase',
+        'DirectDilution': '.direct_dilution',
+        'EthanolPrecipitation': '.ethanol_precipitation',
+        'Gel': '.gels.gel',
+        'Gibson': '.gibson',
+        'GoldenGate': '.golden_gate',
+        'Grow': '.grow',
+        'InversePcr': '.invpcr',
+        'Ivt': '.ivt',
+        'Ivtt': '.ivtt',
+        'Kld': '.kld',
+        'Ladder': '.gels.gel',
+        'LaserScanner': '.gels.laser_scanner',
+        'Ligate': '.ligate',
+        'Lyophilize': '.lyophilize',
+        'Miniprep': '.miniprep',
+        'PagePurify': '.page_purify',
+        'Pcr': '.pcr',
+        'Plugin': '._plugin',
+        'Qpcr': '.qpcr',
+        'RestrictionDigest': '.digest',
+        'ReverseTranscribe': '.reverse_transcribe',
+        'ReverseTranscribeCli': '.reverse_transcribe',
+        'Sequence': '.sequence',
+        'SerialDilution': '.serial_dilution',
+        'SpinCleanup': '.spin_cleanup',
+        'Stain': '.gels.stain',
+        'Thermocycler': '.thermocycler',
+        'Transform': '.transform',
+        'Transilluminator': '.gels.transilluminator',
+        'Trizol': '.trizol',
+}
+
+# Any names that aren't listed above are looked up in these modules, which 
+# used to be star-imported by this package.
+_LAZY_STAR_IMPORTS = [
+        '._utils',
+        '._sample_utils',
+]
+
+def __getattr__(name):
+    from importlib import import_module
+
+    if name == '__all__':
+        return [*_load_star_imports(), *_LAZY_IMPORTS]
+
+    try:
+        module_name = _LAZY_IMPORTS[name]
+    except KeyError:
+        try:
+            value = _load_star_imports()[name]
+        except KeyError:
+            raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    else:
+        module = import_module(module_name, __name__)
+        value = getattr(module, name)
+
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted({*globals(), *_load_star_imports(), *_LAZY_IMPORTS})
+
+def _load_star_imports():
+    from importlib import import_module
+
+    names = {}
+    for module_name in _LAZY_STAR_IMPORTS:
+        module = import_module(module_name, __name__)
+        names.update({
+                k: v
+                for k, v in vars(module).items()
+                if not k.startswith('_')
+        })
+    return names
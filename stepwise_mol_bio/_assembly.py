@@ -4,11 +4,11 @@ import byoc
 import autoprop
 
 from stepwise import Quantity
-from stepwise_mol_bio import Main, UsageError
+from stepwise_mol_bio import Main, UsageError, group_by_fingerprint
 from freezerbox import (
         ReagentConfig, MakerConfig, mw_from_length, parse_conc, 
         parse_size_bp, parse_volume_uL, convert_conc_unit, iter_combos, 
-        group_by_identity, group_by_cluster, unanimous, join_lists,
+        group_by_cluster, unanimous, join_lists,
 )
 from byoc import Key, Method, DocoptConfig
 from dataclasses import dataclass
@@ -324,8 +324,8 @@ class Assembly(Main):
     )
 
     group_by = {
-            'volume_uL': group_by_identity,
-            'excess_insert': group_by_identity,
+            'volume_uL': group_by_fingerprint,
+            'excess_insert': group_by_fingerprint,
     }
     merge_by = {
             'assemblies': join_lists,
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+
+"""\
+Render many protocols in a single process.
+
+Usage:
+    molbio-batch [<commands>] [-o <dir>] [-q]
+
+Arguments:
+    <commands>
+        A file containing one protocol command per line, e.g. `pcr p1,o1,o2`.
+        The leading `stepwise` is optional.  Blank lines and lines starting
+        with `#` are ignored.  If not specified, the commands will be read
+        from stdin.
+
+Options:
+    -o --output <dir>
+        Write each protocol to its own file in the given directory, rather
+        than writing every protocol to stdout (each preceded by the command
+        that produced it).  The files are numbered in the
+        same order as the commands, and named after the protocol, e.g.
+        `01_pcr.txt`, `02_digest.txt`, etc.
+
+    -q --quiet
+        Don't print a summary of how long each command took.
+
+The database, config files, and presets are loaded once and shared by every
+command, so this is much faster than running each command separately.  If a
+command fails, its error message is printed and the remaining commands are
+still rendered.  The exit status is nonzero if any command failed.
+"""
+
+import sys, os
+import shlex
+import time
+
+from pathlib import Path
+from dataclasses import dataclass
+
+@dataclass
+class BatchResult:
+    line_num: int
+    argv: list
+    status: int
+    stdout: bytes
+    stderr: str
+    time_s: float
+    path: Path = None
+
+    @property
+    def command(self):
+        return shlex.join(self.argv)
+
+def main():
+    import docopt
+    from inform import error
+    from ._utils import UsageError
+
+    args = docopt.docopt(__doc__)
+
+    if args['<commands>']:
+        with open(args['<commands>']) as f:
+            lines = f.readlines()
+    else:
+        lines = sys.stdin.readlines()
+
+    # Parse every command before rendering any of them, so a typo at the end 
+    # of the file doesn't waste the time spent on the rest.
+    try:
+        commands = list(parse_commands(lines, args['<commands>']))
+    except UsageError as err:
+        error(err)
+        sys.exit(1)
+
+    out_dir = Path(args['--output']) if args['--output'] else None
+    results = run_batch(commands, out_dir=out_dir)
+
+    for i, result in enumerate(results):
+        sys.stderr.write(result.stderr)
+
+        if not out_dir and result.stdout:
+            if i > 0:
+                sys.stdout.buffer.write(b'\n')
+            sys.stdout.buffer.write(f'$ stepwise {result.command}\n\n'.encode())
+            sys.stdout.buffer.write(result.stdout)
+
+    sys.stdout.flush()
+
+    if not args['--quiet']:
+        print(format_summary(results), file=sys.stderr)
+
+    sys.exit(any(x.status for x in results))
+
+def parse_commands(lines, path=None):
+    """
+    Yield the line number and the parsed arguments for each command in the
+    given lines.  The path is only used in error messages.
+    """
+    from ._utils import UsageError
+
+    for i, line in enumerate(lines, 1):
+        try:
+            argv = shlex.split(line, comments=True)
+        except ValueError as err1:
+            err2 = UsageError(
+                    path=path or '<stdin>',
+                    line_num=i,
+                    line=line.rstrip('\n'),
+                    reason=str(err1),
+            )
+            err2.brief = "{path}:{line_num}: can't parse command"
+            err2.info += "line: {line}"
+            err2.info += "{reason}"
+            raise err2 from err1
+
+        if not argv:
+            continue
+        if argv[0] == 'stepwise':
+            argv = argv[1:]
+
+        yield i, argv
+
+def run_batch(commands, *, cwd=None, out_dir=None):
+    """
+    Render every command, and return a list of `BatchResult` objects.
+
+    Each command is an iterable of (line number, arguments) tuples, as
+    produced by `parse_commands()`.  If an output directory is given, each
+    protocol is written to its own file in that directory.
+    """
+    from ._server import DatabaseCache, warm_configs, run_request
+
+    commands = list(commands)
+    cwd = str(cwd or os.getcwd())
+    db_cache = DatabaseCache()
+    results = []
+
+    if out_dir:
+        out_dir.mkdir(parents=True, exist_ok=True)
+        n = max(2, len(str(len(commands))))
+
+    with warm_configs():
+        for i, (line_num, argv) in enumerate(commands, 1):
+            msg = {'argv': argv, 'cwd': cwd, 'text': True}
+
+            start = time.perf_counter()
+            status, stdout, stderr = run_request(msg, db_cache)
+            time_s = time.perf_counter() - start
+
+            result = BatchResult(line_num, argv, status, stdout, stderr, time_s)
+
+            if out_dir and status == 0:
+                name = Path(argv[0]).stem
+                result.path = out_dir / f'{i:0{n}}_{name}.txt'
+                result.path.write_bytes(stdout)
+
+            results.append(result)
+
+    return results
+
+def format_summary(results):
+    from stepwise import tabulate
+
+    rows = [
+            [
+                x.line_num,
+                x.command,
+                'ok' if x.status == 0 else 'error',
+                f'{1000 * x.time_s:.0f}',
+            ]
+            for x in results
+    ]
+    total_s = sum(x.time_s for x in results)
+    num_errors = sum(bool(x.status) for x in results)
+
+    return tabulate(
+            rows=rows,
+            header=['Line', 'Command', 'Status', 'Time (ms)'],
+            footer=['', f'{len(results)} commands', f'{num_errors} errors', f'{1000 * total_s:.0f}'],
+            align='><<>',
+            max_width=100,
+            truncate='-x--',
+    )
+
+if __name__ == '__main__':
+    main()
+
@@ -0,0 +1,547 @@
+#!/usr/bin/env python3
+
+"""\
+Cache rendered protocols on disk.
+
+Protocols are a deterministic function of the command-line arguments (and
+any files they name), the FreezerBox database, the config files, and the code
+in this package.  The cache stores each rendered protocol in an SQLite
+database, keyed by a hash of all of these inputs, so that rendering the same
+protocol again (e.g. when regenerating a build sheet) doesn't require building
+any of the reaction objects.
+
+The protocol cache is opt-in: set `protocols = true` in the `molbio.cache`
+section of the stepwise config file to enable it.  That section also
+configures the size and age limits of the cache.  The cache can be bypassed
+for a single command with the `--no-cache` option, or for every command by
+setting the `$STEPWISE_MOL_BIO_NO_CACHE` environment variable.
+"""
+
+import os
+import time
+import pickle
+import hashlib
+import sqlite3
+import byoc
+import freezerbox
+
+from stepwise import StepwiseConfig
+from byoc import Key
+from inspect import isfunction
+from functools import lru_cache
+from weakref import WeakKeyDictionary
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+
+from ._utils import app_dirs
+from ._server import (
+        fingerprint_paths, find_freezerbox_db_paths,
+        find_freezerbox_config_paths,
+)
+
+class CacheConfig(byoc.App):
+    __config__ = [
+            StepwiseConfig.setup(('molbio', 'cache')),
+    ]
+    enabled = byoc.param(
+            Key(StepwiseConfig, 'enabled'),
+            cast=bool,
+            default=True,
+    )
+    protocols = byoc.param(
+            Key(StepwiseConfig, 'protocols'),
+            cast=bool,
+            default=False,
+    )
+    max_size_MB = byoc.param(
+            Key(StepwiseConfig, 'max_size_MB'),
+            cast=float,
+            default=100,
+    )
+    max_age_days = byoc.param(
+            Key(StepwiseConfig, 'max_age_days'),
+            cast=float,
+            default=30,
+    )
+
+@dataclass(frozen=True)
+class CachedProtocol:
+    """
+    A protocol retrieved from the cache.
+
+    *warnings* are the warnings that were issued while the protocol was
+    rendered (see `record_warnings()`).  They should be issued again whenever
+    the cached protocol is used, so that they aren't only shown the first
+    time.
+
+    *db_fingerprint* is None unless the protocol was rendered using a database
+    that wasn't part of the cache key.  In that case, it's the fingerprint of
+    the files that database was loaded from (see `fingerprint_db_files()`),
+    and the protocol is only valid if those files haven't changed since.
+    """
+    protocol: object
+    warnings: tuple = ()
+    db_fingerprint: object = None
+
+    def replay_warnings(self):
+        from inform import warn
+
+        for args, kwargs in self.warnings:
+            warn(*args, **kwargs)
+
+class ProtocolCache:
+    """
+    An SQLite database of rendered protocols, keyed by input fingerprints.
+
+    Use `ProtocolCache.from_config()` to get the cache configured by the user,
+    which also respects the `$STEPWISE_MOL_BIO_NO_CACHE` bypass.
+    """
+
+    # Evicting old entries requires scanning the whole table, so only do it 
+    # for the first entry added by each cache, and then every this many 
+    # entries.  Otherwise, caching lots of protocols at once (e.g. for 
+    # `freezerbox make`) would take quadratic time.
+    EVICT_INTERVAL = 100
+
+    def __init__(self, path, *, max_size_MB=100, max_age_days=30):
+        self.path = Path(path)
+        self.max_size_MB = max_size_MB
+        self.max_age_days = max_age_days
+        self._db = None
+        self._num_writes = 0
+
+    @classmethod
+    def from_config(cls):
+        """
+        Return the cache configured by the user, or None if caching is
+        disabled.  Protocols are only cached if the user opted in.
+        """
+        if os.environ.get('STEPWISE_MOL_BIO_NO_CACHE'):
+            return None
+
+        config = CacheConfig()
+        if not (config.enabled and config.protocols):
+            return None
+
+        return cls(
+                Path(app_dirs.user_cache_dir) / 'protocols.sqlite',
+                max_size_MB=config.max_size_MB,
+                max_age_days=config.max_age_days,
+        )
+
+    def get(self, key):
+        """
+        Return the `CachedProtocol` stored under the given key, or None.
+
+        Any problems reading the cache are treated as cache misses, since the
+        protocol can always be rendered from scratch.
+        """
+        try:
+            row = self._connect().execute(
+                    'SELECT protocol FROM protocols WHERE key = ?',
+                    (key,),
+            ).fetchone()
+
+            if row is None:
+                return None
+
+            with self._connect() as db:
+                db.execute(
+                        'UPDATE protocols SET accessed = ? WHERE key = ?',
+                        (time.time(), key),
+                )
+
+            return pickle.loads(row[0])
+
+        except (sqlite3.Error, pickle.UnpicklingError):
+            return None
+
+    def put(self, key, protocol, *, warnings=(), db_fingerprint=None):
+        """
+        Cache the given protocol, then evict old entries if necessary.
+
+        Protocols that can't be pickled are silently not cached.  See
+        `CachedProtocol` for a description of *warnings* and *db_fingerprint*.
+        """
+        try:
+            entry = CachedProtocol(protocol, tuple(warnings), db_fingerprint)
+            blob = pickle.dumps(entry)
+        except Exception:
+            return
+
+        try:
+            with self._connect() as db:
+                db.execute(
+                        'INSERT OR REPLACE INTO protocols VALUES (?, ?, ?, ?)',
+                        (key, blob, len(blob), time.time()),
+                )
+
+            if self._num_writes % self.EVICT_INTERVAL == 0:
+                self.evict()
+            self._num_writes += 1
+
+        except sqlite3.Error:
+            pass
+
+    def evict(self):
+        """
+        Remove entries that haven't been used recently, and then the least
+        recently used entries until the cache fits within its maximum size.
+        """
+        db = self._connect()
+
+        with db:
+            cutoff = time.time() - 86400 * self.max_age_days
+            db.execute('DELETE FROM protocols WHERE accessed < ?', (cutoff,))
+
+            max_size = 1e6 * self.max_size_MB
+            size, = db.execute(
+                    'SELECT COALESCE(SUM(size), 0) FROM protocols'
+            ).fetchone()
+
+            if size <= max_size:
+                return
+
+            rows = db.execute(
+                    'SELECT key, size FROM protocols ORDER BY accessed'
+            )
+            evict = []
+            for key, key_size in rows:
+                if size <= max_size:
+                    break
+                evict.append((key,))
+                size -= key_size
+
+            db.executemany('DELETE FROM protocols WHERE key = ?', evict)
+
+    def clear(self):
+        with self._connect() as db:
+            db.execute('DELETE FROM protocols')
+
+    @staticmethod
+    def key_from_argv(cls, argv, db):
+        """
+        Return the cache key for the protocol that the given class would
+        render from the given command-line arguments, or None if the
+        protocol shouldn't be cached (see `fingerprint_argv()`).
+        """
+        argv_fingerprint = fingerprint_argv(argv)
+        if argv_fingerprint is None:
+            return None
+
+        cwd = os.getcwd()
+
+        return hash_key(
+                'main',
+                cls,
+                list(argv),
+                argv_fingerprint,
+                cwd,
+                fingerprint_paths(find_freezerbox_config_paths(cwd)),
+                fingerprint_db(db) if db is not None else None,
+                fingerprint_configs(cls, db),
+        )
+
+    @staticmethod
+    def key_from_maker(maker):
+        """
+        Return the cache key for the protocol that the given combo maker would
+        render for `freezerbox make`.
+        """
+        cls = maker.__class__
+        return hash_key(
+                'make',
+                cls,
+                [fingerprint_reagent(x) for x in maker.products],
+                getattr(maker, 'show_product_tags', None),
+                fingerprint_db(maker.db),
+                fingerprint_configs(cls, maker.db),
+        )
+
+    def _connect(self):
+        if self._db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.path)
+            self._db.execute('''\
+                    CREATE TABLE IF NOT EXISTS protocols (
+                        key TEXT PRIMARY KEY,
+                        protocol BLOB,
+                        size INTEGER,
+                        accessed REAL
+                    )
+            ''')
+        return self._db
+
+def load_protocol(app, argv):
+    """
+    Return the protocol for the given app, which was configured using the
+    given command-line arguments.  The protocol is taken from the cache if
+    possible, and added to it otherwise.
+    """
+    cache = ProtocolCache.from_config()
+    if not cache:
+        return app.protocol
+
+    # Don't load the database just to compute the key.  Loading and 
+    # fingerprinting it can take longer than rendering a protocol that 
+    # doesn't use it at all.  Instead, a database that's loaded while 
+    # rendering the protocol is checked via the files it came from.
+    db = getattr(app, '_db', None)
+    key = cache.key_from_argv(app.__class__, argv, db)
+    if key is None:
+        return app.protocol
+
+    if entry := cache.get(key):
+        if entry.db_fingerprint is None or \
+                entry.db_fingerprint == fingerprint_db_files():
+            entry.replay_warnings()
+            return entry.protocol
+
+    with record_warnings() as warnings:
+        protocol = app.protocol
+
+    db_fingerprint = None
+
+    if db is None and (db := getattr(app, '_db', None)) is not None:
+        db_fingerprint = fingerprint_db_files(db.config)
+
+    cache.put(
+            key, protocol,
+            warnings=warnings,
+            db_fingerprint=db_fingerprint,
+    )
+    return protocol
+
+@contextmanager
+def record_warnings():
+    """
+    Record the warnings issued via `inform.warn()` within this context.
+
+    The warnings are still displayed as usual.  Each one is recorded as the
+    arguments it was issued with, so that it can be issued again when a
+    cached protocol is used (see `CachedProtocol.replay_warnings()`).
+    """
+    import inform
+
+    informer = inform.get_informer()
+    report = informer._report
+    had_report = '_report' in vars(informer)
+    warnings = []
+
+    def record(args, kwargs, action):
+        if action is inform.warn:
+            warnings.append((args, kwargs))
+        return report(args, kwargs, action)
+
+    informer._report = record
+
+    try:
+        yield warnings
+    finally:
+        if had_report:
+            informer._report = report
+        else:
+            del informer._report
+
+def hash_key(*args):
+    """
+    Combine the given fingerprints into a single key.
+
+    The package version and the modification times of its source files are
+    always included, so that changes to the code invalidate the cache.
+    """
+    key = hashlib.sha256()
+    key.update(repr(fingerprint_package()).encode())
+
+    for arg in args:
+        if isinstance(arg, type):
+            arg = f'{arg.__module__}.{arg.__qualname__}'
+        key.update(repr(arg).encode())
+
+    return key.hexdigest()
+
+def fingerprint_argv(argv):
+    """
+    Return a value that will change if any of the files named by the given
+    command-line arguments change, or None if that can't be done reliably.
+
+    Any argument that names an existing file is assumed to be an input to the
+    protocol (e.g. the CSV file given to `pcr --plate`), as is the value of
+    any `--option=<path>` argument.  Directories and stdin ("-") can't be
+    fingerprinted cheaply, so None is returned if any argument names one.
+    """
+    paths = []
+
+    for arg in argv:
+        values = [arg]
+        if arg.startswith('-') and '=' in arg:
+            values.append(arg.split('=', 1)[1])
+
+        for value in values:
+            if value == '-':
+                return None
+
+            # Arguments that can't be paths (e.g. long sequences) aren't 
+            # files.
+            try:
+                path = Path(value)
+                if path.is_dir():
+                    return None
+                if path.exists():
+                    paths.append(path.resolve())
+            except (OSError, ValueError):
+                pass
+
+    try:
+        return fingerprint_paths(paths)
+    except OSError:
+        return None
+
+def fingerprint_db(db):
+    """
+    Return a hash that will change if any reagent in the given database
+    changes.
+
+    Any files that the database was loaded from, and any files that sequences
+    may be lazily loaded from, are also taken into account.  The hash is
+    calculated only once per database object, so databases should not be
+    modified after being fingerprinted.
+    """
+    try:
+        return _db_fingerprints[db]
+    except KeyError:
+        pass
+
+    hash = hashlib.sha256()
+    hash.update(stable_repr(dict(db.config)).encode())
+
+    for tag, reagent in db.items():
+        hash.update(fingerprint_reagent(reagent).encode())
+
+    hash.update(repr(fingerprint_db_files(db.config)).encode())
+
+    _db_fingerprints[db] = fp = hash.hexdigest()
+    return fp
+
+_db_fingerprints = WeakKeyDictionary()
+
+def fingerprint_db_files(config=None):
+    """
+    Return a value that will change if any of the files that the database
+    would be loaded from, or that sequences may be lazily loaded from, change.
+
+    This is much cheaper than `fingerprint_db()`, since it doesn't require
+    loading the database, but it only works for databases that are loaded
+    from files.  By default, the same config that `freezerbox.load_db()`
+    would use is used.  None is returned if that config can't be loaded.
+    """
+    if config is None:
+        from freezerbox.config import load_config
+
+        try:
+            config = load_config()
+        except Exception:
+            return None
+
+    paths = [
+            *find_freezerbox_db_paths(config),
+            *find_freezerbox_seq_paths(config),
+    ]
+    return fingerprint_paths(paths)
+
+def fingerprint_reagent(reagent):
+    """
+    Return a string that identifies the given reagent, including all of its
+    database fields, and will be the same for equivalent reagents in
+    different processes.
+    """
+    cls = reagent.__class__.__qualname__
+    step = getattr(reagent, 'step', None)
+    return f'{cls}({reagent.tag!r}, step={step}, {stable_repr(reagent._attrs)})'
+
+def fingerprint_configs(cls, db=None):
+    """
+    Return a value that will change if any of the config files that could
+    affect the given class change.
+    """
+    from ._plugin import Plugin
+
+    config_paths = [
+            *StepwiseConfig(cls.from_bare()).config_paths,
+            Plugin.config_path,
+    ]
+    return (
+            fingerprint_paths(config_paths),
+            stable_repr(dict(db.config)) if db is not None else None,
+    )
+
+@lru_cache
+def fingerprint_package():
+    import stepwise_mol_bio
+
+    root = Path(__file__).parent
+    return (
+            stepwise_mol_bio.__version__,
+            fingerprint_paths(sorted(root.glob('**/*.py'))),
+    )
+
+def find_freezerbox_seq_paths(config):
+    """
+    Return every file that sequences could be lazily loaded from.
+
+    The sequence path templates can refer to the reagent tag in arbitrary
+    ways, so every file in the directory containing the templated part of the
+    path is included.
+    """
+    try:
+        loader_configs = config['database'][config['use']]
+    except KeyError:
+        return []
+
+    paths = []
+
+    for loader_config in loader_configs:
+        try:
+            template = loader_config['sequence']
+        except KeyError:
+            continue
+
+        root = Path(str(template).split('{')[0]).expanduser()
+        if not root.is_dir():
+            root = root.parent
+
+        if root.is_dir():
+            paths += sorted(p for p in root.glob('**/*') if p.is_file())
+
+    return paths
+
+def stable_repr(x):
+    """
+    Return a string representation of the given value that doesn't depend on
+    memory addresses.
+
+    The main complication is that FreezerBox represents lazily-parsed fields
+    as closures, which are represented here by their names and the values
+    they close over.
+    """
+    if isinstance(x, freezerbox.Database):
+        return 'Database'
+
+    if isfunction(x):
+        cells = [c.cell_contents for c in x.__closure__ or ()]
+        args = ', '.join(stable_repr(c) for c in cells)
+        return f'{x.__module__}.{x.__qualname__}({args})'
+
+    if isinstance(x, dict):
+        items = ', '.join(
+                f'{stable_repr(k)}: {stable_repr(v)}'
+                for k, v in x.items()
+        )
+        return f'{{{items}}}'
+
+    if isinstance(x, (list, tuple)):
+        items = ', '.join(stable_repr(v) for v in x)
+        return f'{x.__class__.__name__}([{items}])'
+
+    return repr(x)
@@ -0,0 +1,491 @@
+#!/usr/bin/env python3
+
+"""\
+Pick restriction digests that can verify a clone.
+
+A diagnostic digest is useful if the expected plasmid gives a band pattern
+that can't be confused with the pattern from the parent plasmid, or from any
+likely misassembly.  Two patterns can be told apart if some band in one
+pattern doesn't have a partner in the other that's within the resolution of
+the gel.  Bands run roughly according to the logarithm of their size, so the
+resolution is a relative size difference, e.g. 10%.  Formally, the separation
+between two patterns is the Hausdorff distance between their sets of visible
+bands, in log-size units.  Digests are ranked by the smallest separation
+between the expected plasmid and any of the alternatives.
+
+Every single enzyme and every pair of enzymes with a compatible buffer is
+considered, which is thousands of combinations.  So rather than simulating
+each digest, the cut positions for every enzyme are looked up once per
+sequence (see `RestrictionSiteIndex`), and the fragment sizes and separations
+for all the combinations are calculated at once with array operations.  Only
+the digests that are actually reported are simulated with
+`calc_digest_products()`.
+"""
+
+import stepwise, byoc, autoprop
+import numpy as np
+import freezerbox
+
+from byoc import Key, DocoptConfig
+from inform import error
+from itertools import combinations
+from dataclasses import dataclass
+from stepwise_mol_bio import (
+        ConfigError, UsageError, StepwiseMolBioError, comma_list, match_len,
+)
+from .digest import (
+        RestrictionDigest, NEB_BUFFER_NAMES,
+        calc_digest_products, pick_compatible_buffer, get_restriction_batch,
+        get_neb_restriction_enzyme_db,
+)
+from ._site_index import RestrictionSiteIndex, search_sites, get_neb_enzymes
+
+# Bands that differ in size by less than this fraction are assumed to run
+# together.  This is about right for a standard agarose gel.
+RESOLUTION = 0.1
+
+# Bands smaller than this are too faint to see reliably, and bands larger than
+# this don't separate well from each other.
+MIN_BAND_BP = 250
+MAX_BAND_BP = 10000
+
+# Digests that give the expected plasmid more fragments than this are hard to
+# interpret.
+MAX_FRAGMENTS = 6
+
+# Both enzymes in a double digest need at least this much activity (as a
+# percentage) in the chosen buffer, as in NEB's double digest guidelines.
+MIN_BUFFER_ACTIVITY = 50
+
+@dataclass(frozen=True)
+class DiagnosticDigest:
+    """
+    A digest that tells the expected sequence apart from the alternatives.
+
+    *fragments_bp* has the fragment sizes from each sequence, largest first,
+    in the same order as the sequences were given.  *separation* is the
+    smallest relative size difference between the band patterns of the
+    expected sequence and any alternative, e.g. 0.25 means that some band
+    differs by at least 25% from every band of the closest alternative.
+    """
+    enzymes: tuple
+    buffer: str
+    fragments_bp: tuple
+    separation: float
+
+def design_diagnostic_digests(
+        seqs, *,
+        is_circular=True,
+        enzymes=None,
+        enzyme_db=None,
+        max_enzymes=2,
+        resolution=RESOLUTION,
+        min_band_bp=MIN_BAND_BP,
+        max_band_bp=MAX_BAND_BP,
+        max_fragments=MAX_FRAGMENTS,
+        num_results=10,
+):
+    """
+    Find the digests that best distinguish the first of the given sequences
+    from the rest.
+
+    By default, every enzyme sold by NEB is considered, but *enzymes* can
+    give a list of enzyme names instead.  If *enzyme_db* is given (e.g. the
+    database returned by `get_neb_restriction_enzyme_db()`), enzymes that
+    aren't in it are skipped, pairs of enzymes are only considered if they
+    work in the same buffer, and the buffer for each digest is filled in.
+    Otherwise, every pair of enzymes is considered.  *max_enzymes* can be 1
+    to only consider single digests.
+
+    Only digests that distinguish the expected sequence from every
+    alternative at the given *resolution* are returned, best first.
+    """
+    seqs = list(seqs)
+    if len(seqs) < 2:
+        raise UsageError("need an expected sequence and at least one alternative")
+
+    is_circular = match_len(is_circular, len(seqs))
+    names = _pick_enzyme_names(enzymes, enzyme_db)
+    if not names:
+        return []
+
+    batch, bio_names = get_restriction_batch(tuple(names))
+    cuts = [
+            _find_cuts(seq, batch, bio_names)
+            for seq in seqs
+    ]
+
+    # Enzymes that cut the expected sequence too many times can't be part of
+    # a useful digest, so don't waste time on them.  Neither can enzymes that
+    # don't cut any of the sequences; they would just add redundant pairs.
+    num_cuts = np.isfinite(cuts[0]).sum(axis=1)
+    cuts_any = np.any([np.isfinite(x).any(axis=1) for x in cuts], axis=0)
+    ok = (num_cuts <= max_fragments) & cuts_any
+    names = [x for x, ok_i in zip(names, ok) if ok_i]
+    cuts = [_trim_padding(x[ok]) for x in cuts]
+
+    combos = _pick_combos(names, enzyme_db, max_enzymes)
+    if not len(combos):
+        return []
+
+    # Shape: (sequences, combos, bands)
+    bands = [
+            _calc_bands(
+                _calc_fragment_sizes(
+                    _combine_cuts(x, combos), len(seq), circ,
+                ),
+                min_band_bp,
+                max_band_bp,
+            )
+            for x, seq, circ in zip(cuts, seqs, is_circular)
+    ]
+
+    expected_cuts = _combine_cuts(cuts[0], combos)
+    sizes = _calc_fragment_sizes(expected_cuts, len(seqs[0]), is_circular[0])
+    is_cut = np.isfinite(expected_cuts).any(axis=1)
+    num_fragments = (sizes > 0).sum(axis=1)
+    num_bands = np.isfinite(bands[0]).sum(axis=1)
+
+    max_log_sep = np.log10(max_band_bp / min_band_bp)
+    log_sep = np.min([
+            _calc_log_separations(bands[0], x, max_log_sep)
+            for x in bands[1:]
+    ], axis=0)
+
+    ok = (
+            is_cut &
+            (num_bands >= 1) &
+            (num_fragments <= max_fragments) &
+            (log_sep >= np.log10(1 + resolution) - 1e-9)
+    )
+    num_enzymes = (combos >= 0).sum(axis=1)
+    order = np.lexsort((num_bands, num_enzymes, -log_sep))
+    order = order[ok[order]][:num_results]
+
+    digests = []
+
+    for k in order:
+        digest_names = tuple(names[i] for i in combos[k] if i >= 0)
+        digests.append(
+                DiagnosticDigest(
+                    enzymes=digest_names,
+                    buffer=_pick_buffer(digest_names, enzyme_db),
+                    fragments_bp=tuple(
+                        _simulate_digest(seq, digest_names, circ)
+                        for seq, circ in zip(seqs, is_circular)
+                    ),
+                    separation=float(10**log_sep[k] - 1),
+                )
+        )
+
+    return digests
+
+def pick_neb_enzyme_names(enzyme_db):
+    """
+    Return the name of every enzyme in the given NEB database that can be
+    searched for.
+
+    Biopython doesn't distinguish high-fidelity enzymes from the originals,
+    so only one version of each enzyme is included.  The high-fidelity
+    version is preferred, since those all work in rCutSmart buffer, which
+    makes them easier to combine.
+    """
+    names = []
+    for enzyme in sorted(get_neb_enzymes(), key=str):
+        for name in [f'{enzyme}-HFv2', f'{enzyme}-HF', str(enzyme)]:
+            if name in enzyme_db:
+                names.append(name)
+                break
+    return names
+
+@autoprop
+class DiagnosticDigestDesign(byoc.App):
+    """\
+Find restriction digests that distinguish a plasmid from its parent or from
+likely misassemblies.
+
+Usage:
+    molbio-diagnostic-digest <expected> <alternatives>... [options]
+
+Arguments:
+    <expected>
+        The name of the plasmid that should have been cloned, e.g. p2.  This
+        plasmid must be in the FreezerBox database, and must have a sequence.
+
+    <alternatives>
+        The names of the plasmids that the clone needs to be distinguished
+        from, e.g. the parent plasmid or a plasmid with one fragment missing.
+        These plasmids must also be in the FreezerBox database.
+
+Options:
+    -e --enzymes <list>
+        Only consider the given enzymes (comma-separated).  By default, every
+        enzyme sold by NEB is considered.
+
+    -1 --single
+        Only consider digests with a single enzyme.
+
+    -n --num-results <int>          [default: 10]
+        The number of digests to show.
+
+    -r --resolution <percent>       [default: 10]
+        The smallest difference in size (as a percentage) between two bands
+        that can be distinguished on the gel.
+
+    -f --max-fragments <int>        [default: 6]
+        The largest number of fragments that the expected plasmid can be cut
+        into.
+
+Bands smaller than 250 bp are assumed to be too faint to see.  Double digests
+are only considered if both enzymes have at least 50% activity in a common
+buffer.
+"""
+
+    __config__ = [
+            DocoptConfig,
+    ]
+
+    expected = byoc.param('<expected>')
+    alternatives = byoc.param('<alternatives>')
+    enzymes = byoc.param(
+            Key(DocoptConfig, '--enzymes', cast=comma_list),
+            default=None,
+    )
+    max_enzymes = byoc.param(
+            Key(DocoptConfig, '--single', cast=lambda x: 1 if x else 2),
+            default=2,
+    )
+    num_results = byoc.param(
+            Key(DocoptConfig, '--num-results', cast=int),
+            default=10,
+    )
+    resolution = byoc.param(
+            Key(DocoptConfig, '--resolution', cast=lambda x: float(x) / 100),
+            default=RESOLUTION,
+    )
+    max_fragments = byoc.param(
+            Key(DocoptConfig, '--max-fragments', cast=int),
+            default=MAX_FRAGMENTS,
+    )
+
+    def __init__(self, db, expected, alternatives, enzyme_db=None):
+        self.db = db
+        self.expected = expected
+        self.alternatives = alternatives
+        self.enzyme_db = enzyme_db
+
+    @classmethod
+    def main(cls):
+        app = cls.from_bare()
+        app.enzyme_db = None
+        byoc.load(app, DocoptConfig)
+
+        try:
+            app.db = freezerbox.load_db()
+            print(app.format_digests(app.design_digests()))
+        except (
+                StepwiseMolBioError,
+                freezerbox.LoadError,
+                freezerbox.QueryError,
+                byoc.NoValueFound,
+        ) as err:
+            error(err)
+
+    def get_tags(self):
+        return [self.expected, *self.alternatives]
+
+    def design_digests(self):
+        """
+        Return the best digests for telling the plasmids apart, see
+        `design_diagnostic_digests()`.
+        """
+        if not self.alternatives:
+            raise UsageError("no alternative plasmids specified")
+
+        templates = [
+                RestrictionDigest.Template(x, db=self.db)
+                for x in self.tags
+        ]
+        enzyme_db = self.enzyme_db
+        if enzyme_db is None:
+            enzyme_db = get_neb_restriction_enzyme_db()
+
+        digests = design_diagnostic_digests(
+                [x.seq for x in templates],
+                is_circular=[x.is_circular for x in templates],
+                enzymes=self.enzymes or pick_neb_enzyme_names(enzyme_db),
+                enzyme_db=enzyme_db,
+                max_enzymes=self.max_enzymes,
+                resolution=self.resolution,
+                max_fragments=self.max_fragments,
+                num_results=self.num_results,
+        )
+
+        if not digests:
+            err = ConfigError(expected=self.expected, alternatives=self.alternatives)
+            err.brief = "no digest can distinguish {expected!r} from {alternatives!r}"
+            err.hints += "try a finer resolution (--resolution) or more fragments (--max-fragments)"
+            raise err
+
+        return digests
+
+    def format_digests(self, digests):
+        def format_fragments(fragments):
+            if not fragments:
+                return 'uncut'
+            return ', '.join(f'{x / 1000:.1f}' for x in fragments)
+
+        rows = [
+                [
+                    '+'.join(x.enzymes),
+                    x.buffer,
+                    *map(format_fragments, x.fragments_bp),
+                    f'{100 * x.separation:.0f}%',
+                ]
+                for x in digests
+        ]
+        header = [
+                'enzymes',
+                'buffer',
+                *(f'{x} (kb)' for x in self.tags),
+                'separation',
+        ]
+        return stepwise.tabulate(rows, header, align='<<' + '<' * len(self.tags) + '>')
+
+def _pick_enzyme_names(enzymes, enzyme_db):
+    if enzymes is None:
+        enzymes = [str(x) for x in sorted(get_neb_enzymes(), key=str)]
+    if enzyme_db is not None:
+        enzymes = [x for x in enzymes if x in enzyme_db]
+
+    # Biopython doesn't distinguish between the regular and high-fidelity
+    # versions of each enzyme, so only keep the first of each.
+    _, bio_names = get_restriction_batch(tuple(enzymes))
+    unique = {}
+    for name, bio_name in zip(enzymes, bio_names):
+        unique.setdefault(bio_name, name)
+
+    return list(unique.values())
+
+def _find_cuts(seq, batch, bio_names):
+    # Returns a (enzymes, cuts) array with the cut positions for each enzyme,
+    # sorted and padded with infinity.
+    index = RestrictionSiteIndex.from_config()
+    hits = index.get_sites(seq, batch) if index else search_sites(seq, batch)
+    hits = {str(k): v for k, v in hits.items()}
+
+    max_cuts = max(1, max(len(x) for x in hits.values()))
+    cuts = np.full((len(bio_names), max_cuts), np.inf)
+    for i, name in enumerate(bio_names):
+        cuts[i, :len(hits[name])] = hits[name]
+
+    return cuts
+
+def _pick_combos(names, enzyme_db, max_enzymes):
+    # Returns a (combos, 2) array of enzyme indices.  Single digests are
+    # padded with -1.
+    combos = [(i, -1) for i in range(len(names))]
+
+    if max_enzymes >= 2:
+        params = [enzyme_db[x] for x in names] if enzyme_db is not None else None
+        combos += [
+                (i, j)
+                for i, j in combinations(range(len(names)), 2)
+                if params is None or _is_compatible(params[i], params[j])
+        ]
+
+    return np.array(combos, dtype=int).reshape(-1, 2)
+
+def _is_compatible(a, b):
+    buffer = pick_compatible_buffer([a, b])
+    codes = {v: k for k, v in NEB_BUFFER_NAMES.items()}
+    k = codes[buffer]
+    return all(
+            x[f'buf{k}'] >= MIN_BUFFER_ACTIVITY and not x[f'star{k}']
+            for x in (a, b)
+    )
+
+def _trim_padding(x):
+    # Remove any columns that are entirely padding, i.e. infinite or NaN.
+    width = max(1, np.isfinite(x).sum(axis=1).max(initial=0))
+    return x[:, :width]
+
+def _combine_cuts(cuts, combos):
+    # Index -1 refers to the last row, which is all padding.
+    cuts = np.vstack([cuts, np.full((1, cuts.shape[1]), np.inf)])
+    return np.sort(np.hstack([cuts[combos[:, 0]], cuts[combos[:, 1]]]), axis=1)
+
+def _calc_fragment_sizes(cuts, length, is_circular):
+    """
+    Return the sizes of the fragments produced by cutting a sequence of the
+    given length at the given positions.
+
+    *cuts* is a (digests, cuts) array, where each row is sorted and padded
+    with infinity.  The result has a row for each digest, padded with zeros.
+    Uncut circular sequences are treated as a single fragment the length of
+    the whole sequence.  Uncut plasmids don't run at the same size as linear
+    DNA, but they still produce a band, and the most conservative assumption
+    is that it will be confused with any band of about the same size.
+    """
+    n = len(cuts)
+
+    if is_circular:
+        uncut = np.isinf(cuts[:, 0])
+        end = np.where(uncut, 0, cuts[:, 0])[:, None] + length
+        bounds = np.hstack([np.where(np.isinf(cuts), end, cuts), end])
+        bounds[uncut, 0] = 0
+    else:
+        bounds = np.hstack([
+                np.zeros((n, 1)),
+                np.where(np.isinf(cuts), length, cuts),
+                np.full((n, 1), length),
+        ])
+
+    return np.diff(bounds, axis=1)
+
+def _calc_bands(sizes, min_band_bp, max_band_bp):
+    # The log of the size of each visible band, or NaN.  Bands larger than
+    # the maximum all run together.
+    visible = sizes >= min_band_bp
+    with np.errstate(divide='ignore'):
+        logs = np.log10(np.clip(sizes, 1, max_band_bp))
+
+    # Move the visible bands to the front of each row, so the columns that
+    # don't have any visible bands can be dropped.
+    return _trim_padding(np.sort(np.where(visible, logs, np.nan), axis=1))
+
+def _calc_log_separations(a, b, max_log_sep):
+    # The Hausdorff distance between the bands in each row of *a* and *b*.
+    # Rows where only one pattern has visible bands are maximally separated,
+    # and rows where neither does aren't separated at all.
+    seps = np.empty(len(a))
+    chunk = max(1, 2**22 // (a.shape[1] * b.shape[1]))
+
+    for i in range(0, len(a), chunk):
+        a_i = a[i:i+chunk]
+        b_i = b[i:i+chunk]
+
+        # Shape: (digests, bands in a, bands in b)
+        d = np.abs(a_i[:, :, None] - b_i[:, None, :])
+        d = np.where(np.isnan(d), np.inf, d)
+
+        a_to_b = np.where(np.isnan(a_i), -np.inf, d.min(axis=2))
+        b_to_a = np.where(np.isnan(b_i), -np.inf, d.min(axis=1))
+
+        h = np.maximum(a_to_b.max(axis=1), b_to_a.max(axis=1))
+        seps[i:i+chunk] = np.clip(h, 0, max_log_sep)
+
+    return seps
+
+def _pick_buffer(names, enzyme_db):
+    if enzyme_db is None:
+        return None
+    return pick_compatible_buffer([enzyme_db[x] for x in names])
+
+def _simulate_digest(seq, enzymes, is_circular):
+    try:
+        products = calc_digest_products(seq, enzymes, is_circular=is_circular)
+    except ConfigError:
+        return ()
+
+    return tuple(sorted((len(x) for x in products if x), reverse=True))
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+
+"""\
+Screen primers for primer dimers and hairpins.
+
+The biggest risk posed by primers that anneal to each other (or to
+themselves) is that the polymerase will extend them, so only structures
+involving the 3' end of a primer are considered.  For each primer, the
+longest run of bases at its 3' end that is perfectly complementary to any
+part of each other primer is found, and the stability of the resulting duplex
+is estimated using nearest-neighbor free energies.
+
+All the primers that will share a tube are compared at once, using a
+complementarity matrix with one element for every combination of primer,
+partner, and alignment.  This makes it possible to screen hundreds of primers
+(i.e. tens of thousands of pairs) in a fraction of a second.
+"""
+
+import numpy as np
+import autoprop
+import freezerbox
+
+from dataclasses import dataclass
+from ._primers import encode_seq
+from ._melting_temp import calc_stack_dgs, calc_init_dgs
+
+# Duplexes involving the 3' end of a primer are reported if they are more
+# stable than these thresholds.  The free energy of a hairpin doesn't account
+# for the loop, so the threshold for hairpins is stricter.
+MAX_DIMER_DG_KCAL_MOL = -6.0
+MAX_HAIRPIN_DG_KCAL_MOL = -7.0
+
+# The shortest loop a hairpin can physically have.
+MIN_HAIRPIN_LOOP = 3
+
+# The number of bases at the 3' end of each primer to consider.  Longer runs
+# of complementarity are all equally bad, so there's no need to look further.
+WINDOW = 12
+
+@dataclass(frozen=True)
+class PrimerDimer:
+    """
+    A duplex formed between the 3' end of *primer* and some part of
+    *partner*, which may be the same primer.
+    """
+    primer: object
+    partner: object
+    length_bp: int
+    dg_kcal_mol: float
+
+@dataclass(frozen=True)
+class PrimerHairpin:
+    """
+    A duplex formed between the 3' end of *primer* and an upstream part of
+    the same primer.
+    """
+    primer: object
+    length_bp: int
+    dg_kcal_mol: float
+
+def screen_primers(
+        primers,
+        pairs=None, *,
+        max_dimer_dg_kcal_mol=MAX_DIMER_DG_KCAL_MOL,
+        max_hairpin_dg_kcal_mol=MAX_HAIRPIN_DG_KCAL_MOL,
+        min_hairpin_loop=MIN_HAIRPIN_LOOP,
+        window=WINDOW,
+):
+    """
+    Find any primer dimers or hairpins that could form between the given
+    primers.
+
+    The primers can be either sequences or objects with a `seq` attribute,
+    e.g. `Pcr.Primer`.  If *pairs* is given, it should be an iterable of
+    index pairs `(i, j)` specifying which primers will be in the same tube.
+    By default, every primer is assumed to be in the same tube.  Either way,
+    each primer is always checked against itself.
+
+    The return value is a tuple of two lists: the dimers and the hairpins,
+    each sorted from most to least stable.
+    """
+    primers = list(primers)
+    seqs = [
+            freezerbox.normalize_seq(x if isinstance(x, str) else x.seq)
+            for x in primers
+    ]
+    if not seqs:
+        return [], []
+
+    matrix = ComplementarityMatrix(seqs, window=window)
+
+    # Only compare the pairs of primers that will actually be in the same 
+    # tube.  When each reaction has its own primers, this is a small fraction 
+    # of all the possible pairs.
+    if pairs is None:
+        mask = np.ones((len(seqs), len(seqs)), dtype=bool)
+    else:
+        mask = np.eye(len(seqs), dtype=bool)
+        for i, j in pairs:
+            mask[i, j] = mask[j, i] = True
+
+    i, j = np.nonzero(mask)
+    dimer_lengths = matrix.get_pair_dimer_lengths(i, j)
+    dimer_dgs = matrix.get_dgs(dimer_lengths, i)
+    hits = dimer_dgs <= max_dimer_dg_kcal_mol
+
+    dimers = [
+            PrimerDimer(
+                primer=primers[i_],
+                partner=primers[j_],
+                length_bp=int(n),
+                dg_kcal_mol=float(dg),
+            )
+            for i_, j_, n, dg in zip(
+                i[hits], j[hits], dimer_lengths[hits], dimer_dgs[hits],
+            )
+    ]
+
+    hairpin_lengths = matrix.get_hairpin_lengths(min_hairpin_loop)
+    hairpin_dgs = matrix.get_dgs(hairpin_lengths)
+
+    hairpins = [
+            PrimerHairpin(
+                primer=primers[i],
+                length_bp=int(hairpin_lengths[i]),
+                dg_kcal_mol=float(hairpin_dgs[i]),
+            )
+            for i in np.nonzero(hairpin_dgs <= max_hairpin_dg_kcal_mol)[0]
+    ]
+
+    dimers.sort(key=lambda x: x.dg_kcal_mol)
+    hairpins.sort(key=lambda x: x.dg_kcal_mol)
+
+    return dimers, hairpins
+
+@autoprop
+class ComplementarityMatrix:
+    """
+    The complementarity between the 3' end of each primer and every position
+    of every primer.
+    """
+
+    def __init__(self, seqs, window=WINDOW):
+        self.seqs = seqs
+        self.window = w = window
+
+        n = self.lengths = np.array([len(x) for x in seqs])
+        width = n.max()
+
+        # The primers, left-aligned and padded so that every window of every
+        # primer can be compared to the 3' ends.  Unknown bases are given a
+        # different code than in the queries, so they never match.
+        codes = np.full((len(seqs), width + w), 4, dtype=np.uint8)
+        for i, seq in enumerate(seqs):
+            codes[i, :len(seq)] = encode_seq(seq, unknown=4)
+
+        # The reverse complement of the 3' end of each primer.  The first
+        # base is complementary to the last base of the primer.
+        queries = np.full((len(seqs), w), 5, dtype=np.uint8)
+        for i, seq in enumerate(seqs):
+            tail = encode_seq(seq[-w:], unknown=5)[::-1]
+            queries[i, :len(tail)] = np.where(tail < 4, 3 - tail, 5)
+
+        self._codes = codes
+        self._queries = queries
+        self._windows = np.lib.stride_tricks.sliding_window_view(
+                codes, w, axis=1,
+        )[:, :width]
+
+        # The free energy of the duplex formed by the last *k* bases of each
+        # primer, indexed by k.  Duplexes of fewer than 2 bases don't count.
+        stacks = np.cumsum(calc_stack_dgs(queries), axis=1)
+        dgs = np.zeros((len(seqs), w + 1))
+        dgs[:, 2:] = stacks + calc_init_dgs(queries[:, :1]) \
+                + calc_init_dgs(queries[:, 1:])
+        self._dgs = dgs
+
+    def get_dimer_lengths(self):
+        """
+        Return a matrix where element (i, j) is the number of bases at the 3'
+        end of primer i that can anneal to primer j.
+        """
+        num_seqs, width, w = self._windows.shape
+        lengths = np.zeros((num_seqs, num_seqs), dtype=np.int64)
+
+        # Limit how many primers are compared at once, to bound the amount of
+        # memory needed for the comparison.
+        chunk = max(1, 2**24 // (num_seqs * width * w))
+
+        for i in range(0, num_seqs, chunk):
+            queries = self._queries[i:i+chunk]
+
+            # Shape: (queries, primers, positions, bases)
+            matches = queries[:, None, None, :] == self._windows[None]
+            runs = np.logical_and.accumulate(matches, axis=3).sum(axis=3)
+            lengths[i:i+chunk] = runs.max(axis=2)
+
+        return lengths
+
+    def get_pair_dimer_lengths(self, i, j):
+        """
+        Return an array where element k is the number of bases at the 3' end
+        of primer `i[k]` that can anneal to primer `j[k]`.
+
+        This is equivalent to indexing the matrix returned by
+        `get_dimer_lengths()`, but only does the work for the given pairs.
+        """
+        i = np.asarray(i)
+        j = np.asarray(j)
+        num_seqs, width, w = self._windows.shape
+        lengths = np.zeros(len(i), dtype=np.int64)
+
+        chunk = max(1, 2**24 // (width * w))
+
+        for k in range(0, len(i), chunk):
+            queries = self._queries[i[k:k+chunk]]
+            windows = self._windows[j[k:k+chunk]]
+
+            # Shape: (pairs, positions, bases)
+            matches = queries[:, None, :] == windows
+            runs = np.logical_and.accumulate(matches, axis=2).sum(axis=2)
+            lengths[k:k+chunk] = runs.max(axis=1)
+
+        return lengths
+
+    def get_hairpin_lengths(self, min_loop=MIN_HAIRPIN_LOOP):
+        """
+        Return an array with the number of bases at the 3' end of each primer
+        that can anneal to an upstream part of the same primer.
+        """
+        num_seqs, width, w = self._windows.shape
+
+        # Shape: (primers, positions, bases)
+        matches = self._queries[:, None, :] == self._windows
+        runs = np.logical_and.accumulate(matches, axis=2).sum(axis=2)
+
+        # The upstream part of the primer can't overlap the 3' end, and the
+        # two must be separated by a loop.
+        j = np.arange(width)
+        max_runs = (self.lengths[:, None] - j - min_loop) // 2
+        runs = np.minimum(runs, np.maximum(max_runs, 0))
+
+        return runs.max(axis=1)
+
+    def get_dgs(self, lengths, primers=None):
+        """
+        Return the free energies of the duplexes formed by the given numbers
+        of bases at the 3' end of each primer.
+
+        By default, the first dimension of *lengths* must correspond to the
+        primers.  Alternatively, *primers* can give the index of the primer
+        for each element of *lengths*.
+        """
+        lengths = np.asarray(lengths)
+
+        if primers is None:
+            primers = np.arange(len(self.seqs))
+            primers = primers.reshape(-1, *[1] * (lengths.ndim - 1))
+
+        return self._dgs[primers, lengths]
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+"""\
+Pack reactions with different annealing temperatures onto gradient blocks.
+
+A gradient thermocycler can hold each column of its block at a different
+temperature, so reactions with different annealing temperatures can share a
+run as long as each one lands in a column that's close enough to its ideal
+temperature.  The columns are assumed to be evenly spaced between the lowest
+and highest temperatures of the gradient, which is how most instruments
+program them.  The actual column temperatures can deviate slightly from this,
+so it's worth checking them against the instrument's display.
+
+Runs are packed greedily, from the lowest remaining temperature up.  For each
+run, every combination of gradient span and offset is tried, and the one that
+fits the most reactions is kept.  When the capacity of the columns isn't the
+limiting factor, this is the same as the classic greedy algorithm for covering
+points with intervals, which gives the minimum number of runs.
+"""
+
+import numpy as np
+
+from math import ceil, floor
+from dataclasses import dataclass
+
+@dataclass(frozen=True)
+class GradientBlock:
+    """
+    The geometry of a gradient thermocycler block.
+
+    The gradient runs across the columns, and each column holds *num_rows*
+    reactions.  *max_span_C* is the largest temperature difference the
+    instrument can maintain between the first and last columns.
+    """
+    num_columns: int = 12
+    num_rows: int = 8
+    max_span_C: float = 20
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Create a block from a dictionary, e.g. part of a preset.
+        """
+        if isinstance(config, cls):
+            return config
+        return cls(
+                num_columns=int(config.get('num_columns', cls.num_columns)),
+                num_rows=int(config.get('num_rows', cls.num_rows)),
+                max_span_C=float(config.get('max_span_C', cls.max_span_C)),
+        )
+
+@dataclass(frozen=True)
+class GradientRun:
+    """
+    One thermocycler run.
+
+    *column_temps_C* has an entry for every column in the block, even those
+    that are empty.  *columns* maps each column index to the indices of the
+    reactions in that column.
+    """
+    low_temp_C: float
+    high_temp_C: float
+    column_temps_C: tuple
+    columns: dict
+
+    @property
+    def is_gradient(self):
+        return self.high_temp_C > self.low_temp_C
+
+    @property
+    def reactions(self):
+        return sorted(i for x in self.columns.values() for i in x)
+
+def pack_gradient_runs(temps_C, block=GradientBlock(), tolerance_C=1, step_C=0.5):
+    """
+    Assign each of the given annealing temperatures to a column of a gradient
+    run, using as few runs as possible.
+
+    Every reaction ends up in a column that's within *tolerance_C* of its
+    ideal temperature.  Gradient temperatures are chosen in increments of
+    *step_C*.  The runs are returned in order of increasing temperature.
+    """
+    temps = np.asarray(temps_C, dtype=float)
+
+    if np.isnan(temps).any():
+        raise ValueError("annealing temperatures must not be NaN")
+    if tolerance_C < 0:
+        raise ValueError(f"tolerance must not be negative: {tolerance_C}")
+    if block.num_columns < 1 or block.num_rows < 1:
+        raise ValueError(f"block must have at least one well: {block}")
+
+    n = block.num_columns
+    spans = np.arange(0, block.max_span_C + step_C / 2, step_C) if n > 1 else [0]
+
+    todo = np.argsort(temps, kind='stable')
+    runs = []
+
+    while len(todo):
+        t0 = temps[todo[0]]
+        best = None
+
+        for low in _pick_low_temps(t0, tolerance_C):
+            for span in spans:
+                col_temps = np.round(low + span * np.arange(n) / max(n - 1, 1), 1)
+                columns, error = _fill_columns(
+                        temps, todo, col_temps, block.num_rows, tolerance_C,
+                )
+                num_packed = sum(len(x) for x in columns.values())
+                key = num_packed, -error, -span
+
+                if best is None or key > best[0]:
+                    best = key, col_temps, columns
+
+        (num_packed, *_), col_temps, columns = best
+
+        # This can only happen if the tolerance is so small that the 
+        # temperature can't be rounded to 0.1°C.  Use the exact temperature, 
+        # rather than giving up.
+        if not num_packed:
+            col_temps = np.full(n, t0)
+            columns = {0: [int(todo[0])]}
+
+        # The gradient is programmed from the first column to the last, even 
+        # if some columns (including the ends) are empty, because that's what 
+        # determines the temperatures of the columns in between.
+        runs.append(GradientRun(
+                low_temp_C=float(col_temps[0]),
+                high_temp_C=float(col_temps[-1]),
+                column_temps_C=tuple(float(x) for x in col_temps),
+                columns=columns,
+        ))
+
+        packed = {i for x in columns.values() for i in x}
+        todo = np.array([i for i in todo if i not in packed], dtype=int)
+
+    return runs
+
+def _pick_low_temps(t0, tolerance_C):
+    # The first column has to be within the tolerance of the lowest 
+    # temperature, which is the next reaction that needs to be packed.  Try 
+    # putting the lowest temperature at the middle, the edge, and halfway in 
+    # between, rounded to the nearest 0.1°C within the tolerance.
+    lo = ceil(round((t0 - tolerance_C) * 10, 6)) / 10
+    hi = floor(round((t0 + tolerance_C) * 10, 6)) / 10
+
+    return sorted({
+            min(max(round(t0 + x, 1), lo), hi)
+            for x in (0, tolerance_C / 2, tolerance_C)
+    })
+
+def _fill_columns(temps, todo, col_temps, capacity, tolerance_C):
+    # Only the reactions that could possibly reach one of the columns need to
+    # be considered.  *todo* is sorted by temperature, so these are a prefix.
+    reach = np.searchsorted(temps[todo], col_temps[-1] + tolerance_C, 'right')
+    todo = todo[:reach]
+
+    dist = np.abs(temps[todo, None] - col_temps[None, :])
+    order = np.argsort(dist, axis=1, kind='stable')
+    counts = np.zeros(len(col_temps), dtype=int)
+    columns = {}
+    error = 0
+    room = capacity * len(col_temps)
+
+    # Put each reaction in the closest column that still has room.
+    for k, i in enumerate(todo):
+        if not room:
+            break
+        for j in order[k]:
+            if dist[k, j] > tolerance_C + 1e-9:
+                break
+            if counts[j] < capacity:
+                counts[j] += 1
+                room -= 1
+                columns.setdefault(int(j), []).append(int(i))
+                error += dist[k, j]
+                break
+
+    return columns, error
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+"""\
+Calculate primer melting temperatures using the nearest-neighbor model.
+
+The thermodynamic parameters are the unified DNA/DNA parameters from
+SantaLucia & Hicks (2004), and the salt correction is the one from Owczarzy
+et al. (2008), which accounts for both monovalent and divalent cations.  This
+is the same model that most vendor Tm calculators use, and the results agree
+with `Bio.SeqUtils.MeltingTemp.Tm_NN(..., nn_table=DNA_NN3, saltcorr=7)`.
+
+Melting temperatures are usually needed for many primers at once (e.g. when
+setting up dozens of PCR reactions), so the calculation is vectorized over
+arrays of sequences.  Results are also memoized, because the same primers
+tend to be used over and over again.
+"""
+
+import numpy as np
+
+from dataclasses import dataclass
+from Bio.SeqUtils.MeltingTemp import DNA_NN3
+from ._primers import encode_seq
+
+@dataclass(frozen=True)
+class MeltingTempConditions:
+    """
+    The reaction conditions that affect primer melting temperatures.
+
+    All ion concentrations are millimolar.  The monovalent cation
+    concentration includes both Na⁺ and K⁺, and the dNTP concentration is the
+    total of all four dNTPs (since dNTPs chelate Mg²⁺).  The primer
+    concentration is nanomolar, and is assumed to be in large excess over the
+    template.
+    """
+    monovalent_mM: float = 50
+    mg_mM: float = 0
+    dntp_mM: float = 0
+    primer_nM: float = 500
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Create conditions from a dictionary, e.g. part of a preset.
+        """
+        if isinstance(config, cls):
+            return config
+        return cls(**{k: float(v) for k, v in config.items()})
+
+def calc_melting_temp_C(seq, conditions=MeltingTempConditions()):
+    """
+    Return the melting temperature of the given primer, or raise a
+    `ValueError` if it can't be calculated.
+    """
+    tm, = calc_melting_temps_C([seq], conditions)
+
+    if np.isnan(tm):
+        raise ValueError(f"can't calculate melting temperature: {seq!r}")
+
+    return float(tm)
+
+def calc_melting_temps_C(seqs, conditions=MeltingTempConditions()):
+    """
+    Return an array of the melting temperatures of the given primers.
+
+    The result is NaN for any primer with fewer than 2 bases, or with bases
+    other than A, C, G, and T.  Melting temperatures are cached, so only
+    primers that haven't been seen before (with the same conditions) are
+    actually calculated.
+    """
+    seqs = [x.upper() for x in seqs]
+    todo = list({
+            x: None for x in seqs
+            if (x, conditions) not in _melting_temp_cache
+    })
+
+    if todo:
+        tms = _calc_melting_temps_C(todo, conditions)
+        _melting_temp_cache.update(
+                ((seq, conditions), float(tm))
+                for seq, tm in zip(todo, tms)
+        )
+
+    return np.array(
+            [_melting_temp_cache[x, conditions] for x in seqs],
+            dtype=float,
+    )
+
+def calc_stack_dgs(codes, temp_C=37):
+    """
+    Return the free energy (kcal/mol) of each nearest-neighbor stack in the
+    given sequences.
+
+    The sequences must be encoded as in `_primers.encode_seq()`, with 4
+    marking padding (or any other base that can't pair).  The result has one
+    fewer column than the input, and stacks involving padding have no free
+    energy.
+    """
+    codes = np.minimum(codes, 4)
+    pairs = 5 * codes[..., :-1] + codes[..., 1:]
+    return _NN_DH[pairs] - (temp_C + 273.15) * _NN_DS[pairs] / 1000
+
+def calc_init_dgs(codes, temp_C=37):
+    """
+    Return the initiation free energy (kcal/mol) contributed by each of the
+    given terminal bases, encoded as in `calc_stack_dgs()`.
+    """
+    codes = np.asarray(codes)
+    at = np.isin(codes, _AT)
+    gc = np.isin(codes, _GC)
+    t = temp_C + 273.15
+
+    def dg(key):
+        dh, ds = DNA_NN3[key]
+        return dh - t * ds / 1000
+
+    return at * dg('init_A/T') + gc * dg('init_G/C')
+
+def calc_encoded_melting_temps_C(codes, lengths, conditions=MeltingTempConditions()):
+    """
+    Return an array of the melting temperatures of the given primers, which
+    must already be encoded as in `_primers.encode_seq()`.
+
+    Each row of *codes* is one primer, with the bases left-aligned and any
+    remaining columns filled with 4.  This is for callers that already have
+    encoded sequences (e.g. every window of a template), so it skips both the
+    encoding and the cache.  The result is NaN for any primer with fewer than
+    2 bases, or with unknown bases (i.e. codes greater than 4).
+    """
+    codes = np.array(codes, dtype=np.uint8, ndmin=2)
+    n = np.asarray(lengths)
+    width = codes.shape[1]
+
+    valid = (n >= 2) & ((codes < 4) | (np.arange(width) >= n[:, None])).all(axis=1)
+    codes[codes > 4] = 4
+
+    # Sum the parameters for each nearest-neighbor pair.
+    pairs = 5 * codes[:, :-1] + codes[:, 1:]
+    dh = _NN_DH[pairs].sum(axis=1)
+    ds = _NN_DS[pairs].sum(axis=1)
+
+    # Initiation parameters depend on whether the terminal base pairs are A·T
+    # or G·C.
+    rows = np.arange(len(codes))
+    first = codes[:, 0]
+    last = codes[rows, np.maximum(n - 1, 0)]
+    num_at = np.isin(first, _AT).astype(int) + np.isin(last, _AT)
+    num_gc = 2 - num_at
+
+    dh += DNA_NN3['init_A/T'][0] * num_at + DNA_NN3['init_G/C'][0] * num_gc
+    ds += DNA_NN3['init_A/T'][1] * num_at + DNA_NN3['init_G/C'][1] * num_gc
+
+    # Primers are assumed to be in excess over the template, and not to be
+    # self-complementary.
+    R = 1.987
+    k = conditions.primer_nM * 1e-9
+    tm = (1000 * dh) / (ds + R * np.log(k))
+
+    gc = np.isin(codes, _GC).sum(axis=1) / np.maximum(n, 1)
+    tm = 1 / (1 / tm + _calc_salt_correction(gc, n, conditions))
+
+    tm -= 273.15
+    tm[~valid] = np.nan
+    return tm
+
+def _calc_melting_temps_C(seqs, conditions):
+    n = np.array([len(x) for x in seqs])
+    width = max(n.max(), 2)
+
+    # Pad the sequences to the same length.  Code 4 marks padding and has no
+    # parameters, so it contributes nothing to the sums.
+    codes = np.full((len(seqs), width), 4, dtype=np.uint8)
+    for i, seq in enumerate(seqs):
+        codes[i, :len(seq)] = encode_seq(seq, unknown=5)
+
+    return calc_encoded_melting_temps_C(codes, n, conditions)
+
+def _calc_salt_correction(gc, n, conditions):
+    # Owczarzy et al. (2008), Biochemistry 47:5336.  The correction is to
+    # 1/Tm, and depends on the GC content and length of each primer.
+    mon = conditions.monovalent_mM * 1e-3
+    mg = conditions.mg_mM * 1e-3
+    dntps = conditions.dntp_mM * 1e-3
+
+    a, b, c, d = 3.92, -0.911, 6.26, 1.42
+    e, f, g = -48.2, 52.5, 8.31
+
+    # dNTPs bind Mg²⁺, so calculate how much Mg²⁺ is free.
+    if dntps > 0:
+        ka = 3e4
+        x = ka * dntps - ka * mg + 1
+        mg = (-x + np.sqrt(x**2 + 4 * ka * mg)) / (2 * ka)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if mon > 0:
+            ratio = np.sqrt(mg) / mon
+
+            # Monovalent ions dominate.
+            if ratio < 0.22:
+                log_mon = np.log(mon)
+                return (4.29 * gc - 3.95) * 1e-5 * log_mon + 9.40e-6 * log_mon**2
+
+            # Both monovalent and divalent ions matter.
+            if ratio < 6:
+                log_mon = np.log(mon)
+                a = 3.92 * (0.843 - 0.352 * np.sqrt(mon) * log_mon)
+                d = 1.42 * (1.279 - 4.03e-3 * log_mon - 8.03e-3 * log_mon**2)
+                g = 8.31 * (0.486 - 0.258 * log_mon + 5.25e-3 * log_mon**3)
+
+        # Divalent ions dominate.
+        log_mg = np.log(mg)
+        return (
+                a + b * log_mg
+                + gc * (c + d * log_mg)
+                + (e + f * log_mg + g * log_mg**2) / (2 * (n - 1))
+        ) * 1e-5
+
+def _make_nn_tables():
+    # Index the parameters by `5 * first + second`, where the bases are
+    # encoded as A=0, C=1, G=2, T=3, and 4 is padding.
+    bases = 'ACGT'
+    complement = str.maketrans('ACGT', 'TGCA')
+    dh = np.zeros(25)
+    ds = np.zeros(25)
+
+    for i, x in enumerate(bases):
+        for j, y in enumerate(bases):
+            top = x + y
+            bottom = top.translate(complement)
+            key = f'{top}/{bottom}'
+            if key not in DNA_NN3:
+                key = f'{bottom[::-1]}/{top[::-1]}'
+
+            dh[5 * i + j], ds[5 * i + j] = DNA_NN3[key]
+
+    return dh, ds
+
+_NN_DH, _NN_DS = _make_nn_tables()
+_AT = [0, 3]
+_GC = [1, 2]
+_melting_temp_cache = {}
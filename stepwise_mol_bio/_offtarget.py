@@ -0,0 +1,616 @@
+#!/usr/bin/env python3
+
+"""\
+Find every template in the FreezerBox database that a primer pair amplifies.
+
+The predictions use the same rule as `find_amplicon()` in `pcr.py`: a primer
+is assumed to anneal wherever the last 15 bases of its sequence are perfectly
+complementary to the template.  That rule only requires exact k-mer lookups,
+so every k-mer of every template in the database can be indexed ahead of time.
+Scanning a primer pair against the index then takes a handful of binary
+searches, no matter how many templates there are.
+
+Building the index is the slow part, so it's stored on disk (in the same cache
+directory as the rendered protocols) and updated incrementally.  Each database
+record is identified by a hash of its fields, and each sequence by a hash of
+its contents, so only records that have been added or modified since the last
+scan need to be indexed again.
+"""
+
+import os
+import json
+import shutil
+import byoc
+import hashlib
+import stepwise
+import freezerbox
+import numpy as np
+
+from dataclasses import dataclass
+from pathlib import Path
+from uuid import uuid4
+from Bio.Seq import reverse_complement
+from byoc import DocoptConfig
+from inform import error
+from more_itertools import unique_everseen
+
+from .pcr import Pcr
+from ._primers import encode_seq
+from ._utils import app_dirs, ConfigError, StepwiseMolBioError
+from ._cache import CacheConfig, fingerprint_reagent, find_freezerbox_seq_paths
+from ._server import fingerprint_paths
+
+# The number of bases at the 3' end of each primer that must match the
+# template, as assumed by `find_amplicon()`.  Each k-mer is packed into a
+# 32-bit integer (2 bits per base), which limits k to 15.
+KMER_LEN = 15
+
+# Windows containing ambiguous bases are given a code that no real k-mer can
+# have, so that they never match anything.
+INVALID_KMER = np.uint32(0xFFFFFFFF)
+
+# Polymerases can't make arbitrarily long products, so primers that anneal
+# very far apart aren't considered to make an amplicon.
+MAX_LENGTH_BP = 20_000
+
+@dataclass(frozen=True)
+class OffTargetAmplicon:
+    """
+    An amplicon predicted for a primer pair on one of the templates in the
+    database.
+
+    The *start* and *end* attributes give the region of the top strand of the
+    template between the 3' ends of the two primers (inclusive of the
+    annealed bases).  For circular templates, *end* is less than *start* if
+    the amplicon spans the origin.  The *fwd* and *rev* attributes are the
+    primers (as given to `OffTargetIndex.find_amplicons()`) that anneal to
+    the top and bottom strands, respectively.  They may be the same primer.
+    """
+    template: str
+    fwd: object
+    rev: object
+    start: int
+    end: int
+    length_bp: int
+
+class OffTargetIndex:
+    """
+    The positions of every k-mer in every template in a FreezerBox database.
+
+    Use `OffTargetIndex.from_config()` to get an index that is persisted in
+    the user's cache directory.  Call `update()` with a database before
+    calling `find_amplicons()`.
+    """
+
+    def __init__(self, root=None):
+        # If *root* is None, the index is only kept in memory.
+        self.root = Path(root) if root else None
+        self.num_indexed = 0
+
+        self._manifest = {}
+        self._kmers = {}
+        self._arrays = None
+
+    @classmethod
+    def from_config(cls):
+        """
+        Return an index stored in the user's cache directory, or one that is
+        only kept in memory if caching is disabled.
+        """
+        if os.environ.get('STEPWISE_MOL_BIO_NO_CACHE'):
+            return cls()
+
+        if not CacheConfig().enabled:
+            return cls()
+
+        return cls(Path(app_dirs.user_cache_dir) / 'offtarget')
+
+    def update(self, db):
+        """
+        Make sure that every template in the given database is indexed.
+
+        Records that haven't changed since the last update are not loaded
+        from the database at all, and sequences that have already been
+        indexed (e.g. because a record was only renamed) are not indexed
+        again.  The number of sequences that were indexed is stored in the
+        `num_indexed` attribute.
+        """
+        manifest = self._manifest or self._load_manifest()
+        prev_records = manifest.get('records', {})
+
+        # Sequences may be lazily loaded from files that aren't referenced
+        # by the record fields, so if any of those files changed, every
+        # sequence needs to be reloaded (but not necessarily reindexed).
+        seq_paths = repr(fingerprint_paths(find_freezerbox_seq_paths(db.config)))
+        same_seq_paths = manifest.get('seq_paths') == seq_paths
+
+        records = {}
+        self.num_indexed = 0
+
+        for tag, reagent in db.items():
+            if not is_template(reagent):
+                continue
+
+            fingerprint = hash_str(fingerprint_reagent(reagent))
+            prev = prev_records.get(tag)
+
+            if prev and same_seq_paths \
+                    and prev['fingerprint'] == fingerprint \
+                    and self._has_kmers(prev['seq_hash']):
+                records[tag] = {**prev}
+                continue
+
+            try:
+                seq, is_circular = load_template(reagent)
+            except freezerbox.Error:
+                continue
+
+            seq_hash = hash_str(f'{is_circular}:{seq}')
+
+            if not self._has_kmers(seq_hash):
+                self._save_kmers(seq_hash, encode_kmers(seq, is_circular))
+                self.num_indexed += 1
+
+            records[tag] = {
+                    'fingerprint': fingerprint,
+                    'seq_hash': seq_hash,
+                    'length': len(seq),
+                    'circular': is_circular,
+            }
+
+        self._update_index(manifest, records)
+
+        self._manifest = {
+                **self._manifest,
+                'seq_paths': seq_paths,
+                'records': records,
+        }
+        self._save_manifest()
+        self._prune_indices()
+        self._prune_kmers({x['seq_hash'] for x in records.values()})
+
+    def _update_index(self, manifest, records):
+        # Each template is given a permanent id in the index.  When templates
+        # are added, removed, or modified, the index is updated by removing
+        # the sites of the old templates and merging in the sites of the new
+        # ones, which is much faster than sorting every k-mer again.
+        prev_records = manifest.get('records', {})
+        templates = list(manifest.get('templates', []))
+        arrays = self._arrays or self._load_index(manifest.get('index'))
+
+        if arrays is None:
+            prev_records = {}
+            templates = []
+            arrays = _empty_index()
+
+        removed = []
+        added = []
+
+        for tag, prev in prev_records.items():
+            curr = records.get(tag)
+            if not curr or curr['seq_hash'] != prev['seq_hash']:
+                removed.append(prev['id'])
+
+        for tag, curr in records.items():
+            prev = prev_records.get(tag)
+            if prev and curr['seq_hash'] == prev['seq_hash']:
+                curr['id'] = prev['id']
+            else:
+                curr['id'] = len(templates)
+                templates.append(None)
+                added.append(tag)
+
+        for i in removed:
+            templates[i] = None
+        for tag in added:
+            curr = records[tag]
+            templates[curr['id']] = [tag, curr['length'], curr['circular']]
+
+        if removed or added or self._arrays is None:
+            # Start over if most of the ids belong to deleted templates.
+            if templates.count(None) > len(records):
+                self._arrays = None
+                for curr in records.values():
+                    curr.pop('id')
+                return self._update_index({}, records)
+
+            if removed:
+                live = np.ones(len(templates), dtype=bool)
+                live[removed] = False
+                arrays = _filter_index(arrays, live[arrays[1]])
+
+            if added:
+                ids = [records[tag]['id'] for tag in added]
+                kmers = [self._load_kmers(records[tag]['seq_hash']) for tag in added]
+                arrays = _merge_index(arrays, _make_index(ids, kmers))
+
+            index = self._save_index(arrays) if (removed or added) \
+                    else manifest.get('index')
+
+            self._manifest = {'templates': templates, 'index': index}
+            self._arrays = arrays
+
+    def find_amplicons(self, primer_1, primer_2, *, max_length_bp=MAX_LENGTH_BP):
+        """
+        Return every amplicon that the given primers are predicted to make
+        from any template in the database, ordered by template and position.
+
+        The primers can be either sequences or objects with a `seq`
+        attribute, e.g. `Pcr.Primer`.  Amplicons made by a single primer
+        annealing to both strands are included, since those products are
+        just as real.
+        """
+        primers = list(unique_everseen([primer_1, primer_2]))
+        seqs = [get_primer_seq(x) for x in primers]
+        fwd_sites = []
+        rev_sites = []
+
+        for i, seq in enumerate(seqs):
+            # Like `find_amplicon()`, only the top strand is indexed.  Sites
+            # on the bottom strand are found by looking up the reverse
+            # complement of the primer.
+            fwd_sites.append(self._lookup(seq[-KMER_LEN:]))
+            rev_sites.append(self._lookup(reverse_complement(seq)[:KMER_LEN]))
+
+        templates = self._manifest['templates']
+        amplicons = []
+
+        for i, (fwd_records, fwd_positions) in enumerate(fwd_sites):
+            for j, (rev_records, rev_positions) in enumerate(rev_sites):
+                shared = np.intersect1d(fwd_records, rev_records)
+                overhang = len(seqs[i]) + len(seqs[j]) - KMER_LEN
+
+                for record in shared:
+                    tag, n, is_circular = templates[record]
+                    starts = fwd_positions[fwd_records == record].astype(np.int64)
+                    ends = rev_positions[rev_records == record].astype(np.int64)
+
+                    # Same as `find_amplicon()`: the amplicon includes the
+                    # template between the starts of the two k-mers, plus 
+                    # the whole sequence of each primer outside the k-mers.
+                    spans = ends[None, :] - starts[:, None]
+                    if is_circular:
+                        spans[spans < 0] += n
+
+                    lengths = spans + overhang
+                    ok = (spans > 0) & (lengths <= max_length_bp)
+
+                    for a, b in zip(*np.nonzero(ok)):
+                        end = int(ends[b]) + KMER_LEN
+                        if is_circular and end > n:
+                            end -= n
+
+                        amplicons.append(
+                                OffTargetAmplicon(
+                                    template=tag,
+                                    fwd=primers[i],
+                                    rev=primers[j],
+                                    start=int(starts[a]),
+                                    end=end,
+                                    length_bp=int(lengths[a, b]),
+                                )
+                        )
+
+        amplicons.sort(key=lambda x: (x.template, x.start, x.end))
+        return amplicons
+
+    def _lookup(self, kmer):
+        index_kmers, index_records, index_positions = self._arrays
+        code = encode_kmers(kmer, False)[0]
+        lo = np.searchsorted(index_kmers, code, 'left')
+        hi = np.searchsorted(index_kmers, code, 'right')
+
+        return (
+                np.asarray(index_records[lo:hi]),
+                np.asarray(index_positions[lo:hi]),
+        )
+
+    def _load_manifest(self):
+        if not self.root:
+            return {}
+        try:
+            return json.loads((self.root / 'manifest.json').read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self):
+        if not self.root:
+            return
+        self._write_atomic(
+                self.root / 'manifest.json',
+                json.dumps(self._manifest).encode(),
+        )
+
+    def _has_kmers(self, seq_hash):
+        if not self.root:
+            return seq_hash in self._kmers
+        return self._get_kmers_path(seq_hash).exists()
+
+    def _load_kmers(self, seq_hash):
+        if not self.root:
+            return self._kmers[seq_hash]
+        return np.load(self._get_kmers_path(seq_hash))
+
+    def _save_kmers(self, seq_hash, kmers):
+        if not self.root:
+            self._kmers[seq_hash] = kmers
+            return
+        path = self._get_kmers_path(seq_hash)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._write_atomic(path, _npy_bytes(kmers))
+
+    def _prune_kmers(self, seq_hashes):
+        if not self.root:
+            self._kmers = {k: v for k, v in self._kmers.items() if k in seq_hashes}
+            return
+        for path in (self.root / 'kmers').glob('*.npy'):
+            if path.stem not in seq_hashes:
+                path.unlink(missing_ok=True)
+
+    def _get_kmers_path(self, seq_hash):
+        return self.root / 'kmers' / f'{seq_hash}.npy'
+
+    def _load_index(self, index):
+        if not self.root or not index:
+            return None
+
+        # Memory-map the index, so that a scan only needs to read the pages
+        # touched by the binary searches.
+        try:
+            return tuple(
+                    np.load(self.root / f'index-{index}' / f'{x}.npy', mmap_mode='r')
+                    for x in ['kmers', 'records', 'positions']
+            )
+        except (OSError, ValueError):
+            return None
+
+    def _save_index(self, arrays):
+        if not self.root:
+            return None
+
+        # Write each version of the index to a new directory, so that the
+        # manifest never refers to a partially written index.
+        index = uuid4().hex
+        names = ['kmers', 'records', 'positions']
+
+        for name, array in zip(names, arrays):
+            path = self.root / f'index-{index}' / f'{name}.npy'
+            self._write_atomic(path, _npy_bytes(array))
+
+        return index
+
+    def _prune_indices(self):
+        if not self.root:
+            return
+
+        curr = f"index-{self._manifest.get('index')}"
+
+        for dir in self.root.glob('index-*'):
+            if dir.name != curr:
+                shutil.rmtree(dir, ignore_errors=True)
+
+    @staticmethod
+    def _write_atomic(path, data):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(path.name + '.tmp')
+        tmp_path.write_bytes(data)
+        tmp_path.replace(path)
+
+class OffTargetScan(byoc.App):
+    """\
+Find every template in the FreezerBox database that a primer pair amplifies.
+
+Usage:
+    molbio-offtarget <primer_1> <primer_2> [-l <bp>]
+
+Arguments:
+    <primer_1> <primer_2>
+        The names of two primers in the FreezerBox database, e.g. o1 and o2.
+
+Options:
+    -l --max-length <bp>        [default: 20000]
+        Ignore amplicons that are longer than the given length.
+
+Every plasmid and linear DNA fragment with a sequence in the database is
+considered a potential template.  Primers are predicted to anneal wherever the
+last 15 bases of their sequences are perfectly complementary to a template,
+just like when the product sequence of a PCR reaction is calculated.  The
+intended product of the primers will be reported along with any off-target
+products.
+
+The templates are indexed the first time this command is run, which can take
+a while for large databases.  The index is stored in the cache directory and
+updated incrementally, so subsequent scans are fast.
+"""
+
+    __config__ = [
+            DocoptConfig,
+    ]
+
+    primer_1 = byoc.param('<primer_1>')
+    primer_2 = byoc.param('<primer_2>')
+    max_length_bp = byoc.param('--max-length', cast=int, default=MAX_LENGTH_BP)
+
+    def __init__(self, db, primer_1, primer_2):
+        self.db = db
+        self.primer_1 = primer_1
+        self.primer_2 = primer_2
+
+    @classmethod
+    def main(cls):
+        app = cls.from_bare()
+        app.db = freezerbox.load_db()
+        byoc.load(app, DocoptConfig)
+
+        try:
+            app.primer_1 = Pcr.Primer(app.primer_1, db=app.db)
+            app.primer_2 = Pcr.Primer(app.primer_2, db=app.db)
+            print(app.format_amplicons(app.find_amplicons()))
+        except (
+                StepwiseMolBioError,
+                freezerbox.QueryError,
+                byoc.NoValueFound,
+        ) as err:
+            error(err)
+
+    def find_amplicons(self):
+        index = OffTargetIndex.from_config()
+        index.update(self.db)
+        return index.find_amplicons(
+                self.primer_1,
+                self.primer_2,
+                max_length_bp=self.max_length_bp,
+        )
+
+    @staticmethod
+    def format_amplicons(amplicons):
+        if not amplicons:
+            return "No amplicons found."
+
+        rows = [
+                (x.template, x.fwd, x.rev, x.start, x.end, x.length_bp)
+                for x in amplicons
+        ]
+        header = ['template', 'fwd', 'rev', 'start', 'end', 'length (bp)']
+        return stepwise.tabulate(rows, header, align='<<<>>>')
+
+def is_template(reagent):
+    """
+    Return true if the given reagent could be amplified by PCR, i.e. if it's
+    a DNA molecule with an explicitly specified sequence.
+
+    Sequences that are only implied by a reagent's synthesis steps aren't
+    considered, because calculating them would require simulating every
+    protocol in the database.  Oligos aren't considered either, since primers
+    annealing to each other is a different problem.
+    """
+    return (
+            isinstance(reagent, freezerbox.NucleicAcid) and
+            not isinstance(reagent, freezerbox.Oligo) and
+            'seq' in reagent._attrs
+    )
+
+def load_template(reagent):
+    seq = reagent._attrs['seq']
+
+    # Sequences may be lazily loaded, e.g. from SnapGene files.
+    if callable(seq):
+        seq = seq()
+
+    if not seq:
+        raise freezerbox.QueryError("no sequence specified", culprit=reagent)
+
+    return freezerbox.normalize_seq(seq), bool(reagent.is_circular)
+
+def encode_kmers(seq, is_circular):
+    """
+    Return an array with the code of the k-mer starting at each position of
+    the given sequence.
+
+    Circular sequences have one k-mer for each position, including those that
+    span the origin.  Linear sequences only have k-mers for the positions that
+    are at least k bases from the end.  The code of any k-mer that contains an
+    ambiguous base is `INVALID_KMER`.
+    """
+    k = KMER_LEN
+    codes = encode_seq(seq, unknown=4).astype(np.uint32)
+
+    if is_circular:
+        codes = np.concatenate([codes, codes[:k-1]])
+
+    n = len(codes) - k + 1
+    if n <= 0:
+        return np.empty(0, dtype=np.uint32)
+
+    # Build the k-mers one base at a time, rather than making a window for
+    # each position, so that long genomic sequences don't need much memory.
+    kmers = np.zeros(n, dtype=np.uint32)
+    unknown = np.zeros(n, dtype=bool)
+
+    for i in range(k):
+        window = codes[i:i+n]
+        kmers = (kmers << np.uint32(2)) | (window & np.uint32(3))
+        unknown |= window > 3
+
+    kmers[unknown] = INVALID_KMER
+    return kmers
+
+def count_kmers(seq, is_circular):
+    """
+    Return the number of times the k-mer starting at each position of the
+    given sequence appears anywhere in the sequence, on either strand.
+
+    K-mers with ambiguous bases are given a count of 0, since they can't be
+    used as primers anyway.
+    """
+    top = encode_kmers(seq, is_circular)
+    bottom = encode_kmers(reverse_complement(seq), is_circular)
+
+    kmers, counts = np.unique(np.concatenate([top, bottom]), return_counts=True)
+    top_counts = counts[np.searchsorted(kmers, top)]
+    top_counts[top == INVALID_KMER] = 0
+
+    return top_counts
+
+def get_primer_seq(primer):
+    seq = primer if isinstance(primer, str) else primer.seq
+    seq = freezerbox.normalize_seq(seq)
+
+    if len(seq) < KMER_LEN:
+        err = ConfigError(primer=primer, seq=seq, k=KMER_LEN)
+        err.brief = "{primer}: primer too short to scan for off-target amplicons"
+        err.info += "sequence: {seq}"
+        err.hints += "primers must be at least {k} nt long"
+        raise err
+
+    return seq
+
+def _make_index(ids, kmers):
+    """
+    Return sorted arrays of the k-mers, template ids, and positions for the
+    given templates.
+    """
+    sizes = [len(x) for x in kmers]
+    offsets = np.cumsum([0, *sizes], dtype=np.uint64)
+    all_kmers = np.concatenate([np.empty(0, dtype=np.uint32), *kmers])
+
+    # Sorting the k-mers together with their positions (packed into the same
+    # 64-bit integer) is several times faster than `argsort()`.
+    keys = all_kmers.astype(np.uint64) << np.uint64(32)
+    keys |= np.arange(len(all_kmers), dtype=np.uint64)
+    keys = keys[all_kmers != INVALID_KMER]
+    keys.sort()
+
+    i = keys & np.uint64(0xFFFFFFFF)
+    j = np.repeat(np.arange(len(sizes)), sizes)[i]
+
+    return (
+            (keys >> np.uint64(32)).astype(np.uint32),
+            np.asarray(ids, dtype=np.uint32)[j],
+            (i - offsets[j]).astype(np.uint32),
+    )
+
+def _merge_index(index_1, index_2):
+    if not len(index_1[0]):
+        return index_2
+
+    at = np.searchsorted(index_1[0], index_2[0])
+    return tuple(np.insert(a, at, b) for a, b in zip(index_1, index_2))
+
+def _filter_index(index, mask):
+    return tuple(np.asarray(a)[mask] for a in index)
+
+def _empty_index():
+    return tuple(np.empty(0, dtype=np.uint32) for _ in range(3))
+
+def hash_str(x):
+    return hashlib.sha256(x.encode()).hexdigest()
+
+def _npy_bytes(array):
+    from io import BytesIO
+    buffer = BytesIO()
+    np.save(buffer, np.ascontiguousarray(array), allow_pickle=False)
+    return buffer.getvalue()
+
+if __name__ == '__main__':
+    OffTargetScan.main()
@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+
+import byoc
+import autoprop
+import stepwise
+import freezerbox
+
+from freezerbox import LoadError, QueryError, group_by_cleanup
+from freezerbox.stepwise.make import iter_protocols, label_makers, label_products
+from byoc import DocoptConfig
+from inform import error
+from ._utils import ConfigError, StepwiseMolBioError
+from ._server import warm_configs
+
+@autoprop
+class BuildPlan(byoc.App):
+    """\
+Display a protocol for making the given reagents, in stages.
+
+Usage:
+    molbio-plan <tags>... [-R] [-x <tags>]
+
+Arguments:
+    <tags>
+        The names of any number of reagents in the FreezerBox database, e.g.
+        p01 or f01.  Any other reagents that are needed to make the named
+        reagents and that are marked as "not ready" in the database will also
+        be included in the plan.
+
+Options:
+    -R --no-recurse
+        Only make the reagents specified on the command line; don't
+        automatically include dependencies that are marked as "not ready" in
+        the database.
+
+    -x --exclude <tags>
+        A comma-separated list of tags to exclude from the plan, i.e.
+        dependencies that would normally be included but should be excluded for
+        some idiosyncratic reason.
+
+This is an alternative to `freezerbox make` that scales to large numbers of
+reagents.  The reagents are arranged into stages according to their
+dependencies: the first stage includes every reagent that doesn't depend on
+any other reagent in the plan, the second stage includes every reagent that
+only depends on reagents from the first stage, and so on.  Within each stage,
+all the reagents made by the same protocol (e.g. all the PCRs) are made
+together, and the resulting protocol has one section per stage.
+"""
+
+    __config__ = [
+            DocoptConfig,
+    ]
+
+    tags = byoc.param('<tags>', default_factory=list)
+    recurse_deps = byoc.param('--no-recurse', cast=lambda x: not x, default=True)
+    exclude_deps = byoc.param(
+            '--exclude',
+            cast=lambda x: frozenset(x.split(',')),
+            default=frozenset(),
+    )
+
+    def __init__(self, db, tags=None):
+        self.db = db
+        self.tags = tags or []
+
+    def __bareinit__(self):
+        self._deps = {}
+        self._depths = {}
+
+    @classmethod
+    def main(cls):
+        app = cls.from_bare()
+        byoc.load(app, DocoptConfig)
+
+        try:
+            app.db = freezerbox.load_db()
+            app.protocol.print()
+        except (StepwiseMolBioError, LoadError, QueryError) as err:
+            error(err)
+
+    def add_targets(self, tags):
+        """
+        Add more reagents to the plan.
+
+        The dependencies and depths of each reagent are remembered, so plans
+        can be built up incrementally without repeating any work.  This also
+        means that the `recurse_deps` and `exclude_deps` settings shouldn't be
+        changed after the plan has been used.
+        """
+        self.tags = [*self.tags, *tags]
+
+    def get_dependencies(self, tag):
+        """
+        Return the tags of the reagents that need to be made before the given
+        reagent, i.e. those dependencies that aren't ready or excluded.
+
+        This is calculated only once for each reagent, since finding the
+        dependencies of a reagent requires instantiating its maker.
+        """
+        try:
+            return self._deps[tag]
+        except KeyError:
+            pass
+
+        deps = []
+
+        if self.recurse_deps:
+            try:
+                dep_tags = self.db[tag].dependencies
+            except QueryError:
+                dep_tags = []
+
+            for dep_tag in sorted(dep_tags):
+                if dep_tag in self.exclude_deps:
+                    continue
+                try:
+                    dep = self.db[dep_tag]
+                except QueryError:
+                    continue
+                if not dep.ready:
+                    deps.append(dep_tag)
+
+        self._deps[tag] = deps = tuple(deps)
+        return deps
+
+    def get_depth(self, tag):
+        """
+        Return the length of the longest chain of dependencies that must be
+        made before the given reagent.
+
+        The graph is traversed iteratively, so there's no limit on how long
+        the dependency chains can be.
+        """
+        depths = self._depths
+        stack = [(tag, ())]
+
+        while stack:
+            node, path = stack[-1]
+
+            if node in depths:
+                stack.pop()
+                continue
+
+            pending = [
+                    x for x in self.get_dependencies(node)
+                    if x not in depths
+            ]
+            if not pending:
+                depths[node] = 1 + max(
+                        (depths[x] for x in self.get_dependencies(node)),
+                        default=-1,
+                )
+                stack.pop()
+                continue
+
+            for dep in pending:
+                if dep in path or dep == node:
+                    raise ConfigError(
+                            "dependency cycle: {cycle}",
+                            cycle=' → '.join(map(str, [*path, node, dep])),
+                    )
+
+                stack.append((dep, (*path, node)))
+
+        return depths[tag]
+
+    def get_targets(self):
+        """
+        Return the tags of every reagent in the plan, in the order they were
+        discovered.
+        """
+        targets = {}
+        queue = [x for x in self.tags if x not in self.exclude_deps]
+
+        while queue:
+            tag = queue.pop(0)
+            if tag in targets:
+                continue
+            targets[tag] = None
+            queue += self.get_dependencies(tag)
+
+        return list(targets)
+
+    def get_stages(self):
+        """
+        Return a list of stages, where each stage is a list of the reagents
+        that can be made in parallel once every previous stage is complete.
+        """
+        stages = {}
+
+        # Finding dependencies requires instantiating a maker for every
+        # reagent, which would otherwise reload the config files every time.
+        with warm_configs():
+            for tag in self.targets:
+                depth = self.get_depth(tag)
+                stages.setdefault(depth, []).append(self.db[tag])
+
+        return [stages[k] for k in sorted(stages)]
+
+    def get_stage_protocols(self):
+        """
+        Return one protocol for each stage.
+        """
+        with warm_configs():
+            return [make_stage_protocol(x) for x in self.stages]
+
+    def get_protocol(self):
+        protocol = stepwise.Protocol()
+        for stage_protocol in self.stage_protocols:
+            protocol += stage_protocol
+        return protocol
+
+def make_stage_protocol(products):
+    """
+    Return a protocol for making the given products, none of which may depend
+    on any of the others.
+    """
+    protocol = stepwise.Protocol()
+    products = [x.make_intermediate(0) for x in products]
+    labels = label_makers(products)
+
+    for key, group in group_by_synthesis_key(products):
+        for makers, protocol_i in iter_protocols(key, group):
+            protocol += protocol_i
+            if any(getattr(x, 'label_products', True) for x in makers):
+                protocol += label_products(makers, labels)
+
+    parents = [x.parent for x in products]
+    for key, group in group_by_cleanup(parents):
+        for makers, protocol_i in iter_protocols(key, group):
+            protocol += protocol_i
+
+    return protocol
+
+def group_by_synthesis_key(products):
+    """
+    Group the given products by the protocol used to make them, in order of
+    first appearance.
+
+    This is only valid because none of the products depend on each other.
+    Otherwise, a (much more expensive) topological sort would be necessary.
+    """
+    groups = {}
+
+    for product in products:
+        key = product.synthesis_args.by_index[0]
+        groups.setdefault(key, []).append(product)
+
+    return groups.items()
+
+if __name__ == '__main__':
+    BuildPlan.main()
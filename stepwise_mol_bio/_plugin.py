@@ -0,0 +1,9 @@
+#!/usr/bin/env python3
+
+import stepwise
+from pathlib import Path
+
+class Plugin:
+    protocol_dir = Path(__file__).parent
+    config_path = protocol_dir / 'conf.toml'
+    priority = stepwise.Builtins.priority + 10
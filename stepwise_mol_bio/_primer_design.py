@@ -0,0 +1,561 @@
+#!/usr/bin/env python3
+
+"""\
+Design primers to amplify a region of a template.
+
+Every possible primer within some distance of the target region is considered
+at once.  The template is encoded as an array of integers, and each primer
+length is represented by a sliding-window view of that array, so properties
+like melting temperature, GC content, GC clamp, homopolymer runs, and
+uniqueness within the template are calculated for every candidate with a
+handful of array operations.  The best forward and reverse candidates are then
+combined into a matrix of primer pairs, which is scored and ranked the same
+way.  Only the top-ranked pairs are checked individually, for primer dimers.
+"""
+
+import stepwise, byoc
+import numpy as np
+import freezerbox
+
+from byoc import Key, DocoptConfig
+from stepwise import StepwiseConfig, PresetConfig
+from dataclasses import dataclass
+from Bio.Seq import reverse_complement
+from inform import error
+from stepwise_mol_bio import Pcr, UsageError, StepwiseMolBioError
+from ._primers import encode_seq
+from ._offtarget import count_kmers, KMER_LEN
+from ._melting_temp import MeltingTempConditions, calc_encoded_melting_temps_C
+from ._dimers import (
+        ComplementarityMatrix, screen_primers, MAX_HAIRPIN_DG_KCAL_MOL,
+)
+
+MIN_PRIMER_LEN = 18
+OPT_PRIMER_LEN = 20
+MAX_PRIMER_LEN = 25
+
+MIN_MELTING_TEMP_C = 55
+MAX_MELTING_TEMP_C = 65
+MAX_MELTING_TEMP_DIFF_C = 3
+
+MIN_GC_CONTENT = 0.3
+MAX_GC_CONTENT = 0.7
+
+# The number of G/C bases allowed in the last 5 bases of each primer.  At
+# least one helps the 3' end stay annealed; too many promote mispriming.
+MIN_GC_CLAMP = 1
+MAX_GC_CLAMP = 3
+
+# The longest run of a single base allowed in a primer.
+MAX_HOMOPOLYMER = 4
+
+# How far from the target region the primers can anneal.
+MAX_FLANK_BP = 250
+
+# The number of candidates on each side of the target that are paired with
+# each other.  This bounds the size of the pair matrix for long flanks.
+MAX_CANDIDATES = 500
+
+NUM_PAIRS = 5
+
+# Penalty weights.  The unit of the penalty is effectively °C of deviation
+# from the optimal melting temperature.
+_LENGTH_WEIGHT = 0.5
+_FLANK_WEIGHT = 0.01
+
+@dataclass(frozen=True)
+class PrimerPair:
+    """
+    A pair of primers designed to amplify a target region.
+
+    The *start* and *end* attributes give the region of the template that is
+    amplified, from the 5' end of the forward primer to the 5' end of the
+    reverse primer, numbered from 0 with *end* excluded.  For circular
+    templates, *end* is less than *start* if the amplicon spans the origin.
+    """
+    fwd: str
+    rev: str
+    fwd_melting_temp_C: float
+    rev_melting_temp_C: float
+    start: int
+    end: int
+    length_bp: int
+    penalty: float
+
+def design_primers(
+        template, start, end, *,
+        is_circular=False,
+        conditions=MeltingTempConditions(),
+        num_pairs=NUM_PAIRS,
+        min_len=MIN_PRIMER_LEN,
+        opt_len=OPT_PRIMER_LEN,
+        max_len=MAX_PRIMER_LEN,
+        min_tm_C=MIN_MELTING_TEMP_C,
+        max_tm_C=MAX_MELTING_TEMP_C,
+        max_tm_diff_C=MAX_MELTING_TEMP_DIFF_C,
+        max_flank_bp=MAX_FLANK_BP,
+):
+    """
+    Return the best primer pairs for amplifying the given region of the
+    template, sorted from best to worst.
+
+    The region is numbered from 0, with *end* excluded.  For circular
+    templates, the region may span the origin (i.e. *end* may be less than
+    *start*), but may not cover the whole template.  The primers must anneal
+    within *max_flank_bp* of the region, and must meet all of the following
+    criteria:
+
+    - Length between *min_len* and *max_len*.
+    - Melting temperature between *min_tm_C* and *max_tm_C*, calculated for
+      the given *conditions*.
+    - GC content between 30% and 70%.
+    - 1-3 G/C bases in the last 5 bases.
+    - No runs of more than 4 of the same base.
+    - The last 15 bases anneal nowhere else on the template, on either strand.
+    - No stable hairpins or primer dimers, see `screen_primers()`.
+
+    The primers in each pair must also have melting temperatures within
+    *max_tm_diff_C* of each other.  Pairs are ranked by a penalty that grows
+    as the melting temperatures deviate from the middle of the allowed range
+    and from each other, as the primer lengths deviate from *opt_len*, and as
+    the primers get farther from the target region.
+    """
+    seq = freezerbox.normalize_seq(template)
+    n = len(seq)
+
+    if not (0 <= start < n and 0 < end <= n):
+        raise ValueError(
+                f"region {start}-{end} not in template (length: {n} bp)")
+    if not is_circular and end <= start:
+        raise ValueError(f"region {start}-{end} is empty")
+    if min_len < KMER_LEN:
+        raise ValueError(f"primers must be at least {KMER_LEN} bp")
+
+    # Rotate circular templates so that the fwd primers are at the beginning,
+    # then treat them as linear.  The part of the template outside the target
+    # is split between the fwd and rev primers, so that neither can anneal
+    # where the other should.
+    target_len = (end - start) % n or n
+
+    if is_circular:
+        if target_len == n:
+            raise ValueError(f"region {start}-{end} covers the whole template")
+
+        gap = n - target_len
+        fwd_flank = min(max_flank_bp, gap // 2)
+        rev_flank = min(max_flank_bp, gap - gap // 2)
+        shift = (start - fwd_flank) % n
+    else:
+        fwd_flank = min(max_flank_bp, start)
+        rev_flank = min(max_flank_bp, n - end)
+        shift = 0
+
+    rotated = seq[shift:] + seq[:shift]
+    target_start = (start - shift) % n
+    target_end = target_start + target_len
+
+    kmer_counts = count_kmers(seq, is_circular)
+
+    def lookup_kmer_counts(i):
+        return kmer_counts[(i + shift) % n]
+
+    codes = encode_seq(rotated, unknown=5)
+    opt_tm_C = (min_tm_C + max_tm_C) / 2
+    tm_kwargs = dict(
+            conditions=conditions,
+            opt_len=opt_len,
+            opt_tm_C=opt_tm_C,
+            min_tm_C=min_tm_C,
+            max_tm_C=max_tm_C,
+    )
+
+    fwd = _Candidates.concat(
+            _find_candidates(
+                codes, 1,
+                positions=np.arange(
+                    target_start - fwd_flank,
+                    target_start - k + 1,
+                ),
+                length=k,
+                flank=lambda i: target_start - (i + k),
+                lookup_kmer_counts=(
+                    lambda i: lookup_kmer_counts(i + k - KMER_LEN)
+                ),
+                **tm_kwargs,
+            )
+            for k in range(min_len, max_len + 1)
+    )
+    rev = _Candidates.concat(
+            _find_candidates(
+                codes, -1,
+                positions=np.arange(
+                    target_end,
+                    target_end + rev_flank - k + 1,
+                ),
+                length=k,
+                flank=lambda j: j - target_end,
+                lookup_kmer_counts=lookup_kmer_counts,
+                **tm_kwargs,
+            )
+            for k in range(min_len, max_len + 1)
+    )
+
+    fwd = fwd.select_best(MAX_CANDIDATES).load_seqs(rotated).remove_hairpins()
+    rev = rev.select_best(MAX_CANDIDATES).load_seqs(rotated).remove_hairpins()
+
+    # Score every combination of forward and reverse candidates.
+    tm_diffs = abs(fwd.tms[:, None] - rev.tms[None, :])
+    penalties = fwd.penalties[:, None] + rev.penalties[None, :] + tm_diffs
+    penalties[tm_diffs > max_tm_diff_C] = np.inf
+
+    pairs = []
+    order = np.argsort(penalties, axis=None, kind='stable')
+
+    for i, j in zip(*np.unravel_index(order, penalties.shape)):
+        if len(pairs) >= num_pairs or np.isinf(penalties[i, j]):
+            break
+
+        # Most pairs are never considered, so only check for dimers once a
+        # pair is good enough to be returned.
+        dimers, _ = screen_primers([fwd.seqs[i], rev.seqs[j]])
+        if dimers:
+            continue
+
+        amplicon_start = fwd.positions[i]
+        amplicon_end = rev.positions[j] + rev.lengths[j]
+
+        pairs.append(
+                PrimerPair(
+                    fwd=fwd.seqs[i],
+                    rev=rev.seqs[j],
+                    fwd_melting_temp_C=float(fwd.tms[i]),
+                    rev_melting_temp_C=float(rev.tms[j]),
+                    start=int(amplicon_start + shift) % n,
+                    end=int(amplicon_end + shift - 1) % n + 1,
+                    length_bp=int(amplicon_end - amplicon_start),
+                    penalty=float(penalties[i, j]),
+                )
+        )
+
+    return pairs
+
+class PrimerDesign(byoc.App):
+    """\
+Design primers to amplify a region of a template.
+
+Usage:
+    molbio-design-primers <template> <start> <end> [options]
+
+Arguments:
+    <template>
+        The name of the template to amplify, e.g. p1.  This template must be in
+        the FreezerBox database, and must have a sequence.
+
+    <start> <end>
+        The first and last bases of the region to amplify, numbered from 1 (as
+        in most sequence viewers).  For circular templates, the region can span
+        the origin, i.e. <end> can be less than <start>.
+
+Options:
+    -n --num-pairs <int>            [default: 5]
+        The number of primer pairs to show.
+
+    -p --preset <name>
+        The PCR preset that the primers will be used with.  This determines
+        the reaction conditions used to calculate melting temperatures, and the
+        annealing temperature and extension time shown for each pair.  By
+        default, the same preset as the `pcr` protocol is used.
+
+    -t --melting-temp <range>       [default: 55-65]
+        The acceptable range of melting temperatures for the primers, in °C.
+
+    -l --primer-length <range>      [default: 18-25]
+        The acceptable range of lengths for the primers, in bp.
+
+    -f --max-flank <bp>             [default: 250]
+        How far from the region the primers can anneal.
+
+Candidate primers must have 30-70% GC content, 1-3 G/C bases in the last 5
+bases, and no runs of more than 4 of the same base.  The last 15 bases of each
+primer must not anneal anywhere else on the template, and the primers must not
+be predicted to form hairpins or dimers.  Pairs of primers must have melting
+temperatures within 3°C of each other, and are ranked by how close their
+melting temperatures are to the middle of the acceptable range, how close
+their lengths are to 20 bp, and how close they anneal to the region.
+"""
+
+    __config__ = [
+            DocoptConfig,
+            PresetConfig,
+            StepwiseConfig.setup(('molbio', 'pcr')),
+    ]
+
+    template = byoc.param('<template>')
+    start = byoc.param('<start>', cast=int)
+    end = byoc.param('<end>', cast=int)
+    num_pairs = byoc.param('--num-pairs', cast=int, default=NUM_PAIRS)
+    presets = byoc.param(
+            Key(StepwiseConfig, 'presets'),
+            pick=list,
+    )
+    preset = byoc.param(
+            Key(DocoptConfig, '--preset'),
+            Key(StepwiseConfig, 'default_preset'),
+    )
+    melting_temp_range_C = byoc.param(
+            Key(
+                DocoptConfig, '--melting-temp',
+                cast=lambda x: parse_range(x, float),
+            ),
+            default=(MIN_MELTING_TEMP_C, MAX_MELTING_TEMP_C),
+    )
+    melting_temp_conditions = byoc.param(
+            Key(PresetConfig, 'melting_temp'),
+            Key(StepwiseConfig, 'melting_temp'),
+            cast=MeltingTempConditions.from_config,
+            default=MeltingTempConditions(),
+    )
+    primer_length_range = byoc.param(
+            Key(
+                DocoptConfig, '--primer-length',
+                cast=lambda x: parse_range(x, int),
+            ),
+            default=(MIN_PRIMER_LEN, MAX_PRIMER_LEN),
+    )
+    max_flank_bp = byoc.param(
+            Key(DocoptConfig, '--max-flank', cast=int),
+            default=MAX_FLANK_BP,
+    )
+
+    def __init__(self, db, template, start, end):
+        self.db = db
+        self.template = template
+        self.start = start
+        self.end = end
+
+    @classmethod
+    def main(cls):
+        app = cls.from_bare()
+        app.db = freezerbox.load_db()
+        byoc.load(app, DocoptConfig)
+
+        try:
+            print(app.format_pairs(app.design_primers()))
+        except (
+                StepwiseMolBioError,
+                freezerbox.QueryError,
+                byoc.NoValueFound,
+        ) as err:
+            error(err)
+
+    def design_primers(self):
+        """
+        Return the best primer pairs for amplifying the region, see
+        `design_primers()`.
+        """
+        template = Pcr.Template(self.template, db=self.db)
+        min_tm_C, max_tm_C = self.melting_temp_range_C
+        min_len, max_len = self.primer_length_range
+
+        try:
+            return design_primers(
+                    template.seq,
+                    self.start - 1,
+                    self.end,
+                    is_circular=template.is_circular,
+                    conditions=self.melting_temp_conditions,
+                    num_pairs=self.num_pairs,
+                    min_len=min_len,
+                    opt_len=min(max(OPT_PRIMER_LEN, min_len), max_len),
+                    max_len=max_len,
+                    min_tm_C=min_tm_C,
+                    max_tm_C=max_tm_C,
+                    max_flank_bp=self.max_flank_bp,
+            )
+        except ValueError as err:
+            raise UsageError(str(err)) from None
+
+    def get_pcr(self, pair):
+        """
+        Return a `Pcr` protocol for the given primer pair.
+
+        The protocol uses the same preset as the primer design, so its
+        annealing temperature and extension time are the ones that should be
+        used with the primers.
+        """
+        amplicon = Pcr.Amplicon(
+                Pcr.Template(self.template),
+                Pcr.Primer(
+                    'fwd',
+                    seq=pair.fwd,
+                    melting_temp_C=pair.fwd_melting_temp_C,
+                ),
+                Pcr.Primer(
+                    'rev',
+                    seq=pair.rev,
+                    melting_temp_C=pair.rev_melting_temp_C,
+                ),
+                length_bp=pair.length_bp,
+        )
+        pcr = Pcr([amplicon])
+        pcr.db = self.db
+        pcr.preset = self.preset
+        return pcr
+
+    def format_pairs(self, pairs):
+        if not pairs:
+            return "No primer pairs found."
+
+        rows = []
+        for pair in pairs:
+            pcr = self.get_pcr(pair)
+            anneal_temp_C, = pcr.anneal_temp_C
+            rows.append((
+                pair.fwd,
+                pair.rev,
+                f'{pair.fwd_melting_temp_C:.1f}/{pair.rev_melting_temp_C:.1f}',
+                f'{pair.start + 1}-{pair.end}',
+                pair.length_bp,
+                f'{anneal_temp_C:.0f}°C',
+                f'{pcr.extend_time_s}s',
+                f'{pair.penalty:.2f}',
+            ))
+
+        header = [
+                'fwd', 'rev', 'Tm (°C)', 'amplicon', 'length (bp)',
+                'Ta', 'extend', 'penalty',
+        ]
+        return stepwise.tabulate(rows, header, align='<<>>>>>>')
+
+def parse_range(string, cast):
+    """
+    Parse a range of the form "<min>-<max>".
+    """
+    try:
+        lo, hi = map(cast, string.split('-'))
+    except ValueError:
+        raise UsageError(
+                f"expected a range like '55-65', not {string!r}") from None
+
+    if lo > hi:
+        raise UsageError(f"expected a range like '55-65', not {string!r}")
+
+    return lo, hi
+
+class _Candidates:
+    """
+    The properties of a set of candidate primers on one side of the target.
+
+    The primers are identified by their positions on the (rotated) template.
+    Forward primers are identical to the template at these positions;
+    reverse primers are complementary.  The sequences themselves are only
+    loaded for candidates that survive the initial filters.
+    """
+
+    def __init__(self, strand, positions, lengths, tms, penalties):
+        self.strand = strand
+        self.positions = positions
+        self.lengths = lengths
+        self.tms = tms
+        self.penalties = penalties
+        self.seqs = None
+
+    @classmethod
+    def concat(cls, candidates):
+        candidates = list(candidates)
+        return cls(
+                candidates[0].strand,
+                *(
+                    np.concatenate([getattr(x, attr) for x in candidates])
+                    for attr in ['positions', 'lengths', 'tms', 'penalties']
+                ),
+        )
+
+    def __len__(self):
+        return len(self.positions)
+
+    def take(self, indices):
+        subset = _Candidates(
+                self.strand,
+                self.positions[indices],
+                self.lengths[indices],
+                self.tms[indices],
+                self.penalties[indices],
+        )
+        if self.seqs is not None:
+            subset.seqs = [self.seqs[i] for i in indices]
+        return subset
+
+    def select_best(self, n):
+        if len(self) <= n:
+            return self
+        return self.take(np.argpartition(self.penalties, n)[:n])
+
+    def load_seqs(self, template):
+        self.seqs = [
+                template[i:i+k] if self.strand > 0 else
+                reverse_complement(template[i:i+k])
+                for i, k in zip(self.positions, self.lengths)
+        ]
+        return self
+
+    def remove_hairpins(self):
+        if not len(self):
+            return self
+
+        matrix = ComplementarityMatrix(self.seqs)
+        dgs = matrix.get_dgs(matrix.get_hairpin_lengths())
+        return self.take(np.nonzero(dgs > MAX_HAIRPIN_DG_KCAL_MOL)[0])
+
+def _find_candidates(
+        codes, strand, *,
+        positions, length, flank, lookup_kmer_counts,
+        conditions, opt_len, opt_tm_C, min_tm_C, max_tm_C,
+):
+    k = length
+
+    if len(positions) == 0:
+        empty = np.empty(0)
+        return _Candidates(strand, positions, positions, empty, empty)
+
+    # Shape: (candidates, bases)
+    windows = np.lib.stride_tricks.sliding_window_view(codes, k)[positions]
+
+    # Nearest-neighbor parameters are the same for both strands of a duplex,
+    # so the melting temperatures of the reverse primers can be calculated
+    # without taking the reverse complement.
+    tms = calc_encoded_melting_temps_C(
+            windows, np.full(len(windows), k), conditions)
+
+    is_gc = (windows == 1) | (windows == 2)
+    gc_content = is_gc.mean(axis=1)
+    gc_clamp = (is_gc[:, -5:] if strand > 0 else is_gc[:, :5]).sum(axis=1)
+
+    same_as_next = windows[:, 1:] == windows[:, :-1]
+    homopolymers = np.lib.stride_tricks.sliding_window_view(
+            same_as_next, MAX_HOMOPOLYMER, axis=1,
+    ).all(axis=2).any(axis=1)
+
+    ok = (
+            (tms >= min_tm_C) & (tms <= max_tm_C) &
+            (gc_content >= MIN_GC_CONTENT) & (gc_content <= MAX_GC_CONTENT) &
+            (gc_clamp >= MIN_GC_CLAMP) & (gc_clamp <= MAX_GC_CLAMP) &
+            ~homopolymers &
+            (lookup_kmer_counts(positions) == 1)
+    )
+
+    positions = positions[ok]
+    tms = tms[ok]
+    penalties = (
+            abs(tms - opt_tm_C) +
+            _LENGTH_WEIGHT * abs(k - opt_len) +
+            _FLANK_WEIGHT * flank(positions)
+    )
+
+    return _Candidates(
+            strand,
+            positions,
+            np.full(len(positions), k),
+            tms,
+            penalties,
+    )
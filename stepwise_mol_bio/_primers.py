@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+
+"""\
+Predict where primers anneal, allowing for mismatches.
+
+`find_amplicon()` in `pcr.py` assumes that the last 15 bases of each primer
+are perfectly complementary to the template.  That's fast and usually right,
+but it fails for mutagenic primers and for templates that don't quite match
+the primers.  The functions in this module instead score ungapped alignments
+between the 3' end of each primer and every position on both strands of the
+template, and accept any site within a mismatch budget.
+
+The alignments are vectorized with NumPy: the template is encoded once as an
+array of integers, and every window of the template is compared to every
+primer (of the same length) in a single operation.  Gaps aren't considered,
+since they're rare in practice and can't be vectorized this way.
+"""
+
+import numpy as np
+import freezerbox
+
+from dataclasses import dataclass
+from functools import lru_cache
+from more_itertools import chunked
+from Bio.Seq import reverse_complement
+
+# The number of bases at the 3' end of each primer to align, and the maximum
+# number of mismatches that will be tolerated within those bases.
+ANNEAL_LEN = 20
+MAX_MISMATCHES = 3
+
+# The number of bases at the very 3' end of each primer that must match the
+# template exactly.  Polymerases rarely extend primers with mismatched 3' ends.
+MIN_3PRIME_MATCHES = 3
+
+@dataclass(frozen=True)
+class PrimerSite:
+    """
+    A position where the 3' end of a primer is predicted to anneal.
+
+    The *start* and *end* attributes refer to the region of the top strand of
+    the template that pairs with the aligned part of the primer.  For primers
+    that anneal to the bottom strand, this region is the reverse complement
+    of the primer.  For circular templates, *end* may exceed the length of the
+    template if the site spans the origin.
+    """
+    start: int
+    end: int
+    strand: int
+    mismatches: int
+
+@dataclass(frozen=True)
+class PrimerMatch:
+    """
+    An amplicon predicted from primers that may not perfectly match the
+    template.
+    """
+    seq: str
+    fwd_site: PrimerSite
+    rev_site: PrimerSite
+
+    @property
+    def mismatches(self):
+        return self.fwd_site.mismatches + self.rev_site.mismatches
+
+class PrimerSiteFinder:
+    """
+    Find the sites where primers anneal to a template.
+
+    Use `load_primer_site_finder()` to get a cached instance, so that each
+    template is only encoded once.
+    """
+
+    def __init__(self, template, is_circular=False):
+        self.seq = freezerbox.normalize_seq(template)
+        self.is_circular = is_circular
+        self._codes = encode_seq(self.seq, unknown=4)
+
+    def find_sites(
+            self,
+            primers, *,
+            anneal_len=ANNEAL_LEN,
+            **kwargs,
+    ):
+        """
+        Return a list of the sites where each of the given primers anneals,
+        sorted from fewest to most mismatches.
+
+        Only the last *anneal_len* bases of each primer are aligned.  Sites 
+        with more than *max_mismatches* mismatches, or with any mismatches in 
+        the last *min_3prime_matches* bases of the primer, are excluded.
+
+        Primers with the same length (after being trimmed to *anneal_len*) are
+        aligned to the template together, so scanning many primers against
+        the same template is fast.
+        """
+        primers = [freezerbox.normalize_seq(x) for x in primers]
+        sites = [[] for _ in primers]
+        by_len = {}
+
+        for i, primer in enumerate(primers):
+            n = min(len(primer), anneal_len, len(self.seq))
+            if n > 0:
+                by_len.setdefault(n, []).append(i)
+
+        for n, indices in by_len.items():
+            # Pad circular templates so that windows can span the origin.
+            codes = self._codes
+            if self.is_circular:
+                codes = np.concatenate([codes, codes[:n-1]])
+
+            windows = np.lib.stride_tricks.sliding_window_view(codes, n)
+
+            # Limit how many primers are aligned at once, to bound the amount 
+            # of memory needed for the comparison.
+            for chunk in chunked(indices, 32):
+                self._find_sites(sites, primers, chunk, n, windows, **kwargs)
+
+        for x in sites:
+            x.sort(key=lambda x: (x.mismatches, x.start, -x.strand))
+
+        return sites
+
+    def _find_sites(
+            self, sites, primers, indices, n, windows, *,
+            max_mismatches=MAX_MISMATCHES,
+            min_3prime_matches=MIN_3PRIME_MATCHES,
+    ):
+        # Both strands are searched by aligning the reverse complement of 
+        # each primer to the top strand.  For the reverse complement, the 3' 
+        # end of the primer is on the left.
+        queries = [primers[i][-n:] for i in indices]
+        queries += [reverse_complement(x) for x in queries]
+        codes = np.array([encode_seq(x, unknown=5) for x in queries])
+
+        # Shape: (queries, windows, bases)
+        mismatch_mask = windows[None, :, :] != codes[:, None, :]
+        mismatches = mismatch_mask.sum(axis=2)
+
+        k = min(min_3prime_matches, n)
+        m = len(indices)
+        end_mismatches = np.concatenate([
+                mismatch_mask[:m, :, n-k:].any(axis=2),
+                mismatch_mask[m:, :, :k].any(axis=2),
+        ])
+        ok = (mismatches <= max_mismatches) & ~end_mismatches
+
+        for q, w in zip(*np.nonzero(ok)):
+            sites[indices[q % m]].append(
+                    PrimerSite(
+                        start=int(w),
+                        end=int(w) + n,
+                        strand=1 if q < m else -1,
+                        mismatches=int(mismatches[q, w]),
+                    )
+            )
+
+    def find_amplicon(self, primer_1, primer_2, **kwargs):
+        """
+        Return the amplicon produced by the given primers, or raise a
+        `ValueError` if there isn't one.
+
+        The primer sites with the fewest mismatches are used.  The amplicon
+        incorporates the full sequence of each primer, including any
+        mismatches and 5' overhangs.
+        """
+        primer_1 = freezerbox.normalize_seq(primer_1)
+        primer_2 = freezerbox.normalize_seq(primer_2)
+        sites_1, sites_2 = self.find_sites([primer_1, primer_2], **kwargs)
+
+        candidates = []
+
+        for fwd, fwd_sites, rev, rev_sites in [
+                (primer_1, sites_1, primer_2, sites_2),
+                (primer_2, sites_2, primer_1, sites_1),
+        ]:
+            fwd_site = _first_on_strand(fwd_sites, 1)
+            rev_site = _first_on_strand(rev_sites, -1)
+
+            if not fwd_site or not rev_site:
+                continue
+
+            seq = self._join_primers(fwd, fwd_site, rev, rev_site)
+            if seq is not None:
+                candidates.append(PrimerMatch(seq, fwd_site, rev_site))
+
+        if not candidates:
+            raise ValueError("no amplicon found")
+
+        return min(candidates, key=lambda x: x.mismatches)
+
+    def _join_primers(self, fwd, fwd_site, rev, rev_site):
+        template = self.seq
+        i = fwd_site.start
+        j = rev_site.start
+
+        if j < i:
+            if not self.is_circular:
+                return None
+            j += len(template)
+
+        if i == j:
+            raise ValueError("primers bind same position")
+
+        # The part of the amplicon between the primers comes from the 
+        # template; everything else comes from the primers.
+        rev = reverse_complement(rev)
+        fwd_end = fwd_site.end
+
+        if fwd_end <= j:
+            return fwd + (template + template)[fwd_end:j] + rev
+        else:
+            return fwd + rev[fwd_end - j:]
+
+def _first_on_strand(sites, strand):
+    for site in sites:
+        if site.strand == strand:
+            return site
+    return None
+
+def encode_seq(seq, unknown):
+    """
+    Convert the given DNA sequence into an array of integers.
+
+    Unrecognized bases are all given the same *unknown* code.  Use different
+    codes for the template and the primer to prevent unrecognized bases from
+    ever matching each other.
+    """
+    codes = np.full(256, unknown, dtype=np.uint8)
+    for i, base in enumerate('ACGT'):
+        codes[ord(base)] = i
+
+    raw = np.frombuffer(seq.encode('ascii', 'replace'), dtype=np.uint8)
+    return codes[raw]
+
+@lru_cache(maxsize=128)
+def load_primer_site_finder(template, is_circular=False):
+    """
+    Return a (cached) site finder for the given template sequence.
+    """
+    return PrimerSiteFinder(template, is_circular)
@@ -2,16 +2,18 @@
 
 import stepwise
 import byoc
+import autoprop
 import sys, inspect, functools
 
-from . import StepwiseMolBioError, bind
+from . import StepwiseMolBioError, bind, group_by_fingerprint
 from byoc import Key, DocoptConfig
 from decopatch import function_decorator, DECORATED
 from inform import error
 from more_itertools import one, first
 from types import SimpleNamespace
-from freezerbox import load_db, group_by_identity
+from freezerbox import load_db
 from functools import cached_property
+from contextlib import contextmanager
 from reprfunc import repr_from_init
 
 # Group object:
@@ -53,7 +55,8 @@ class App(byoc.App):
     @cached_property
     def protocol(self):
         n = getattr(self, 'num_replicates', 1)
-        return self.Sample.make(n * self.samples)
+        with grouping_cache():
+            return self.Sample.make(n * self.samples)
 
     @cached_property
     def usage_vars(self):
@@ -135,17 +138,39 @@ def group_samples(*attrs, f=DECORATED):
     class NotFound(Exception):
         pass
 
-    def find_group(f, args, kwargs):
-        sig = inspect.signature(f)
-        try:
-            group_param = one(
-                    (k for k, v in sig.parameters.items()
-                    if v.annotation is Group),
-                    too_short=NotFound,
-                    too_long=TypeError("at most one parameter can be annotated as Group"),
-            )
-        except NotFound:
-            group_param = first(sig.parameters)
+    # Work out where the group argument is once, rather than every time the 
+    # function is called.  Planning functions tend to call each other a lot, 
+    # and `inspect.signature()` is relatively expensive.
+    sig = inspect.signature(f)
+    try:
+        group_param = one(
+                (k for k, v in sig.parameters.items()
+                if v.annotation is Group),
+                too_short=NotFound,
+                too_long=TypeError("at most one parameter can be annotated as Group"),
+        )
+    except NotFound:
+        group_param = first(sig.parameters)
+
+    positional_kinds = (
+            inspect.Parameter.POSITIONAL_ONLY,
+            inspect.Parameter.POSITIONAL_OR_KEYWORD,
+    )
+    if sig.parameters[group_param].kind in positional_kinds:
+        group_index = list(sig.parameters).index(group_param)
+    else:
+        group_index = None
+
+    def find_group(args, kwargs):
+        # Fast path: the group was passed positionally, so there's no need to 
+        # bind the arguments.
+        if group_index is not None and group_index < len(args):
+            i = group_index
+
+            def call_with_group(group):
+                return f(*args[:i], group, *args[i+1:], **kwargs)
+
+            return args[i], call_with_group
 
         bound_args = sig.bind(*args, **kwargs)
         group_arg = bound_args.arguments[group_param]
@@ -158,15 +183,25 @@ def group_samples(*attrs, f=DECORATED):
 
     @functools.wraps(f)
     def wrapper(*args, **kwargs):
-        group, call_with_group = find_group(f, args, kwargs)
+        group, call_with_group = find_group(args, kwargs)
         if not isinstance(group, Group):
             group = Group(group, [group])
         return call_with_group(group)
 
     def for_group_in(*args, **kwargs):
-        group, call_with_group = find_group(f, args, kwargs)
-        for subgroup in group_by_attrs(group, f.attrs):
-            yield call_with_group(subgroup)
+        group, call_with_group = find_group(args, kwargs)
+
+        # Any planning functions called for each subgroup will probably 
+        # regroup the same samples, so share one cache between all of them.  
+        # The results are collected before leaving the context manager, in 
+        # case the caller doesn't consume them right away.
+        with grouping_cache():
+            results = [
+                    call_with_group(subgroup)
+                    for subgroup in group_by_attrs(group, f.attrs)
+            ]
+
+        yield from results
 
     def concat(*args, **kwargs):
         return stepwise.Protocol.merge(*for_group_in(*args, **kwargs))
@@ -230,17 +265,109 @@ def group_samples(*attrs, f=DECORATED):
     return wrapper
 
 def group_by_attrs(items, attrs):
+    parent = items if isinstance(items, Group) else None
+    cache = _grouping_cache
+
+    if cache is None:
+        def by_attrs(item):
+            return {
+                    k: getattr_recursive(item, k)
+                    for k in attrs
+            }
+
+        for key, group in group_by_fingerprint(items, key=by_attrs):
+            yield Group(make_namespace_recursive(key), group, parent=parent)
+
+    else:
+        yield from cache.group_by_attrs(items, attrs, parent)
+
+@autoprop
+class GroupingCache:
+    """
+    Remember how samples were grouped, for the duration of one protocol.
+
+    Planning functions decorated with `@group_samples` often call each other, 
+    and each may regroup the same samples by overlapping sets of attributes.  
+    Resolving those attributes can be expensive (e.g. if they come from config 
+    files), so this cache keeps (i) the value of each attribute for each 
+    sample and (ii) the groups produced for each set of samples and 
+    attributes.  Samples are identified by identity, so they shouldn't be 
+    changed in ways that affect grouping while the cache is active.
+
+    Use the `grouping_cache()` context manager to activate a cache.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._values = {}
+        self._groups = {}
+
+        # Keep references to every sample and group used as a key, so that 
+        # their ids can't be reused by other objects.
+        self._objects = []
+
+    def group_by_attrs(self, items, attrs, parent=None):
+        items = list(items)
+        attrs = frozenset(attrs)
+        key = tuple(map(id, items)), id(parent), attrs
+
+        try:
+            groups = self._groups[key]
+        except KeyError:
+            self.misses += 1
+        else:
+            self.hits += 1
+            return groups
+
+        def by_attrs(item):
+            return {
+                    k: self.getattr(item, k)
+                    for k in attrs
+            }
+
+        self._groups[key] = groups = [
+                Group(make_namespace_recursive(k), group, parent=parent)
+                for k, group in group_by_fingerprint(items, key=by_attrs)
+        ]
+        self._objects += [items, parent]
+        return groups
+
+    def getattr(self, obj, attr):
+        key = id(obj), attr
+
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+
+        self._values[key] = value = getattr_recursive(obj, attr)
+        self._objects.append(obj)
+        return value
+
+    def get_hit_rate(self):
+        n = self.hits + self.misses
+        return self.hits / n if n else 0
+
+@contextmanager
+def grouping_cache():
+    """
+    Share one `GroupingCache` between every grouping that happens within the 
+    context manager.  If a cache is already active, it is reused.
+    """
+    global _grouping_cache
 
-    def by_attrs(item):
-        return {
-                k: getattr_recursive(item, k)
-                for k in attrs
-        }
+    if _grouping_cache is not None:
+        yield _grouping_cache
+        return
 
-    parent = item if isinstance(items, Group) else None
+    _grouping_cache = GroupingCache()
+    try:
+        yield _grouping_cache
+    finally:
+        _grouping_cache = None
 
-    for key, group in group_by_identity(items, key=by_attrs):
-        yield Group(make_namespace_recursive(key), group, parent=parent)
+_grouping_cache = None
 
 def make_namespace_recursive(attrs):
     ns = SimpleNamespace()
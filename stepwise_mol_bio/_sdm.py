@@ -0,0 +1,481 @@
+#!/usr/bin/env python3
+
+"""\
+Design primers for site-directed mutagenesis by inverse PCR.
+
+Each mutation is made with a pair of back-to-back primers, as in the NEB Q5
+site-directed mutagenesis kit.  The primers anneal to either side of the
+mutated region and point away from each other, so the PCR product is the whole
+plasmid minus any deleted bases.  Inserted or substituted bases are carried on
+the 5' tails of the primers.  The product is then circularized with a KLD
+reaction.
+
+Mutations are designed in batches, e.g. for a whole library of variants.  The
+template is encoded once, and the annealing regions of every allowed length
+for every mutation are gathered from it with index arithmetic.  That way, the
+melting temperatures for the whole library are calculated with a single
+vectorized call, and the best pair of lengths for each mutation is picked from
+a matrix of all the possible combinations.
+"""
+
+import re
+import stepwise, byoc, autoprop
+import numpy as np
+import freezerbox
+
+from byoc import Key, DocoptConfig
+from stepwise import StepwiseConfig, PresetConfig, pl, pre
+from dataclasses import dataclass
+from pathlib import Path
+from Bio.Seq import reverse_complement
+from inform import error
+from stepwise_mol_bio import (
+        Pcr, InversePcr, ConfigError, UsageError, StepwiseMolBioError,
+)
+from ._primers import encode_seq
+from ._offtarget import count_kmers, KMER_LEN
+from ._melting_temp import MeltingTempConditions, calc_encoded_melting_temps_C
+
+# The range of lengths considered for the part of each primer that anneals to
+# the template.  The minimum has to be at least as long as the k-mers used to
+# find primer sites (i.e. 15 bp), otherwise the amplicon can't be predicted.
+MIN_ANNEAL_LEN = 15
+MAX_ANNEAL_LEN = 40
+
+# The annealing regions of both primers should melt above this temperature,
+# and as close to it (and to each other) as possible.
+MIN_MELTING_TEMP_C = 60
+
+# The longest 5' tail that will be added to a single primer.  Longer inserts
+# are split between both primers.
+MAX_TAIL_LEN = 30
+
+@dataclass(frozen=True)
+class Mutation:
+    """
+    A change to a template sequence.
+
+    The bases from *start* to *end* (numbered from 0, with *end* excluded) are
+    replaced by *insert*.  Deletions have an empty insert, and insertions
+    have `start == end`.
+    """
+    name: str
+    start: int
+    end: int
+    insert: str = ''
+
+    @classmethod
+    def from_hgvs(cls, string, template=None):
+        """
+        Parse a mutation from a string in HGVS-like notation.
+
+        Bases are numbered from 1.  The following forms are understood:
+
+        - ``123A>G``: substitution
+        - ``123del``, ``123_125del``: deletion
+        - ``123_124insGGC``: insertion
+        - ``123delinsGG``, ``123_125delinsGG``: deletion-insertion
+
+        If a template is given, the reference base of each substitution is
+        checked against it.
+        """
+        m = re.fullmatch(
+                r'''
+                (?P<start>\d+)
+                (?:_(?P<end>\d+))?
+                (?:
+                    (?P<ref>[ACGT])>(?P<alt>[ACGT]) |
+                    (?P<delins>delins|del|ins)(?P<insert>[ACGT]*)
+                )
+                ''',
+                string.strip(),
+                flags=re.VERBOSE | re.IGNORECASE,
+        )
+        if not m:
+            err = ConfigError(mutation=string)
+            err.brief = "can't parse mutation: {mutation!r}"
+            err.hints += "expected e.g. '123A>G', '123_125del', '123_124insGGC', or '123_125delinsTT'"
+            raise err
+
+        i = int(m['start']) - 1
+        j = int(m['end'] or m['start'])
+        op = (m['delins'] or '').lower()
+        ref = (m['ref'] or '').upper()
+        insert = (m['alt'] or m['insert'] or '').upper()
+
+        def check(ok):
+            if not ok:
+                err = ConfigError(mutation=string)
+                err.brief = "invalid mutation: {mutation!r}"
+                raise err
+
+        check(i >= 0)
+
+        if ref:
+            check(m['end'] is None)
+            if template is not None and template[i:i+1].upper() != ref:
+                err = ConfigError(mutation=string, pos=i+1, ref=ref, actual=template[i:i+1])
+                err.brief = "{mutation!r}: expected {ref!r} at position {pos}, found {actual!r}"
+                raise err
+            return cls(string, i, i + 1, insert)
+
+        if op == 'ins':
+            # Insertions are between the two given positions.
+            check(m['end'] is not None and j == i + 2 and insert)
+            return cls(string, i + 1, i + 1, insert)
+
+        check(j > i)
+
+        if op == 'del':
+            check(not insert)
+            return cls(string, i, j)
+
+        check(insert)
+        return cls(string, i, j, insert)
+
+    def apply(self, template):
+        """
+        Return the sequence of the given template with this mutation.
+        """
+        return template[:self.start] + self.insert + template[self.end:]
+
+@dataclass(frozen=True)
+class MutagenicPrimers:
+    """
+    The back-to-back primers that make a mutation.
+
+    The forward primer anneals downstream of the mutation and the reverse
+    primer anneals upstream of it.  The melting temperatures are for the
+    annealing regions alone, i.e. not including any 5' tails.
+    """
+    mutation: Mutation
+    fwd: str
+    rev: str
+    fwd_anneal_len: int
+    rev_anneal_len: int
+    fwd_melting_temp_C: float
+    rev_melting_temp_C: float
+    length_bp: int
+
+def design_mutagenic_primers(
+        template,
+        mutations, *,
+        conditions=MeltingTempConditions(),
+        min_anneal_len=MIN_ANNEAL_LEN,
+        max_anneal_len=MAX_ANNEAL_LEN,
+        min_tm_C=MIN_MELTING_TEMP_C,
+        max_tail_len=MAX_TAIL_LEN,
+):
+    """
+    Design back-to-back primers for each of the given mutations.
+
+    The template is assumed to be circular, since inverse PCR doesn't make
+    sense otherwise.  The annealing region of each primer is between
+    *min_anneal_len* and *max_anneal_len* bases long.  For each mutation, the
+    pair of lengths is chosen such that both annealing regions melt above
+    *min_tm_C*, with a penalty for differences between the two melting
+    temperatures and for exceeding *min_tm_C*.  Lengths where the last 15
+    bases of the primer aren't unique within the template are avoided.  If
+    no pair of lengths meets these criteria, the pair with the highest
+    melting temperature is used.
+
+    Inserts up to *max_tail_len* bases are carried on the 5' end of the
+    forward primer.  Longer inserts are split between both primers.
+    """
+    seq = freezerbox.normalize_seq(template)
+    n = len(seq)
+    mutations = list(mutations)
+
+    if not mutations:
+        return []
+
+    for mutation in mutations:
+        if not (0 <= mutation.start <= mutation.end <= n):
+            err = ConfigError(mutation=mutation, length=n)
+            err.brief = "{mutation.name!r}: not in template (length: {length} bp)"
+            raise err
+        if len(mutation.insert) > 2 * max_tail_len:
+            err = ConfigError(mutation=mutation, max=2 * max_tail_len)
+            err.brief = "{mutation.name!r}: insert too long to add with primers"
+            err.hints += "the longest insert that can be added is {max} bp"
+            raise err
+
+    codes = encode_seq(seq, unknown=5)
+    kmer_counts = count_kmers(seq, is_circular=True)
+
+    starts = np.array([x.start for x in mutations])
+    ends = np.array([x.end for x in mutations])
+    lengths = np.arange(min_anneal_len, max_anneal_len + 1)
+    offsets = np.arange(max_anneal_len)
+
+    # Shape: (mutations, lengths, bases)
+    #
+    # The forward primers anneal to the bases starting at the end of the
+    # mutation, and the reverse primers anneal to the bases leading up to the
+    # start of the mutation.  Both windows are left-aligned, and positions
+    # past the end of each window are padded.
+    pad = offsets[None, None, :] >= lengths[None, :, None]
+    fwd_i = ends[:, None, None] + offsets[None, None, :]
+    rev_i = starts[:, None, None] - lengths[None, :, None] + offsets[None, None, :]
+
+    fwd_codes = np.where(pad, 4, np.take(codes, fwd_i, mode='wrap'))
+    rev_codes = np.where(pad, 4, np.take(codes, rev_i, mode='wrap'))
+
+    # Nearest-neighbor parameters are the same for both strands of a duplex,
+    # so the reverse primers don't need to be reverse-complemented.
+    num_mutations, num_lengths = len(mutations), len(lengths)
+    all_codes = np.concatenate([fwd_codes, rev_codes]).reshape(-1, max_anneal_len)
+    all_lengths = np.tile(lengths, 2 * num_mutations)
+    tms = calc_encoded_melting_temps_C(all_codes, all_lengths, conditions)
+    fwd_tms, rev_tms = tms.reshape(2, num_mutations, num_lengths)
+
+    # The 3' end of the forward primer moves downstream as it gets longer, and
+    # the 3' end of the reverse primer moves upstream.
+    fwd_unique = np.take(
+            kmer_counts,
+            ends[:, None] + lengths[None, :] - KMER_LEN,
+            mode='wrap',
+    ) == 1
+    rev_unique = np.take(
+            kmer_counts,
+            starts[:, None] - lengths[None, :],
+            mode='wrap',
+    ) == 1
+
+    # Shape: (mutations, fwd lengths, rev lengths)
+    f = fwd_tms[:, :, None]
+    r = rev_tms[:, None, :]
+    ok = (
+            (f >= min_tm_C) & (r >= min_tm_C) &
+            fwd_unique[:, :, None] & rev_unique[:, None, :]
+    )
+    penalties = abs(f - r) + 0.5 * ((f - min_tm_C) + (r - min_tm_C))
+    penalties = np.where(ok, penalties, np.inf)
+
+    fallback = -np.fmin(f, r)
+    fallback = np.where(np.isnan(fallback), np.inf, fallback)
+    penalties = np.where(
+            np.isinf(penalties).all(axis=(1, 2), keepdims=True),
+            fallback,
+            penalties,
+    )
+
+    best = penalties.reshape(num_mutations, -1).argmin(axis=1)
+    best_f, best_r = np.unravel_index(best, (num_lengths, num_lengths))
+
+    primers = []
+
+    for k, mutation in enumerate(mutations):
+        i, j = mutation.start, mutation.end
+        fwd_len = int(lengths[best_f[k]])
+        rev_len = int(lengths[best_r[k]])
+
+        fwd_anneal = _slice_circular(seq, j, j + fwd_len)
+        rev_anneal = reverse_complement(_slice_circular(seq, i - rev_len, i))
+
+        insert = mutation.insert
+        split = len(insert) // 2 if len(insert) > max_tail_len else 0
+
+        primers.append(
+                MutagenicPrimers(
+                    mutation=mutation,
+                    fwd=insert[split:] + fwd_anneal,
+                    rev=reverse_complement(insert[:split]) + rev_anneal,
+                    fwd_anneal_len=fwd_len,
+                    rev_anneal_len=rev_len,
+                    fwd_melting_temp_C=float(fwd_tms[k, best_f[k]]),
+                    rev_melting_temp_C=float(rev_tms[k, best_r[k]]),
+                    length_bp=n - (j - i) + len(insert),
+                )
+        )
+
+    return primers
+
+@autoprop
+class SiteDirectedMutagenesis(byoc.App):
+    """\
+Design primers for a library of mutations, and show the protocol for making
+them all by inverse PCR.
+
+Usage:
+    molbio-sdm <template> <mutations>... [options]
+    molbio-sdm <template> -f <path> [options]
+
+Arguments:
+    <template>
+        The name of the plasmid to mutate, e.g. p1.  This plasmid must be in
+        the FreezerBox database, and must have a sequence.
+
+    <mutations>
+        The mutations to make, in HGVS-like notation with bases numbered from
+        1.  The following forms are understood:
+
+            123A>G              substitution
+            123_125del          deletion
+            123_124insGGC       insertion
+            123_125delinsTT     deletion-insertion
+
+Options:
+    -f --file <path>
+        Read the mutations from the given file, one per line.  Blank lines
+        and lines starting with '#' are ignored.
+
+    -p --preset <name>
+        The PCR preset to use.  This determines the reaction conditions used
+        to calculate melting temperatures, along with the PCR protocol itself.
+
+    -t --melting-temp <°C>          [default: 60]
+        The minimum melting temperature for the annealing region of each
+        primer.  The annealing regions are made as short as possible while
+        still exceeding this temperature, so that every reaction can use the
+        same annealing temperature.
+
+The primers are named after the mutations, with '-F' and '-R' suffixes.  The
+forward primer anneals immediately downstream of each mutation and carries any
+inserted bases on its 5' end; the reverse primer anneals immediately upstream.
+Inserts longer than 30 bp are split between the two primers.
+"""
+
+    __config__ = [
+            DocoptConfig,
+            PresetConfig,
+            StepwiseConfig.setup(('molbio', 'pcr')),
+    ]
+
+    template = byoc.param('<template>')
+    mutations = byoc.param(
+            Key(DocoptConfig, '<mutations>'),
+            Key(DocoptConfig, '--file', cast=lambda x: read_mutations(x)),
+    )
+    presets = byoc.param(
+            Key(StepwiseConfig, 'presets'),
+            pick=list,
+    )
+    preset = byoc.param(
+            Key(DocoptConfig, '--preset'),
+            Key(StepwiseConfig, 'default_preset'),
+    )
+    min_melting_temp_C = byoc.param(
+            Key(DocoptConfig, '--melting-temp', cast=float),
+            default=MIN_MELTING_TEMP_C,
+    )
+    melting_temp_conditions = byoc.param(
+            Key(PresetConfig, 'melting_temp'),
+            Key(StepwiseConfig, 'melting_temp'),
+            cast=MeltingTempConditions.from_config,
+            default=MeltingTempConditions(),
+    )
+
+    def __init__(self, db, template, mutations):
+        self.db = db
+        self.template = template
+        self.mutations = mutations
+
+    @classmethod
+    def main(cls):
+        app = cls.from_bare()
+        app.db = freezerbox.load_db()
+        byoc.load(app, DocoptConfig)
+
+        try:
+            app.protocol.print()
+        except (
+                StepwiseMolBioError,
+                freezerbox.QueryError,
+                byoc.NoValueFound,
+        ) as err:
+            error(err)
+
+    def design_primers(self):
+        """
+        Return the primers for each mutation, see
+        `design_mutagenic_primers()`.
+        """
+        template = Pcr.Template(self.template, db=self.db)
+        seq = template.seq
+
+        mutations = [
+                x if isinstance(x, Mutation) else Mutation.from_hgvs(x, seq)
+                for x in self.mutations
+        ]
+        if not mutations:
+            raise UsageError("no mutations specified")
+
+        return design_mutagenic_primers(
+                seq, mutations,
+                conditions=self.melting_temp_conditions,
+                min_tm_C=self.min_melting_temp_C,
+        )
+
+    def get_inverse_pcr(self, primers):
+        """
+        Return a single `InversePcr` protocol (including the KLD step) that
+        makes all of the given mutations.
+        """
+        amplicons = [
+                Pcr.Amplicon(
+                    Pcr.Template(self.template),
+                    Pcr.Primer(
+                        f'{x.mutation.name}-F',
+                        seq=x.fwd,
+                        melting_temp_C=x.fwd_melting_temp_C,
+                    ),
+                    Pcr.Primer(
+                        f'{x.mutation.name}-R',
+                        seq=x.rev,
+                        melting_temp_C=x.rev_melting_temp_C,
+                    ),
+                    length_bp=x.length_bp,
+                )
+                for x in primers
+        ]
+
+        app = InversePcr(amplicons)
+        app.db = self.db
+        app.preset = self.preset
+
+        # The primers were all designed to melt at about the same temperature,
+        # so use a single annealing temperature that works for all of them.
+        # That way all the reactions can go in the same thermocycler run.
+        app.anneal_temp_C = round(min(
+                app.anneal_temp_func(x.fwd_melting_temp_C, x.rev_melting_temp_C)
+                for x in primers
+        ))
+
+        return app
+
+    def get_protocol(self):
+        primers = self.design_primers()
+        p = stepwise.Protocol()
+        p += pl(
+                "Order the following mutagenic primers:",
+                pre(self.format_primers(primers)),
+        )
+        p += self.get_inverse_pcr(primers).protocol
+        return p
+
+    @staticmethod
+    def format_primers(primers):
+        rows = []
+        for x in primers:
+            rows += [
+                (f'{x.mutation.name}-F', x.fwd, f'{x.fwd_melting_temp_C:.1f}'),
+                (f'{x.mutation.name}-R', x.rev, f'{x.rev_melting_temp_C:.1f}'),
+            ]
+
+        header = ['name', 'sequence', 'Tm (°C)']
+        return stepwise.tabulate(rows, header, align='<<>')
+
+def read_mutations(path):
+    """
+    Read mutations from a file with one mutation per line.
+    """
+    lines = Path(path).read_text().splitlines()
+    return [
+            x.strip() for x in lines
+            if x.strip() and not x.strip().startswith('#')
+    ]
+
+def _slice_circular(seq, i, j):
+    n = len(seq)
+    return ''.join(seq[k % n] for k in range(i, j))
@@ -0,0 +1,509 @@
+#!/usr/bin/env python3
+
+"""\
+Render protocols in a long-lived process, to avoid paying the startup costs
+(e.g. importing dependencies, loading the FreezerBox database, parsing config
+files) for every command.
+
+Usage:
+    molbio-server [-s <path>]
+
+Options:
+    -s --socket <path>
+        The path to the Unix socket that the server should listen on.  The
+        default is taken from the $STEPWISE_MOL_BIO_SOCKET environment
+        variable, or failing that, a file in the user cache directory.
+
+Use `molbio-client` to send commands to the server.  For example, the following
+two commands produce the same protocol, but the second is much faster if a
+server is already running:
+
+    $ stepwise pcr p1,o1,o2
+    $ molbio-client pcr p1,o1,o2
+
+The server reloads the FreezerBox database and any config files whenever they
+change on disk, so it can be left running indefinitely.
+"""
+
+# Only import standard library modules at the top level of this file.  The
+# client should start as quickly as possible, so anything that's only needed
+# by the server is imported within the relevant functions.
+
+import sys, os
+import json
+import socket
+
+from pathlib import Path
+from contextlib import contextmanager
+
+CLIENT_USAGE = """\
+Render a protocol using a running `molbio-server` process.
+
+Usage:
+    molbio-client [-s <path>] <command> [<args>...]
+
+Arguments:
+    <command>
+        The name of the protocol to render, e.g. `pcr` or `digest`.
+
+    <args>
+        Any arguments to pass to the protocol, exactly as they would be given
+        on the command line.
+
+Options:
+    -s --socket <path>
+        The path to the Unix socket that the server is listening on.  See
+        `molbio-server -h` for the default.
+
+If no server is listening on the given socket, the protocol will be rendered by
+the client itself.  The output will be the same either way, just slower.
+"""
+
+# Map the names of the protocol scripts to the classes that implement them.
+# The classes are identified by name, so that they can be looked up lazily.
+COMMANDS = {
+        'aliquot': 'Aliquot',
+        'anneal': 'Anneal',
+        'autoclave': 'Autoclave',
+        'digest': 'RestrictionDigest',
+        'direct_dilution': 'DirectDilution',
+        'dnase': 'Dnase',
+        'ethanol_precipitation': 'EthanolPrecipitation',
+        'gel': 'Gel',
+        'gibson': 'Gibson',
+        'golden_gate': 'GoldenGate',
+        'grow': 'Grow',
+        'invpcr': 'InversePcr',
+        'ivt': 'Ivt',
+        'ivtt': 'Ivtt',
+        'kld': 'Kld',
+        'laser_scanner': 'LaserScanner',
+        'ligate': 'Ligate',
+        'lyophilize': 'Lyophilize',
+        'miniprep': 'Miniprep',
+        'page_purify': 'PagePurify',
+        'pcr': 'Pcr',
+        'qpcr': 'Qpcr',
+        'reverse_transcribe': 'ReverseTranscribeCli',
+        'sequence': 'Sequence',
+        'serial_dilution': 'SerialDilution',
+        'spin_cleanup': 'SpinCleanup',
+        'stain': 'Stain',
+        'thermocycler': 'Thermocycler',
+        'transform': 'Transform',
+        'transilluminator': 'Transilluminator',
+        'trizol': 'Trizol',
+}
+
+def server_main():
+    import docopt
+
+    args = docopt.docopt(__doc__)
+    socket_path = Path(args['--socket'] or get_default_socket_path())
+    serve(socket_path)
+
+def client_main():
+    import docopt
+
+    args = docopt.docopt(CLIENT_USAGE, options_first=True)
+    socket_path = Path(args['--socket'] or get_default_socket_path())
+    argv = [args['<command>'], *args['<args>']]
+
+    status, stdout, stderr = request(
+            argv,
+            cwd=os.getcwd(),
+            text=sys.stdout.isatty(),
+            socket_path=socket_path,
+    )
+
+    sys.stderr.write(stderr)
+    sys.stdout.buffer.write(stdout)
+    sys.stdout.flush()
+    sys.exit(status)
+
+def get_default_socket_path():
+    # Don't use `app_dirs` from `_utils`, because importing that module would
+    # defeat the purpose of having a lightweight client.
+    from appdirs import AppDirs
+
+    if path := os.environ.get('STEPWISE_MOL_BIO_SOCKET'):
+        return Path(path)
+
+    return Path(AppDirs("stepwise_mol_bio").user_cache_dir) / 'server.sock'
+
+def request(argv, *, cwd=None, text=False, socket_path=None):
+    """
+    Render the protocol described by the given command-line arguments.
+
+    The protocol will be rendered by the server listening on the given socket,
+    if there is one, or by this process otherwise.  The return value is a
+    tuple of the exit status, the rendered protocol (as bytes), and any error
+    messages (as a string).  See `render_protocol()` for a description of the
+    *text* argument.
+    """
+    cwd = cwd or os.getcwd()
+    socket_path = socket_path or get_default_socket_path()
+    msg = {'argv': list(argv), 'cwd': str(cwd), 'text': text}
+
+    try:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(str(socket_path))
+
+    except (FileNotFoundError, ConnectionRefusedError):
+        sock.close()
+        return run_request(msg, DatabaseCache())
+
+    with sock:
+        return send_request(sock, msg)
+
+def send_request(sock, msg):
+    sock.sendall(json.dumps(msg).encode() + b'\n')
+    sock.shutdown(socket.SHUT_WR)
+
+    with sock.makefile('rb') as f:
+        header = json.loads(f.readline())
+        stdout = f.read()
+
+    return header['status'], stdout, header['stderr']
+
+def serve(socket_path):
+    """
+    Listen for requests on the given Unix socket, until interrupted.
+
+    Requests are handled one at a time, because rendering a protocol may
+    involve changing the working directory and other process-wide state.
+    """
+    import stepwise_mol_bio
+    from stepwise_mol_bio import ConfigError
+
+    # Import every protocol up front, so that the first request for each one
+    # doesn't have to pay for it.
+    for command in COMMANDS:
+        find_protocol(command)
+
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+
+    if socket_path.exists():
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(str(socket_path))
+        except ConnectionRefusedError:
+            socket_path.unlink()
+        else:
+            raise ConfigError(
+                    "another server is already listening on: {path}",
+                    path=socket_path,
+            )
+
+    db_cache = DatabaseCache()
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server, \
+            warm_configs():
+
+        server.bind(str(socket_path))
+        server.listen()
+
+        try:
+            while True:
+                conn, _ = server.accept()
+                handle_connection(conn, db_cache)
+
+        except KeyboardInterrupt:
+            pass
+
+        finally:
+            socket_path.unlink(missing_ok=True)
+
+def handle_connection(conn, db_cache):
+    with conn:
+        with conn.makefile('rb') as f:
+            msg = json.loads(f.readline())
+
+        status, stdout, stderr = run_request(msg, db_cache)
+        header = json.dumps({'status': status, 'stderr': stderr})
+
+        try:
+            conn.sendall(header.encode() + b'\n' + stdout)
+        except BrokenPipeError:
+            pass
+
+def run_request(msg, db_cache):
+    from io import StringIO
+    from contextlib import redirect_stderr
+    from traceback import print_exc
+    from inform import error
+    from stepwise_mol_bio import StepwiseMolBioError
+
+    argv = msg['argv']
+    stdout = b''
+    stderr = StringIO()
+
+    with cd(msg['cwd']), redirect_stderr(stderr):
+        try:
+            db = db_cache.load_db(Path.cwd())
+            protocol = load_protocol(argv, db=db)
+            stdout = render_protocol(protocol, text=msg['text'])
+            status = 0
+
+        except StepwiseMolBioError as err:
+            error(err, culprit=argv[0])
+            status = 1
+
+        except SystemExit as err:
+            # Raised by docopt, e.g. for `-h` or invalid arguments.
+            if isinstance(err.code, str):
+                print(err.code, file=sys.stderr)
+                status = 1
+            else:
+                status = err.code or 0
+
+        except Exception:
+            print_exc()
+            status = 1
+
+    return status, stdout, stderr.getvalue()
+
+def find_protocol(command):
+    """
+    Return the class that implements the given protocol.
+
+    The command can be given either as a bare name (e.g. "pcr") or as a path
+    to one of the protocol scripts in this package (e.g. "gels/gel.py").
+    """
+    import stepwise_mol_bio
+    from stepwise_mol_bio import UsageError
+    from inform import did_you_mean
+
+    name = Path(command).stem
+
+    try:
+        return getattr(stepwise_mol_bio, COMMANDS[name])
+    except KeyError:
+        err = UsageError(command=command)
+        err.brief = "unknown protocol: {command!r}"
+        err.hints += lambda e: f"did you mean: {did_you_mean(e.command, COMMANDS)!r}"
+        raise err from None
+
+def load_protocol(argv, *, db=None):
+    """
+    Create the protocol described by the given command-line arguments.
+
+    The first argument must be the name of the protocol (see `find_protocol`).
+    The remaining arguments are parsed exactly as they would be if the
+    corresponding script were run from the command line.  If a database is
+    given, it will be used instead of loading one.
+    """
+    import byoc
+    import freezerbox
+    from byoc import DocoptConfig
+    from freezerbox import BaseProductConfig
+    from stepwise_mol_bio import Main
+
+    cls = find_protocol(argv[0])
+    app = cls.from_bare()
+
+    # The usage text is written to whatever stream the class was given at
+    # import time, which won't be redirected.
+    app.usage_io = sys.stderr
+
+    with munge_sys_argv(argv):
+        byoc.load(app, DocoptConfig)
+
+    if isinstance(app, Main):
+        if db is not None:
+            app.db = db
+        byoc.load(app, BaseProductConfig)
+    else:
+        app.db = db if db is not None else freezerbox.load_db()
+
+    return app.protocol
+
+def render_protocol(protocol, *, text=False):
+    """
+    Convert the given protocol to bytes.
+
+    If *text* is true, the protocol is formatted for a person to read.
+    Otherwise, it is pickled in the same format that stepwise uses when
+    protocols are piped between commands.
+    """
+    import pickle
+    from stepwise import ProtocolIO
+    from stepwise.printer import format_protocol
+
+    if text:
+        return (format_protocol(protocol) + '\n').encode()
+    else:
+        return pickle.dumps(ProtocolIO(protocol))
+
+class DatabaseCache:
+    """
+    Keep FreezerBox databases loaded between requests.
+
+    Which database is loaded depends on the config files present in the
+    working directory and its parents, so databases are cached separately for
+    each set of config files.  A cached database is reloaded whenever any of
+    these config files, or any of the files that make up the database itself,
+    are modified.  Note that changes to files that are loaded lazily by
+    individual reagents (e.g. sequence files) are not detected.
+    """
+
+    def __init__(self):
+        self._cache = {}
+
+    def load_db(self, cwd):
+        """
+        Return the database for the given directory, or None if no database
+        is configured there.
+        """
+        import freezerbox
+        from freezerbox.config import load_config
+
+        config_paths = find_freezerbox_config_paths(cwd)
+        key = tuple(config_paths)
+
+        try:
+            paths, fingerprint, db = self._cache[key]
+        except KeyError:
+            pass
+        else:
+            if fingerprint_paths(paths) == fingerprint:
+                return db
+
+        # `load_config()` is memoized, but its result depends on the working
+        # directory, so call the underlying function instead.
+        with cd(cwd):
+            config = load_config.__wrapped__()
+            paths = [*config_paths, *find_freezerbox_db_paths(config)]
+            fingerprint = fingerprint_paths(paths)
+
+            try:
+                db = freezerbox.load_db(config=config)
+            except freezerbox.LoadError:
+                return None
+
+        self._cache[key] = paths, fingerprint, db
+        return db
+
+def find_freezerbox_config_paths(cwd):
+    """
+    Return every path that FreezerBox would check for config files, when run
+    from the given directory.
+
+    Paths that don't exist are included, so that we can notice if they are
+    created.
+    """
+    from freezerbox.config import BUILTIN_CONF
+
+    cwd = Path(cwd).resolve()
+    paths = [BUILTIN_CONF]
+
+    for dir in reversed([cwd, *cwd.parents]):
+        paths += [
+                dir / '.config' / 'freezerbox' / 'conf.toml',
+                dir / '.freezerboxrc',
+        ]
+
+    return paths
+
+def find_freezerbox_db_paths(config):
+    try:
+        loader_configs = config['database'][config['use']]
+    except KeyError:
+        return []
+
+    return [
+            Path(x['path']).expanduser().resolve()
+            for x in loader_configs
+            if 'path' in x
+    ]
+
+def fingerprint_paths(paths):
+    """
+    Return a value that will change if any of the given files are created,
+    deleted, or modified.
+    """
+    fingerprint = []
+
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            fingerprint.append((str(path), None))
+        else:
+            fingerprint.append((str(path), stat.st_mtime_ns, stat.st_size))
+
+    return tuple(fingerprint)
+
+@contextmanager
+def warm_configs():
+    """
+    Avoid repeatedly loading the same config files and plugins.
+
+    Every app normally parses its TOML config files and searches the installed
+    packages for stepwise plugins when it's loaded.  Both are wasteful when
+    many apps are loaded by the same process, so while this context manager is
+    active, the parsed config files are cached (and reloaded only if modified)
+    and the plugins are only searched for once.
+    """
+    import stepwise.config
+    from byoc import TomlConfig
+    from copy import deepcopy
+
+    toml_cache = {}
+    plugin_cache = {}
+
+    orig_do_load = TomlConfig.__dict__['_do_load']
+    orig_load_plugins = stepwise.config.load_plugins
+
+    def do_load(path):
+        fingerprint = fingerprint_paths([path])
+
+        try:
+            prev_fingerprint, data = toml_cache[path]
+        except KeyError:
+            pass
+        else:
+            if fingerprint == prev_fingerprint:
+                # Protect the cache from any changes made by the caller.
+                return deepcopy(data)
+
+        data = orig_do_load.__func__(path)
+        toml_cache[path] = fingerprint, data
+        return deepcopy(data)
+
+    def load_plugins(group, default_priority=None):
+        key = group, default_priority
+        if key not in plugin_cache:
+            plugin_cache[key] = list(orig_load_plugins(group, default_priority))
+        return iter(plugin_cache[key])
+
+    TomlConfig._do_load = staticmethod(do_load)
+    stepwise.config.load_plugins = load_plugins
+
+    try:
+        yield
+    finally:
+        TomlConfig._do_load = orig_do_load
+        stepwise.config.load_plugins = orig_load_plugins
+
+@contextmanager
+def cd(dir):
+    prev_dir = os.getcwd()
+    os.chdir(dir)
+    try:
+        yield
+    finally:
+        os.chdir(prev_dir)
+
+@contextmanager
+def munge_sys_argv(argv):
+    prev_argv = sys.argv
+    sys.argv = list(argv)
+    try:
+        yield
+    finally:
+        sys.argv = prev_argv
+
+
+if __name__ == '__main__':
+    server_main()
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+
+"""\
+Cache the restriction sites in each template sequence on disk.
+
+The same plasmids tend to be searched for the same commercial enzymes over
+and over again, e.g. to simulate digests, to check Golden Gate parts for
+internal sites, and to plan diagnostic digests.  The site index searches each
+unique sequence for every enzyme sold by NEB the first time the sequence is
+seen, and stores the cut positions in an SQLite database keyed by a hash of
+the sequence.  After that, finding where any of those enzymes cut is just a
+lookup.  Enzymes that aren't sold by NEB are searched for on demand and added
+to the record for the sequence.
+
+Because the records are keyed by the sequence itself (and the version of
+Biopython, which provides the enzyme data), a sequence that changes in the
+FreezerBox database simply gets a new record.  Records that haven't been used
+recently are evicted, using the same limits as the protocol cache (the
+`molbio.cache` section of the stepwise config file).  Setting the
+`$STEPWISE_MOL_BIO_NO_CACHE` environment variable bypasses the index.
+"""
+
+import os
+import time
+import pickle
+import hashlib
+import sqlite3
+
+from functools import lru_cache
+from pathlib import Path
+
+from ._utils import app_dirs
+
+class RestrictionSiteIndex:
+    """
+    An SQLite database of the restriction sites in each sequence, keyed by
+    a hash of the sequence.
+
+    Use `RestrictionSiteIndex.from_config()` to get the index configured by
+    the user, which also respects the `$STEPWISE_MOL_BIO_NO_CACHE` bypass.
+    """
+
+    # Increment this whenever the format of the records changes, to
+    # invalidate any records that were written by older versions of this code.
+    RECORD_VERSION = 1
+
+    # Don't bother updating the time that a record was last accessed if it 
+    # was already accessed within this many seconds.
+    ACCESS_RESOLUTION_S = 3600
+
+    # Evicting old records requires scanning the whole table, so only do it 
+    # for the first write made by each index, and then every this many 
+    # writes.  Otherwise, indexing lots of new sequences at once would take 
+    # quadratic time.
+    EVICT_INTERVAL = 100
+
+    def __init__(self, path, *, max_size_MB=100, max_age_days=30):
+        self.path = Path(path)
+        self.max_size_MB = max_size_MB
+        self.max_age_days = max_age_days
+        self._db = None
+        self._db_pid = None
+        self._records = {}
+        self._num_writes = 0
+
+    @classmethod
+    def from_config(cls):
+        """
+        Return the index configured by the user, or None if caching is
+        disabled.
+        """
+        if os.environ.get('STEPWISE_MOL_BIO_NO_CACHE'):
+            return None
+
+        return _load_site_index_from_config(cls)
+
+    def get_sites(self, seq, enzymes):
+        """
+        Return a dictionary mapping each of the given enzymes to the positions
+        where it cuts the given sequence.
+
+        The enzymes must be Biopython `RestrictionType` objects, e.g. the
+        members of a `RestrictionBatch`.  The positions are 0-indexed, so each
+        one is the index of the first base after the cut, and they are given
+        in increasing order.  As in `RestrictionBatch.search()`, the sequence
+        is searched as if it were linear.
+        """
+        key = self.key_from_seq(seq)
+        record = self._load_record(key, seq)
+        missing = [x for x in enzymes if str(x) not in record]
+
+        if missing:
+            record = {**record, **search_sites(seq, missing)}
+            self._save_record(key, record)
+
+        return {x: record[str(x)] for x in enzymes}
+
+    def evict(self):
+        """
+        Remove records that haven't been used recently, and then the least
+        recently used records until the index fits within its maximum size.
+        """
+        db = self._connect()
+
+        with db:
+            cutoff = time.time() - 86400 * self.max_age_days
+            db.execute('DELETE FROM sites WHERE accessed < ?', (cutoff,))
+
+            max_size = 1e6 * self.max_size_MB
+            size, = db.execute(
+                    'SELECT COALESCE(SUM(size), 0) FROM sites'
+            ).fetchone()
+
+            if size <= max_size:
+                return
+
+            rows = db.execute(
+                    'SELECT key, size FROM sites ORDER BY accessed'
+            )
+            evict = []
+            for key, key_size in rows:
+                if size <= max_size:
+                    break
+                evict.append((key,))
+                size -= key_size
+
+            db.executemany('DELETE FROM sites WHERE key = ?', evict)
+
+    def clear(self):
+        with self._connect() as db:
+            db.execute('DELETE FROM sites')
+        self._records = {}
+
+    @classmethod
+    def key_from_seq(cls, seq):
+        """
+        Return the key that the restriction sites in the given sequence are
+        stored under.
+        """
+        from Bio import __version__ as biopython_version
+
+        key = hashlib.sha256()
+        key.update(f'{cls.RECORD_VERSION}:{biopython_version}:'.encode())
+        key.update(str(seq).encode())
+        return key.hexdigest()
+
+    def _load_record(self, key, seq):
+        try:
+            return self._records[key]
+        except KeyError:
+            pass
+
+        # Any problems reading the index (including not being able to create 
+        # the directory it goes in) are treated as misses, since the sites 
+        # can always be found from scratch.
+        try:
+            row = self._connect().execute(
+                    'SELECT sites, accessed FROM sites WHERE key = ?',
+                    (key,),
+            ).fetchone()
+
+            if row is not None:
+                blob, accessed = row
+
+                # Each write is a separate transaction, which is slow enough 
+                # to matter when hundreds of sequences are looked up at once.  
+                # The access times are only used to evict records that 
+                # haven't been used in days, so they don't need to be exact.
+                if time.time() - accessed > self.ACCESS_RESOLUTION_S:
+                    with self._connect() as db:
+                        db.execute(
+                                'UPDATE sites SET accessed = ? WHERE key = ?',
+                                (time.time(), key),
+                        )
+
+                record = self._records[key] = pickle.loads(blob)
+                return record
+
+        except (sqlite3.Error, pickle.UnpicklingError, OSError):
+            pass
+
+        record = search_sites(seq, get_neb_enzymes())
+        self._save_record(key, record)
+        return record
+
+    def _save_record(self, key, record):
+        self._records[key] = record
+        blob = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+
+        try:
+            with self._connect() as db:
+                db.execute(
+                        'INSERT OR REPLACE INTO sites VALUES (?, ?, ?, ?)',
+                        (key, blob, len(blob), time.time()),
+                )
+
+            if self._num_writes % self.EVICT_INTERVAL == 0:
+                self.evict()
+            self._num_writes += 1
+
+        except (sqlite3.Error, OSError):
+            pass
+
+    def _connect(self):
+        # SQLite connections can't be used across `fork()`, and the index 
+        # returned by `from_config()` is shared by the whole process, so it 
+        # will be inherited by any workers forked by `make`.  Give each 
+        # process its own connection.
+        if self._db is None or self._db_pid != os.getpid():
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(self.path)
+            self._db_pid = os.getpid()
+            self._db.execute('''\
+                    CREATE TABLE IF NOT EXISTS sites (
+                        key TEXT PRIMARY KEY,
+                        sites BLOB,
+                        size INTEGER,
+                        accessed REAL
+                    )
+            ''')
+        return self._db
+
+def search_sites(seq, enzymes):
+    """
+    Search the given sequence for the given enzymes, without using the index.
+
+    The return value maps the name of each enzyme to a tuple of 0-indexed cut
+    positions, in the same format as the records in the index.  The enzymes
+    can be given as a `RestrictionBatch`, to avoid making a new one.
+    """
+    from Bio.Restriction import RestrictionBatch
+    from Bio.Seq import Seq
+
+    if isinstance(enzymes, RestrictionBatch):
+        batch = enzymes
+    else:
+        batch = RestrictionBatch(list(enzymes))
+
+    return {
+            str(enzyme): tuple(x - 1 for x in sites)
+            for enzyme, sites in batch.search(Seq(seq)).items()
+    }
+
+@lru_cache
+def get_neb_enzymes():
+    """
+    Return every enzyme sold by NEB, according to the REBASE data that ships
+    with Biopython.
+
+    This list is used instead of the enzymes in the NEB database so that the
+    index can be built without downloading anything.
+    """
+    from Bio.Restriction import RestrictionBatch
+    return RestrictionBatch(suppliers=['N'])
+
+@lru_cache
+def _load_site_index_from_config(cls):
+    from ._cache import CacheConfig
+
+    config = CacheConfig()
+    if not config.enabled:
+        return None
+
+    return cls(
+            Path(app_dirs.user_cache_dir) / 'restriction_sites.sqlite',
+            max_size_MB=config.max_size_MB,
+            max_age_days=config.max_age_days,
+    )
@@ -1,18 +1,21 @@
 #!/usr/bin/env python3
 
 import sys
+import stepwise
 import byoc
 import autoprop
 import tidyexc
 import freezerbox
 
 from freezerbox import ReagentConfig, BaseProductConfig, iter_combo_makers
-from byoc import Method, DocoptConfig
+from stepwise import StepwiseConfig
+from byoc import Key, Method, DocoptConfig
 from appdirs import AppDirs
 from inform import format_range, error
-from more_itertools import all_equal, always_iterable, first, unique_everseen
+from more_itertools import all_equal, always_iterable, first, spy, unique_everseen
 from functools import partial
 from pathlib import Path
+from types import SimpleNamespace
 
 app_dirs = AppDirs("stepwise_mol_bio")
 
@@ -22,14 +25,33 @@ class Main(byoc.App):
     group_by = {}
     merge_by = {}
 
+    # The number of processes to use when rendering protocols for `freezerbox
+    # make`.  If None, the `molbio.make.workers` config setting is used.
+    make_workers = None
+
+    # Solo makers for products that have already been made, see
+    # `SoloMakerCache`.  This is shared by every subclass.
+    solo_maker_cache = None
+
     @classmethod
     def main(cls):
+        from ._server import munge_sys_argv
+
+        # `--no-cache` applies to every protocol, so it's handled here rather 
+        # than in each usage text.
+        argv = sys.argv[1:]
+        use_cache = '--no-cache' not in argv
+        argv = [x for x in argv if x != '--no-cache']
+
         app = cls.from_bare()
-        byoc.load(app, DocoptConfig)
+        with munge_sys_argv([sys.argv[0], *argv]):
+            byoc.load(app, DocoptConfig)
         byoc.load(app, BaseProductConfig)
         
         try:
-            app.protocol.print()
+            from ._cache import load_protocol
+            protocol = load_protocol(app, argv) if use_cache else app.protocol
+            protocol.print()
         except StepwiseMolBioError as err:
             error(err)
 
@@ -55,15 +77,26 @@ class Main(byoc.App):
     @classmethod
     def protocols_from_makers(cls, makers):
         db = first(makers).db
-        for maker in iter_combo_makers(
-                    partial(cls._combo_maker_factory, db),
-                    makers,
-                    group_by=cls.group_by,
-                    merge_by=cls.merge_by,
-            ):
-            yield maker.makers, maker.protocol
+        combo_makers = iter_combo_makers(
+                partial(cls._combo_maker_factory, db),
+                makers,
+                group_by=cls.group_by,
+                merge_by=cls.merge_by,
+        )
+        for maker, protocol in cls._iter_maker_protocols(combo_makers):
+            yield maker.makers, protocol
 
 
+    @classmethod
+    def _iter_maker_protocols(cls, combo_makers):
+        from ._cache import ProtocolCache
+
+        return iter_maker_protocols(
+                combo_makers,
+                workers=cls.make_workers,
+                cache=ProtocolCache.from_config(),
+        )
+
     def refresh(self):
         autoprop.clear_cache(self)
 
@@ -79,6 +112,10 @@ class Main(byoc.App):
 
     @classmethod
     def _solo_maker_factory(cls, product):
+        return cls.solo_maker_cache.load(cls, product)
+
+    @classmethod
+    def _load_solo_maker(cls, product):
         app = cls.from_bare()
         app.db = product.db
         app.products = [product]
@@ -109,17 +146,129 @@ class Cleanup(Main):
     @classmethod
     def protocols_from_makers(cls, makers):
         db = first(makers).db
-        combo_makers = list(iter_combo_makers(
+        combo_makers = iter_combo_makers(
                 partial(cls._combo_maker_factory, db),
                 makers,
                 group_by=cls.group_by,
                 merge_by=cls.merge_by,
-        ))
-        show_product_tags = (len(combo_makers) != 1)
+        )
+
+        # Only the first two combo makers are needed to know whether there's
+        # more than one, so there's no need to wait for the rest.
+        head, combo_makers = spy(combo_makers, 2)
+        show_product_tags = (len(head) != 1)
+
+        def iter_tagged_combo_makers():
+            for maker in combo_makers:
+                maker.show_product_tags = show_product_tags
+                yield maker
+
+        for maker, protocol in cls._iter_maker_protocols(
+                iter_tagged_combo_makers()
+            ):
+            yield maker.makers, protocol
+
+@autoprop
+class SoloMakerCache:
+    """
+    Reuse the solo makers created for products that have been made before.
+
+    Creating a solo maker is cheap, but resolving its parameters (e.g. looking
+    up presets, parsing the product's database fields, etc.) is not.  This
+    cache keeps each solo maker, along with every parameter value it has
+    resolved so far, and returns it again the next time the same product is
+    made.  A cached maker is only reused for the very same product object
+    (i.e. the database hasn't been reloaded since the maker was created), and
+    only if the product's database fields, the rest of the database, and the
+    active config files are all unchanged.  Cached makers are never modified,
+    so makers that were handed out earlier stay valid.
+
+    The cache only lasts as long as the process, so it mainly helps
+    long-running processes, e.g. `molbio-server` or interactive sessions.
+    """
+
+    def __init__(self, max_size=1024):
+        from collections import OrderedDict
+
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._cache = OrderedDict()
+
+    def load(self, cls, product):
+        """
+        Return a solo maker of the given class for the given product.
+        """
+        key = cls, product.tag
+        fingerprint = self._fingerprint(cls, product)
+
+        try:
+            prev_product, prev_fingerprint, app = self._cache[key]
+        except KeyError:
+            pass
+        else:
+            # Don't point a cached maker at a reloaded (but equivalent) 
+            # database.  Whoever got the maker last time may still be using 
+            # it, e.g. a combo maker in the middle of being rendered.
+            if prev_product is product and fingerprint == prev_fingerprint:
+                self.hits += 1
+                self._cache.move_to_end(key)
+                return app
+
+        self.misses += 1
+
+        app = cls._load_solo_maker(product)
+        self._cache[key] = product, fingerprint, app
+        self._cache.move_to_end(key)
+
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+        return app
+
+    def clear(self):
+        self._cache.clear()
+        self.hits = self.misses = 0
+
+    def get_size(self):
+        return len(self._cache)
+
+    def get_hit_rate(self):
+        n = self.hits + self.misses
+        return self.hits / n if n else 0
+
+    def get_stats(self):
+        return dict(
+                hits=self.hits,
+                misses=self.misses,
+                hit_rate=self.hit_rate,
+                size=self.size,
+        )
+
+    def _fingerprint(self, cls, product):
+        from ._cache import (
+                fingerprint_reagent, fingerprint_db, fingerprint_configs,
+        )
+
+        # Parameters can depend on any reagent in the database (e.g. the
+        # template for a PCR reaction), not just the product itself.
+        return (
+                fingerprint_reagent(product),
+                fingerprint_db(product.db),
+                fingerprint_configs(cls, product.db),
+        )
+
+Main.solo_maker_cache = SoloMakerCache()
 
-        for maker in combo_makers:
-            maker.show_product_tags = show_product_tags
-            yield maker.makers, maker.protocol
+class MakeConfig(byoc.App):
+    __config__ = [
+            StepwiseConfig.setup(('molbio', 'make')),
+    ]
+    workers = byoc.param(
+            Key(StepwiseConfig, 'workers'),
+            cast=int,
+            default=1,
+    )
 
 @autoprop
 class Bindable(metaclass=byoc.BareMeta):
@@ -228,6 +377,218 @@ class UsageError(StepwiseMolBioError):
     # For if the program isn't being used correctly, e.g. missing information.
     pass
 
+def iter_maker_protocols(makers, *, workers=None, cache=None):
+    """
+    Yield each maker along with its protocol.
+
+    The makers must be independent of each other, i.e. rendering one protocol
+    can't affect any other.  If more than one worker is requested, the
+    protocols are rendered in parallel by forked processes.  Otherwise, the
+    makers are consumed lazily, so each protocol is yielded as soon as it's
+    rendered.  The makers are yielded in the order they were given either
+    way.  If *workers* is None, the number of workers is taken from the
+    `molbio.make.workers` config setting, and if it's 0, one worker is used
+    for each CPU.
+
+    If a `ProtocolCache` is given, protocols are taken from it when possible,
+    and only the protocols that aren't cached are rendered.
+    """
+    import os
+    import multiprocessing as mp
+
+    head, makers = spy(makers, 2)
+
+    if len(head) > 1 and workers is None:
+        workers = MakeConfig().workers
+    if workers == 0:
+        workers = os.cpu_count()
+
+    # The makers can't be pickled, so the only way to send them to the worker
+    # processes is to have the workers inherit them via `fork()`.
+    if len(head) < 2 or (workers or 1) < 2 or \
+            'fork' not in mp.get_all_start_methods():
+        for maker in makers:
+            yield maker, _load_protocol(maker, cache)
+        return
+
+    makers = list(makers)
+    keys = [cache and cache.key_from_maker(x) for x in makers]
+    entries = [cache and cache.get(x) for x in keys]
+    misses = [i for i, x in enumerate(entries) if not x]
+
+    rendered = _iter_forked_protocols([makers[i] for i in misses], workers)
+
+    for i, maker in enumerate(makers):
+        if entries[i]:
+            entries[i].replay_warnings()
+            protocol = entries[i].protocol
+        else:
+            protocol, warnings = next(rendered)
+            if cache:
+                cache.put(keys[i], protocol, warnings=warnings)
+
+        yield maker, protocol
+
+def _load_protocol(maker, cache):
+    if not cache:
+        return maker.protocol
+
+    from ._cache import record_warnings
+
+    key = cache.key_from_maker(maker)
+
+    if entry := cache.get(key):
+        entry.replay_warnings()
+        return entry.protocol
+
+    with record_warnings() as warnings:
+        protocol = maker.protocol
+
+    cache.put(key, protocol, warnings=warnings)
+    return protocol
+
+def _iter_forked_protocols(makers, workers):
+    import pickle
+    import multiprocessing as mp
+    from ._cache import record_warnings
+
+    global _forked_makers
+
+    if not makers:
+        return
+
+    _forked_makers = makers
+
+    try:
+        ctx = mp.get_context('fork')
+        with ctx.Pool(min(workers, len(makers))) as pool:
+            results = pool.imap(_render_forked_protocol, range(len(makers)))
+
+            for maker, result in zip(makers, results):
+                if result is None:
+                    # Rendering failed in the worker, so render again here
+                    # to raise the error with its full context.
+                    with record_warnings() as warnings:
+                        protocol = maker.protocol
+                    yield protocol, warnings
+                else:
+                    yield pickle.loads(result)
+
+    finally:
+        _forked_makers = None
+
+def _render_forked_protocol(i):
+    import pickle
+    from ._cache import record_warnings
+
+    # The warnings are displayed by the worker, but they also need to be 
+    # sent back so they can be cached along with the protocol.
+    try:
+        with record_warnings() as warnings:
+            protocol = _forked_makers[i].protocol
+        return pickle.dumps((protocol, warnings))
+    except Exception:
+        return None
+
+_forked_makers = None
+
+def group_by_fingerprint(items, key=lambda x: x):
+    """
+    Group the given items by key, in order of first appearance.
+
+    This is a drop-in replacement for `freezerbox.group_by_identity()`: the
+    groups are the same, and each is yielded as a `(key, items)` tuple where
+    the key is that of the first item in the group.  The difference is that
+    `group_by_identity()` compares every key to every group seen so far, which
+    is quadratic in the number of groups.  Here, each key is instead converted
+    to a hashable fingerprint (see `fingerprint_key()`), so that all the items
+    can be grouped in a single pass through a dictionary.  Keys that can't be
+    fingerprinted are still grouped by equality, but only with each other.
+    """
+    groups = []
+    hashed_groups = {}
+    unhashed_groups = []
+
+    for item in items:
+        item_key = key(item)
+
+        try:
+            fingerprint = fingerprint_key(item_key)
+        except TypeError:
+            for group in unhashed_groups:
+                if item_key == group[0]:
+                    group[1].append(item)
+                    break
+            else:
+                group = item_key, [item]
+                unhashed_groups.append(group)
+                groups.append(group)
+
+        else:
+            try:
+                hashed_groups[fingerprint][1].append(item)
+            except KeyError:
+                group = hashed_groups[fingerprint] = item_key, [item]
+                groups.append(group)
+
+    yield from groups
+
+def fingerprint_key(x):
+    """
+    Return a hashable value that is equal for any two keys that are equal.
+
+    Lists, dicts, and sets are fingerprinted by their contents, and reactions
+    are fingerprinted by the same reagent attributes that they're compared
+    by.  Any other value is expected to be hashable.  A `TypeError` is raised
+    if the key can't be fingerprinted, e.g. because it contains unhashable
+    objects of some other type.
+    """
+    # This function is called for every item being grouped, so the common
+    # types are looked up directly rather than via a chain of `isinstance()`
+    # checks.
+    cls = x.__class__
+
+    if cls in _atomic_types:
+        return x
+
+    try:
+        fingerprint = _fingerprinters[cls]
+    except KeyError:
+        for base, fingerprint in _fingerprinters.items():
+            if isinstance(x, base):
+                break
+        else:
+            # Raises TypeError for unhashable objects.
+            hash(x)
+            return x
+
+    return fingerprint(x)
+
+def _fingerprint_reaction(rxn):
+    return 'reaction', tuple([
+        ('reagent', *map(fingerprint_key, [
+            r.name, r.catalog_num, r.volume_or_none, r.stock_conc,
+        ]))
+        for r in rxn
+    ])
+
+# Each container is tagged with its type, so that (for example) a list and a
+# tuple with the same items get different fingerprints, just like they aren't
+# equal.  Sets and frozensets are tagged the same, because they can be equal.
+_atomic_types = {str, int, float, bool, bytes, type(None)}
+_fingerprinters = {
+        tuple: lambda x: ('tuple', tuple(map(fingerprint_key, x))),
+        list: lambda x: ('list', tuple(map(fingerprint_key, x))),
+        dict: lambda x: ('dict', frozenset(zip(
+            map(fingerprint_key, x.keys()),
+            map(fingerprint_key, x.values()),
+        ))),
+        set: lambda x: ('set', frozenset(map(fingerprint_key, x))),
+        frozenset: lambda x: ('set', frozenset(map(fingerprint_key, x))),
+        SimpleNamespace: lambda x: ('namespace', fingerprint_key(vars(x))),
+        stepwise.Reaction: _fingerprint_reaction,
+}
+
 def bind(app, bindables, iter=always_iterable, force=False):
     # Would `funcy.walk()` be a good way to handle any level of nesting?
     for bindable in iter(bindables):
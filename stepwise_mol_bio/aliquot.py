@@ -2,8 +2,8 @@
 
 import stepwise, byoc, autoprop
 from stepwise import Quantity
-from stepwise_mol_bio import Cleanup
-from freezerbox import MakerConfig, group_by_identity
+from stepwise_mol_bio import Cleanup, group_by_fingerprint
+from freezerbox import MakerConfig
 from byoc import DocoptConfig, Key, Method
 
 @autoprop
@@ -38,8 +38,8 @@ Arguments:
     )
 
     group_by = {
-        'volume': group_by_identity,
-        'conc': group_by_identity,
+        'volume': group_by_fingerprint,
+        'conc': group_by_fingerprint,
     }
 
     def __init__(self, volume, conc=None, product_tags=None):
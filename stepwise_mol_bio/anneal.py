@@ -5,11 +5,11 @@ import stepwise, byoc, autoprop
 from stepwise import StepwiseConfig, pl, ul
 from stepwise_mol_bio import (
         Main, BindableReagent, UsageError,
-        bind, merge_names,
+        bind, merge_names, group_by_fingerprint,
 )
 from freezerbox import (
         ReagentConfig, MakerConfig, QueryError,
-        parse_conc_uM, parse_volume_uL, group_by_identity, join_lists,
+        parse_conc_uM, parse_volume_uL, join_lists,
 )
 from byoc import Key, Method, DocoptConfig
 from inform import plural
@@ -151,8 +151,8 @@ FreezerBox:
     config_paths = byoc.config_attr()
 
     group_by = {
-            'volume_uL': group_by_identity,
-            'oligo_conc_uM': group_by_identity,
+            'volume_uL': group_by_fingerprint,
+            'oligo_conc_uM': group_by_fingerprint,
     }
     merge_by = {
             'oligo_pairs': join_lists,
@@ -3,24 +3,31 @@
 import stepwise
 import byoc
 import autoprop
+import os
 import re
 import json
+import time
+import pickle
 import requests
+import threading
 
 from stepwise_mol_bio import (
         Main, BindableReagent, UsageError, ConfigError,
         bind, app_dirs, comma_list, match_len, int_or_expr,
+        group_by_fingerprint,
 )
+from stepwise_mol_bio._site_index import RestrictionSiteIndex, search_sites
 from stepwise import StepwiseConfig, pl, ul
 from freezerbox import (
         ReagentConfig, MakerConfig,
         parse_mass_ug, parse_volume_uL, parse_size_bp, parse_time,
-        group_by_identity, join_lists,
+        join_lists,
 )
 from byoc import Key, Method, DocoptConfig
 from inform import Error, plural, did_you_mean
 from more_itertools import one
-from functools import partial
+from functools import partial, lru_cache
+from dataclasses import dataclass
 from pathlib import Path
 
 def parse_templates_from_csv(string):
@@ -32,70 +39,118 @@ def parse_templates_from_csv(string):
 def parse_template_from_freezerbox(string):
     return [RestrictionDigest.Template(string)]
 
+# The NEB data identifies the common buffers by these codes.  Don't consider 
+# `buf5`.  This is the code for buffers that are unique to a specific enzyme, 
+# so even if two enzymes both want `buf5`, it's not the same buffer.
+NEB_BUFFER_NAMES = {
+        '1': "NEBuffer r1.1",
+        '2': "NEBuffer r2.1",
+        '3': "NEBuffer r3.1",
+        '4': "rCutSmart Buffer",
+}
+
 def pick_compatible_buffer(enzymes):
     if len(enzymes) == 1:
         return enzymes[0]['recommBuffer']
 
-    # Don't consider `buf5`.  This is the code for buffers that are unique to a 
-    # specific enzyme, so even if two enzymes both want `buf5`, it's not the 
-    # same buffer.
-
-    buffer_names = {
-            '1': "NEBuffer r1.1",
-            '2': "NEBuffer r2.1",
-            '3': "NEBuffer r3.1",
-            '4': "rCutSmart Buffer",
-    }
     buffer_scores = {
             k: (
                 sum(not x[f'star{k}'] for x in enzymes),  # Star activity?
                 sum(x[f'buf{k}'] for x in enzymes),       # Cutting activity?
                 k == '4',                                 # Prefer CutSmart
             )
-            for k in buffer_names
+            for k in NEB_BUFFER_NAMES
     }
     best_buffer = max(
             buffer_scores,
             key=lambda k: buffer_scores[k],
     )
 
-    return buffer_names[best_buffer]
+    return NEB_BUFFER_NAMES[best_buffer]
 
 def calc_digest_products(seq, enzymes, *, is_circular):
-    from more_itertools import pairwise, flatten
-    from Bio.Restriction import RestrictionBatch
-    from Bio.Seq import Seq
+    return calc_digest_products_batch(
+            [seq], enzymes,
+            is_circular=is_circular,
+    )[0]
+
+def calc_digest_products_batch(seqs, enzymes, *, is_circular):
+    """
+    Digest each of the given sequences with the same set of enzymes.
+
+    The return value is a list with the products of each digest, in the same
+    order as the sequences.  *is_circular* can either be a single value that
+    applies to every sequence, or a list with one value per sequence.  The
+    products of each digest are exactly the same as those returned by
+    `calc_digest_products()`, but the enzymes only have to be looked up once.
+
+    If the site index is enabled (see `RestrictionSiteIndex`), the sites are
+    looked up rather than searched for, so each unique sequence only has to be
+    searched once.
+    """
+    from more_itertools import flatten
 
     if not enzymes:
         raise UsageError("no enzymes specified", enzymes=enzymes)
 
-    enzymes = [
+    batch, enzymes = get_restriction_batch(tuple(enzymes))
+    is_circular = match_len(is_circular, len(seqs))
+    site_index = RestrictionSiteIndex.from_config()
+    products = []
+
+    for seq, is_circular_i in zip(seqs, is_circular):
+        if site_index:
+            hits = site_index.get_sites(seq, batch).values()
+        else:
+            hits = search_sites(seq, batch).values()
+
+        sites = list(flatten(hits))
+
+        if not sites:
+            raise ConfigError(
+                    lambda e: f"{','.join(map(repr, e.enzymes))} {plural(e.enzymes):/does/do} not cut template.",
+                    enzymes=list(enzymes),
+                    seq=seq,
+            )
+
+        products.append(_split_at_sites(seq, sites, is_circular_i))
+
+    return products
+
+@lru_cache
+def get_restriction_batch(enzymes):
+    """
+    Return a Biopython `RestrictionBatch` for the given tuple of enzyme names,
+    along with the names that were actually looked up.
+
+    Biopython doesn't distinguish between the regular and high-fidelity
+    versions of each enzyme, so any "-HF" suffixes are removed.  Batches are
+    cached, so digesting lots of templates with the same enzymes only looks
+    up the enzymes once.
+    """
+    from Bio.Restriction import RestrictionBatch
+
+    enzymes = tuple(
             re.sub('-HF(v2)?$', '', x)
             for x in enzymes
-    ]
+    )
 
     try:
-        batch = RestrictionBatch(enzymes)
+        return RestrictionBatch(enzymes), enzymes
     except ValueError:
         raise ConfigError(
                 lambda e: f"unknown enzyme(s): {','.join(map(repr, e.enzymes))}",
-                enzymes=enzymes,
+                enzymes=list(enzymes),
         ) from None
 
-    sites = [x-1 for x in flatten(batch.search(Seq(seq)).values())]
-
-    if not sites:
-        raise ConfigError(
-                lambda e: f"{','.join(map(repr, e.enzymes))} {plural(enzymes):/does/do} not cut template.",
-                enzymes=enzymes,
-                seq=seq,
-        )
+def _split_at_sites(seq, sites, is_circular):
+    from more_itertools import pairwise
 
     sites += [] if is_circular else [0, len(seq)]
     sites = sorted(sites)
 
     seqs = []
-    for i,j in pairwise(sorted(sites)):
+    for i,j in pairwise(sites):
         seqs.append(seq[i:j])
 
     if is_circular:
@@ -239,10 +294,10 @@ Options:
     )
 
     group_by = {
-        'enzyme_names': group_by_identity,
-        'dna_ug': group_by_identity,
-        'target_volume_uL': group_by_identity,
-        'time': group_by_identity,
+        'enzyme_names': group_by_fingerprint,
+        'dna_ug': group_by_fingerprint,
+        'target_volume_uL': group_by_fingerprint,
+        'time': group_by_fingerprint,
     }
     merge_by = {
         'templates': join_lists,
@@ -270,7 +325,7 @@ Options:
         return [self.enzyme_db[x] for x in self.enzyme_names]
 
     def get_enzyme_db(self):
-        return NebRestrictionEnzymeDatabase()
+        return get_neb_restriction_enzyme_db()
 
     def get_reaction(self):
         # Define a prototypical restriction digest reaction.  Stock 
@@ -475,66 +530,450 @@ the DNA will be purified before use.
         return self.reaction.volume
 
 
+@dataclass(frozen=True)
+class NebRestrictionEnzyme:
+    """
+    The parameters of a restriction enzyme that are needed to setup a
+    reaction, extracted from the raw NEB data when the index is built.
+
+    *buffer_activity* and *star_activity* are indexed by the NEB buffer codes
+    ('1' through '5').  *supplements* only includes the supplements that are
+    actually required, i.e. those with nonzero concentrations.
+    """
+    name: str
+    concentration_U_uL: float
+    recommended_buffer: str
+    buffer_activity: dict
+    star_activity: dict
+    supplements: dict
+
+    @classmethod
+    def from_neb(cls, params):
+        codes = '12345'
+        return cls(
+                name=params['name'],
+                concentration_U_uL=params['concentration'] / 1000,
+                recommended_buffer=params['recommBuffer'],
+                buffer_activity={k: params[f'buf{k}'] for k in codes},
+                star_activity={k: params[f'star{k}'] for k in codes},
+                supplements={
+                    k: v
+                    for k, v in params['supplement'].items() if v
+                },
+        )
+
+NEB_URL = 'http://nebcloner.neb.com/data/reprop.json'
+NEB_SNAPSHOT_PATH = Path(__file__).parent / 'neb_restriction_enzymes.json'
+
+def fetch_json(url, timeout_s):
+    """
+    Download and parse the JSON document at the given URL.
+
+    This is the default HTTP layer for `NebRestrictionEnzymeDatabase`.  Any
+    callable with the same signature can be used instead, e.g. to avoid the
+    network in tests.  Errors should be reported as `ConfigError`.
+    """
+    try:
+        response = requests.get(url, timeout=timeout_s)
+        response.raise_for_status()
+        return response.json()
+
+    except (requests.exceptions.RequestException, ValueError) as err1:
+        err2 = ConfigError(url=url, timeout_s=timeout_s)
+        err2.brief = "failed to download restriction enzyme data from NEB"
+        err2.info += "URL: {url}"
+        err2.hints += "make sure the internet is connected and the above URL is reachable."
+        raise err2 from err1
+
+def download_neb_data(path, url=NEB_URL, fetch_json=fetch_json, timeout_s=10):
+    """
+    Download the restriction enzyme data from NEB to the given path.
+
+    The file is replaced atomically, so processes reading it concurrently
+    will see either the old data or the new data.  This is also how the
+    bundled snapshot is updated:
+
+        download_neb_data(NEB_SNAPSHOT_PATH)
+    """
+    data = fetch_json(url, timeout_s)
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    _write_atomic(path, lambda f: f.write(json.dumps(data).encode()))
+
+@autoprop
 class NebRestrictionEnzymeDatabase:
+    """
+    Restriction enzyme data downloaded from NEB.
+
+    The raw data is a ~1 MB JSON file, and parsing it is slow enough to matter
+    when lots of digests or Golden Gate assemblies are being made at once.  So
+    the first time the data is loaded, it's also written to a pickled index
+    next to the JSON file.  The index records the modification time and size
+    of the JSON file it was built from, and is rebuilt whenever either
+    changes (e.g. when the data is downloaded again).
+
+    Lookups never wait for the network.  The data comes from the user's cache
+    if it exists, or from a snapshot bundled with this package otherwise.  If
+    that data is more than *max_age_days* old, or if an unknown enzyme is
+    requested, it's still used as is, but new data is downloaded in a
+    background thread.  The download gives up after *timeout_s*, and isn't
+    attempted again for *retry_interval_s* if it fails.  Names that aren't
+    found are remembered, so asking for the same unknown name repeatedly
+    doesn't cost anything.  If there's neither a cache nor a snapshot to
+    load, the database starts out empty and every lookup fails right away
+    (with an error saying why) until the background download finishes.  Call
+    `download_cache()` to wait for the data instead.
+
+    Most code should use `get_neb_restriction_enzyme_db()`, which returns a
+    database shared by the whole process, rather than constructing new
+    instances.
+    """
 
-    def __init__(self, cache_path=None):
-        self.cache_path = cache_path or Path(app_dirs.user_cache_dir) / 'neb' / 'restriction_enzymes.json'
+    # Increment this whenever the format of the index changes, to invalidate 
+    # any indices that were written by older versions of this code.
+    INDEX_VERSION = 2
+
+    def __init__(
+            self,
+            cache_path=None, *,
+            snapshot_path=NEB_SNAPSHOT_PATH,
+            url=NEB_URL,
+            fetch_json=fetch_json,
+            timeout_s=10,
+            max_age_days=30,
+            retry_interval_s=3600,
+    ):
+        self.cache_path = Path(cache_path or Path(app_dirs.user_cache_dir) / 'neb' / 'restriction_enzymes.json')
+        self.index_path = self.cache_path.with_suffix('.index.pickle')
+        self.attempt_path = self.cache_path.with_suffix('.last_attempt')
+        self.snapshot_path = snapshot_path and Path(snapshot_path)
+        self.url = url
+        self.fetch_json = fetch_json
+        self.timeout_s = timeout_s
+        self.max_age_days = max_age_days
+        self.retry_interval_s = retry_interval_s
+        self.refresh_thread = None
+        self.unknown_names = set()
+        self._lock = threading.RLock()
         self.load_cache()
 
+        if self.is_stale:
+            self.refresh_in_background()
+
     def __getitem__(self, name):
+        key = name.lower()
+
         try:
-            return self.enzyme_params[name.lower()]
+            return self.enzyme_params[key]
+        except KeyError:
+            pass
 
+        # Check if a background refresh has finished since the data was 
+        # loaded.  This only requires a `stat()` call, and it clears the 
+        # negative cache if the data did change.
+        self.reload_if_stale()
+
+        try:
+            return self.enzyme_params[key]
         except KeyError:
-            try:
-                self.download_cache()
-                self.load_cache()
-                return self.enzyme_params[name.lower()]
-
-            except (KeyError, ConfigError) as err1:
-                err2 = ConfigError(
-                        enzyme=name,
-                        known_enzymes=self.enzyme_names,
-                        fresh_download=not isinstance(err1, ConfigError),
-                )
-                err2.brief = "no such enzyme {enzyme!r}"
-                err2.info += lambda e: (
-                        f"successfully downloaded the most recent restriction enzyme data from NEB (in case {e.enzyme!r} is a new enzyme)"
-                        if e.fresh_download else
-                        f"failed to download the most recent restriction enzyme data from NEB (in case {e.enzyme!r} is a new enzyme)"
-                )
-                err2.hints += lambda e: f"did you mean: {did_you_mean(e.enzyme, e.known_enzymes)!r}"
-
-                raise err2 from err1
+            pass
+
+        if self.source_path is None:
+            self.refresh_in_background()
+
+            err = ConfigError(
+                    enzyme=name,
+                    cache_path=self.cache_path,
+                    refreshing=self.is_refreshing,
+            )
+            err.brief = "can't look up {enzyme!r}: no restriction enzyme data available"
+            err.info += "cache: {cache_path}"
+            err.info += lambda e: (
+                    "downloading restriction enzyme data from NEB in the background"
+                    if e.refreshing else
+                    "already tried downloading restriction enzyme data from NEB recently"
+            )
+            err.hints += "make sure the internet is connected, then try again once the download finishes."
+            raise err
+
+        # Only try downloading new data the first time each unknown name is 
+        # looked up.
+        if key not in self.unknown_names:
+            self.unknown_names.add(key)
+            self.refresh_in_background()
+
+        err = ConfigError(
+                enzyme=name,
+                known_enzymes=self.enzyme_names,
+                source_path=self.source_path,
+                refreshing=self.is_refreshing,
+        )
+        err.brief = "no such enzyme {enzyme!r}"
+        err.info += "restriction enzyme data: {source_path}"
+        err.info += lambda e: (
+                f"downloading the most recent restriction enzyme data from NEB in the background (in case {e.enzyme!r} is a new enzyme)"
+                if e.refreshing else
+                f"already tried downloading new restriction enzyme data from NEB recently"
+        )
+        err.hints += lambda e: f"did you mean: {did_you_mean(e.enzyme, e.known_enzymes)!r}"
+        raise err
+
+    def __contains__(self, name):
+        return name.lower() in self.enzyme_params
+
+    def __len__(self):
+        return len(self.enzyme_params)
+
+    def get_enzyme(self, name):
+        """
+        Return the `NebRestrictionEnzyme` with the given (case-insensitive)
+        name.
+        """
+        # Make sure the name is valid, and report a useful error if not.
+        params = self[name]
+
+        try:
+            return self.enzymes[name.lower()]
+        except KeyError:
+            pass
+
+        # The enzyme is in the database, but its parameters couldn't be 
+        # summarized when the index was built.  Try again, so the error can 
+        # say what's wrong.
+        try:
+            return NebRestrictionEnzyme.from_neb(params)
+
+        except KeyError as err1:
+            err2 = ConfigError(
+                    enzyme=name,
+                    field=err1.args[0],
+                    source_path=self.source_path,
+            )
+            err2.brief = "missing {field!r} parameter for enzyme {enzyme!r}"
+            err2.info += "restriction enzyme data: {source_path}"
+            raise err2 from err1
+
+        except (TypeError, AttributeError) as err1:
+            err2 = ConfigError(enzyme=name, source_path=self.source_path)
+            err2.brief = "malformed parameters for enzyme {enzyme!r}"
+            err2.info += "restriction enzyme data: {source_path}"
+            raise err2 from err1
 
     def load_cache(self):
-        if not self.cache_path.exists():
-            self.download_cache()
+        with self._lock:
+            try:
+                source_path = self._find_source_path()
 
-        with self.cache_path.open() as f:
-            data = json.load(f)
+            # Don't wait for the data to be downloaded.  Lookups will fail 
+            # until the background refresh started by the constructor 
+            # finishes, and `reload_if_stale()` notices the new file.
+            except FileNotFoundError:
+                source_path = stamp = None
+                index = self._build_index({}, source_path, stamp)
+
+            else:
+                stamp = self._get_stamp(source_path)
+                index = self._load_index(source_path, stamp)
+
+                if index is None:
+                    with source_path.open() as f:
+                        data = json.load(f)
+
+                    index = self._build_index(data, source_path, stamp)
+                    self._save_index(index)
+
+            self.source_path = source_path
+            self.stamp = stamp
+            self.enzyme_names = index['names']
+            self.enzyme_params = index['params']
+            self.enzymes = index['enzymes']
+            self.unknown_names = set()
+
+    def reload_if_stale(self):
+        """
+        Reload the data if it has changed since it was loaded, e.g. because
+        a background refresh finished.
+
+        Only the modification time and size of the file are checked, so this
+        is cheap enough to call before every lookup.
+        """
+        try:
+            source_path = self._find_source_path()
+            stamp = self._get_stamp(source_path)
+        except FileNotFoundError:
+            return
 
-        self.enzyme_names = list(data.keys())
-        self.enzyme_params = {k.lower(): v for k, v in data.items()}
+        if (source_path, stamp) != (self.source_path, self.stamp):
+            self.load_cache()
 
     def download_cache(self):
-        url = 'http://nebcloner.neb.com/data/reprop.json'
+        """
+        Download the most recent data from NEB, waiting for it to finish.
+        """
+        try:
+            download_neb_data(
+                    self.cache_path,
+                    url=self.url,
+                    fetch_json=self.fetch_json,
+                    timeout_s=self.timeout_s,
+            )
+        finally:
+            self._record_attempt()
+
+    def refresh_in_background(self):
+        """
+        Start downloading the most recent data from NEB in a background
+        thread, unless a download is already in progress or failed recently.
+
+        The thread is a daemon, so it never keeps the process from exiting.
+        A download that gets cut off this way is harmless: the cache is
+        replaced atomically, so it's either left as it was or fully updated.
+        The attempt is only recorded once the download finishes, so a
+        download that was cut off will be tried again the next time the
+        program is run.
+        """
+        with self._lock:
+            if self.is_refreshing:
+                return
+            if self._get_time_since_attempt() < self.retry_interval_s:
+                return
+
+            self.refresh_thread = threading.Thread(
+                    target=self._refresh,
+                    name='neb-refresh',
+                    daemon=True,
+            )
+            self.refresh_thread.start()
+
+    def get_is_refreshing(self):
+        thread = self.refresh_thread
+        return thread is not None and thread.is_alive()
+
+    def get_is_stale(self):
+        if self.source_path != self.cache_path:
+            return True
+
+        age_s = time.time() - self.stamp[0] / 1e9
+        return age_s > self.max_age_days * 86400
 
+    def _refresh(self):
+        # There's no one to report errors to in the background.  If the 
+        # download fails (or the cache can't be written), the existing data 
+        # will keep being used, and another attempt will be made after the 
+        # retry interval.
         try:
-            data = requests.get(url).json()
+            self.download_cache()
+        except (ConfigError, OSError):
+            pass
 
-        except requests.exceptions.ConnectionError as err1:
-            err2 = ConfigError(url=url)
-            err2.brief = "failed to download restriction enzyme data from NEB"
-            err2.info += "URL: {url}"
-            err2.hints += "make sure the internet is connected and the above URL is reachable."
-            raise err2 from err1
+    def _find_source_path(self):
+        if self.cache_path.exists():
+            return self.cache_path
+        if self.snapshot_path and self.snapshot_path.exists():
+            return self.snapshot_path
 
-        else:
-            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        raise FileNotFoundError(self.cache_path)
+
+    def _get_stamp(self, path):
+        st = path.stat()
+        return st.st_mtime_ns, st.st_size
+
+    def _get_time_since_attempt(self):
+        try:
+            return time.time() - self.attempt_path.stat().st_mtime
+        except OSError:
+            return float('inf')
+
+    def _record_attempt(self):
+        try:
+            self.attempt_path.parent.mkdir(parents=True, exist_ok=True)
+            self.attempt_path.touch()
+        except OSError:
+            pass
+
+    def _build_index(self, data, source_path, stamp):
+        enzymes = {}
+
+        # Enzymes with missing or malformed parameters can still be looked 
+        # up, they just don't get a summary.
+        for k, v in data.items():
+            try:
+                enzymes[k.lower()] = NebRestrictionEnzyme.from_neb(v)
+            except (KeyError, TypeError, AttributeError):
+                pass
+
+        return {
+                'version': self.INDEX_VERSION,
+                'source': str(source_path),
+                'stamp': stamp,
+                'names': list(data.keys()),
+                'params': {k.lower(): v for k, v in data.items()},
+                'enzymes': enzymes,
+        }
+
+    def _load_index(self, source_path, stamp):
+        try:
+            with self.index_path.open('rb') as f:
+                index = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return None
+
+        try:
+            if index['version'] != self.INDEX_VERSION:
+                return None
+            if index['source'] != str(source_path):
+                return None
+            if index['stamp'] != stamp:
+                return None
+        except (TypeError, KeyError):
+            return None
+
+        return index
+
+    def _save_index(self, index):
+        # Failing to write the index isn't an error; it just means it will be 
+        # rebuilt next time.
+        try:
+            self.index_path.parent.mkdir(parents=True, exist_ok=True)
+            _write_atomic(
+                    self.index_path,
+                    lambda f: pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL),
+            )
+        except OSError:
+            pass
+
+def _write_atomic(path, write):
+    # Write to a temporary file and rename it, so that concurrent processes 
+    # (or threads) never see a partially written file.
+    tmp_path = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        with tmp_path.open('wb') as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+_shared_dbs = {}
+
+def get_neb_restriction_enzyme_db(cache_path=None):
+    """
+    Return the restriction enzyme database shared by the whole process.
+
+    The database is loaded the first time this function is called, and
+    reloaded if the underlying data changes on disk.  Any other call just
+    returns the same object.
+    """
+    key = Path(cache_path) if cache_path else None
+
+    try:
+        db = _shared_dbs[key]
+    except KeyError:
+        db = _shared_dbs[key] = NebRestrictionEnzymeDatabase(cache_path)
+    else:
+        db.reload_if_stale()
 
-            with self.cache_path.open('w') as f:
-                json.dump(data, f)
+    return db
 
 if __name__ == '__main__':
     RestrictionDigest.main()
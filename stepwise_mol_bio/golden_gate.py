@@ -4,13 +4,35 @@ import stepwise
 import byoc
 import autoprop
 
-from stepwise import pl, ul
-from stepwise_mol_bio import Assembly
-from stepwise_mol_bio.digest import NebRestrictionEnzymeDatabase
+from stepwise import pl
+from stepwise_mol_bio import Assembly, group_by_fingerprint
+from stepwise_mol_bio.digest import get_neb_restriction_enzyme_db
 from stepwise_mol_bio._assembly import ARGUMENT_DOC, OPTION_DOC
-from freezerbox import MakerConfig, group_by_identity
+from stepwise_mol_bio.thermocycler import (
+        ThermocyclerProgram, Incubation, Repeat, PCR_FORMAT,
+)
+from freezerbox import MakerConfig
 from byoc import Key, DocoptConfig
 from inform import plural
+from dataclasses import replace
+
+THERMOCYCLER_PROGRAMS = {
+        'quick': ThermocyclerProgram([
+            Incubation(37, 5 * 60, name='assemble'),
+        ]),
+        'standard': ThermocyclerProgram([
+            Incubation(37, 60 * 60, name='assemble'),
+            Incubation(60, 5 * 60, name='denature'),
+        ]),
+        'cycled': ThermocyclerProgram([
+            Repeat(30, (
+                Incubation(37, 60, name='digest'),
+                Incubation(16, 60, name='ligate'),
+            ), name='cycles'),
+            Incubation(60, 5 * 60, name='denature'),
+        ]),
+}
+THERMOCYCLER_FORMAT = replace(PCR_FORMAT, repeat='Repeat {num_cycles} times:')
 
 @autoprop.cache
 class GoldenGate(Assembly):
@@ -56,7 +78,7 @@ Database:
 
     group_by = {
             **Assembly.group_by,
-            'enzymes': group_by_identity,
+            'enzymes': group_by_fingerprint,
     }
 
     def get_reaction(self):
@@ -75,10 +97,10 @@ Database:
         rxn['T4 DNA ligase'].master_mix = True
         rxn['T4 DNA ligase'].order = 3
 
-        enzyme_db = NebRestrictionEnzymeDatabase()
+        enzyme_db = get_neb_restriction_enzyme_db()
 
         for enzyme in self.enzymes:
-            stock = enzyme_db[enzyme]['concentration'] / 1000
+            stock = enzyme_db.get_enzyme(enzyme).concentration_U_uL
             rxn[enzyme].volume = enz_uL, 'µL'
             rxn[enzyme].stock_conc = stock, 'U/µL'
             rxn[enzyme].master_mix = True
@@ -86,6 +108,24 @@ Database:
 
         return self._add_fragments_to_reaction(rxn)
 
+    def get_thermocycler_program(self):
+        n = self.num_fragments
+
+        if n <= 2:
+            return THERMOCYCLER_PROGRAMS['quick']
+        if n <= 4:
+            return THERMOCYCLER_PROGRAMS['standard']
+
+        # Cycling between the optimal temperatures for the restriction enzyme 
+        # and the ligase helps with larger assemblies.
+        program = THERMOCYCLER_PROGRAMS['cycled']
+        if n > 10:
+            program = program.replace(
+                    digest={'time_s': 5 * 60},
+                    ligate={'time_s': 5 * 60},
+            )
+        return program
+
     def get_protocol(self):
         # Maybe this should be the getter function for the assembly param...
 
@@ -99,54 +139,15 @@ Database:
                 f"Setup {plural(n):# Golden Gate assembl/y/ies}{p.add_footnotes(f)}:",
                 rxn,
         )
+        step = pl(
+                "Run the following thermocycler protocol:",
+                self.thermocycler_program.format_ul(THERMOCYCLER_FORMAT),
+        )
         if n_frags <= 2:
-            p += pl(
-                    "Run the following thermocycler protocol:",
-                    ul(
-                        "37°C for 5 min",
-                    ),
-                    "Or, to maximize the number of transformants:",
-                    ul(
-                        "37°C for 60 min",
-                        "60°C for 5 min",
-                    ),
-            )
-
-        elif n_frags <= 4:
-            p += pl(
-                    "Run the following thermocycler protocol:",
-                    ul(
-                        "37°C for 60 min",
-                        "60°C for 5 min",
-                    ),
-            )
-
-        elif n_frags <= 10:
-            p += pl(
-                    "Run the following thermocycler protocol:",
-                    ul(
-                        "Repeat 30 times:",
-                        ul(
-                            "37°C for 1 min",
-                            "16°C for 1 min",
-                        ),
-                        "60°C for 5 min",
-                    ),
-            )
-
-        else:
-            p += pl(
-                    "Run the following thermocycler protocol:",
-                    ul(
-                        "Repeat 30 times:",
-                        ul(
-                            "37°C for 5 min",
-                            "16°C for 5 min",
-                        ),
-                        "60°C for 5 min",
-                    ),
-            )
+            step += "Or, to maximize the number of transformants:"
+            step += THERMOCYCLER_PROGRAMS['standard'].format_ul(THERMOCYCLER_FORMAT)
 
+        p += step
         return p
 
 
@@ -7,11 +7,12 @@ from stepwise import (
 )
 from stepwise_mol_bio import (
         Main, BindableReagent, UsageError, bind, format_min,
+        group_by_fingerprint,
 )
 from freezerbox import (
         ReagentConfig, MakerConfig,
         parse_volume_uL, parse_time_m, parse_temp_C, convert_conc_unit,
-        unanimous, group_by_identity, normalize_seq, join_lists,
+        unanimous, normalize_seq, join_lists,
 )
 from byoc import DocoptConfig, Key, Method
 from more_itertools import one
@@ -382,10 +383,10 @@ Template Preparation:
     )
 
     group_by = {
-        'preset': group_by_identity,
-        'volume_uL': group_by_identity,
-        'incubation_times_min': group_by_identity,
-        'incubation_temp_C': group_by_identity,
+        'preset': group_by_fingerprint,
+        'volume_uL': group_by_fingerprint,
+        'incubation_times_min': group_by_fingerprint,
+        'incubation_temp_C': group_by_fingerprint,
     }
     merge_by = {
         'templates': join_lists,
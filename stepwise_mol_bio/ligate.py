@@ -5,9 +5,9 @@ import autoprop
 import byoc
 
 from stepwise import pl, ul
-from stepwise_mol_bio import Assembly
+from stepwise_mol_bio import Assembly, group_by_fingerprint
 from stepwise_mol_bio._assembly import ARGUMENT_DOC, OPTION_DOC
-from freezerbox import MakerConfig, group_by_identity, parse_bool
+from freezerbox import MakerConfig, parse_bool
 from byoc import Key, DocoptConfig
 from inform import plural
 
@@ -58,7 +58,7 @@ Database:
 
     group_by = {
             **Assembly.group_by,
-            'use_kinase': group_by_identity,
+            'use_kinase': group_by_fingerprint,
     }
 
     def get_reaction(self):
@@ -2,8 +2,8 @@
 
 import stepwise, byoc, autoprop
 from stepwise import Quantity
-from stepwise_mol_bio import Cleanup, UsageError
-from freezerbox import MakerConfig, group_by_identity, parse_volume, parse_conc
+from stepwise_mol_bio import Cleanup, UsageError, group_by_fingerprint
+from freezerbox import MakerConfig, parse_volume, parse_conc
 from byoc import DocoptConfig, Key
 from inform import plural
 
@@ -54,8 +54,8 @@ Database:
     )
 
     group_by = {
-        'volume': group_by_identity,
-        'conc': group_by_identity,
+        'volume': group_by_fingerprint,
+        'conc': group_by_fingerprint,
     }
 
     def __init__(self, *, volume=None, conc=None):
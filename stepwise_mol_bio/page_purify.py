@@ -10,11 +10,12 @@ from stepwise import (
 from byoc import Key, Method, DocoptConfig
 from freezerbox import (
         ReagentConfig, MakerConfig, ParseError, unanimous, 
-        convert_conc_unit, group_by_identity, join_lists,
+        convert_conc_unit, join_lists,
         parse_volume_uL as parse_strict_volume_uL,
 )
 from stepwise_mol_bio import (
         Cleanup, Gel, SpinCleanup, ConfigError, bind, comma_list,
+        group_by_fingerprint,
 )
 from operator import not_
 from more_itertools import one
@@ -351,8 +352,8 @@ Database:
     )
 
     group_by = {
-            'preset': group_by_identity,
-            'gel_preset': group_by_identity,
+            'preset': group_by_fingerprint,
+            'gel_preset': group_by_fingerprint,
     }
     merge_by = {
             'samples': join_lists,
@@ -385,7 +386,7 @@ Database:
             sample.load_volume_per_lane_uL = k * sample.volume_per_lane_uL
             sample.num_lanes = int(ceil(sample.volume_uL / sample.volume_per_lane_uL))
 
-        conc_vol_groups = group_by_identity(
+        conc_vol_groups = group_by_fingerprint(
                 self.samples,
                 key=lambda x: (x.stock_conc, x.volume_uL),
         )
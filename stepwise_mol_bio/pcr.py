@@ -1,9 +1,8 @@
 #!/usr/bin/env python3
 
-import stepwise, byoc, autoprop, freezerbox
+import stepwise, byoc, autoprop, freezerbox, re
 from math import sqrt, ceil
-from numbers import Real
-from inform import plural, indent
+from inform import plural, indent, warn
 from byoc import Key, Method, DocoptConfig
 from stepwise import (
         StepwiseConfig, PresetConfig, Quantity, To, UsageError,
@@ -12,20 +11,31 @@ from stepwise import (
 from stepwise_mol_bio import (
         Main, Bindable, BindableReagent, ConfigError,
         comma_set, bind, require_reagent,
-        int_or_expr, float_or_expr, merge_names,
+        int_or_expr, float_or_expr, merge_names, group_by_fingerprint,
 )
 from freezerbox import (
         ReagentConfig, MakerConfig, unanimous,
         parse_volume_uL, parse_temp_C, parse_time_s, parse_size_bp,
-        group_by_identity, join_lists,
+        join_lists,
 )
 from more_itertools import (
         one, first_true, flatten, chunked, all_equal, always_iterable,
+        unique_everseen, collapse,
 )
 from statistics import mean
-from collections.abc import Iterable
 from copy import deepcopy
+from itertools import combinations
+from functools import lru_cache
 from operator import not_
+from ._melting_temp import (
+        MeltingTempConditions, calc_melting_temp_C, calc_melting_temps_C,
+)
+from ._dimers import screen_primers
+from ._gradient import GradientBlock, pack_gradient_runs
+from .thermocycler import (
+        ThermocyclerProgram, Incubation, Repeat, Hold, MeltCurve,
+        MeasureFluorescence, PCR_FORMAT,
+)
 
 # I'd like to support multiple <product> arguments, but first I need 
 # MakerConfig to support multiple products (e.g. call unanimous, then fail 
@@ -34,9 +44,12 @@ from operator import not_
 def find_amplicon(template, primer_1, primer_2, is_template_circular=False):
     from Bio.Seq import reverse_complement
 
+    # The template index is cached, so the template only has to be normalized 
+    # and scanned once no matter how many amplicons are made from it.
+    index = load_template_index(template, is_template_circular)
+
     # This is a temporary solution until I implement full support for IDT-style 
     # sequence strings in freezerbox.
-    template = freezerbox.normalize_seq(template)
     primer_1 = freezerbox.normalize_seq(primer_1)
     primer_2 = freezerbox.normalize_seq(primer_2)
 
@@ -45,12 +58,28 @@ def find_amplicon(template, primer_1, primer_2, is_template_circular=False):
             (primer_2, reverse_complement(primer_1)),
     ]
 
+    amplicon = _find_amplicon(index, primer_pairs)
+
+    # Only consider primers that bind across the origin of a circular template 
+    # if no other amplicon can be found, so that the results are the same as 
+    # they've always been whenever an amplicon could be found before.
+    if amplicon is None and index.is_circular:
+        amplicon = _find_amplicon(index, primer_pairs, junction=True)
+
+    if amplicon is None:
+        raise ValueError("no amplicon found")
+
+    return amplicon
+
+def _find_amplicon(index, primer_pairs, junction=False):
+    template = index.seq
+
     for fwd, rev in primer_pairs:
         # Assume perfect complementarity in the last 15 bases.  This isn't a 
         # good approach; better would be to predict where each oligo would 
         # anneal.  I think I could use Smith-Waterman for this.
-        i = template.find(fwd[-15:  ])
-        j = template.find(rev[   :15])
+        i = index.find(fwd[-15:  ], junction=junction)
+        j = index.find(rev[   :15], junction=junction)
 
         if i < 0 or j < 0:
             continue
@@ -59,7 +88,7 @@ def find_amplicon(template, primer_1, primer_2, is_template_circular=False):
             break
 
         if i > j:
-            if is_template_circular:
+            if index.is_circular:
                 break
             else:
                 continue
@@ -68,16 +97,221 @@ def find_amplicon(template, primer_1, primer_2, is_template_circular=False):
             raise ValueError("primers bind same position")
 
     else:
-        raise ValueError("no amplicon found")
+        return None
 
     if i < j:
         return fwd[:-15] + template[i:j] + rev
     else:
         return fwd[:-15] + template[i:] + template[:j] + rev
 
+def precalc_melting_temps(primers):
+    """
+    Calculate the nearest-neighbor melting temperatures of the given primers
+    in vectorized batches, so that later lookups only hit the cache.
+    """
+    by_conditions = {}
+
+    for primer in primers:
+        try:
+            seq = primer.seq
+            conditions = primer.melting_temp_conditions
+        except AttributeError:
+            continue
+
+        by_conditions.setdefault(conditions, []).append(seq)
+
+    for conditions, seqs in by_conditions.items():
+        calc_melting_temps_C(seqs, conditions)
+
+class TemplateIndex:
+    """
+    The positions of every k-mer in a template sequence.
+
+    This makes it fast to find primer binding sites when many amplicons are 
+    made from the same template.  Only the top strand is indexed; sites on the 
+    bottom strand can be found by looking up the reverse complement of the 
+    primer.  For circular templates, the k-mers that span the origin are 
+    indexed separately, see `find()`.
+    """
+
+    # Building the index takes about as long as scanning the template a few 
+    # dozen times, so it's only worth doing for templates that are used by 
+    # more than a couple of amplicons.  Until then, just scan the template.
+    max_unindexed_lookups = 4
+
+    def __init__(self, template, is_circular=False, k=15):
+        self.seq = freezerbox.normalize_seq(template)
+        self.is_circular = is_circular
+        self.k = k
+
+        self._sites = None
+        self._junction_sites = None
+        self._num_lookups = 0
+
+    def find(self, kmer, junction=False):
+        """
+        Return the first position where the given sequence occurs in the 
+        template, or -1 if it doesn't occur.
+
+        The result is the same as `str.find()`, unless *junction* is true.  In 
+        that case, sites that span the origin of a circular template are also 
+        found, but only if the sequence doesn't occur anywhere else.
+        """
+        if len(kmer) == self.k:
+            self._num_lookups += 1
+
+            if self._sites is None and \
+                    self._num_lookups > self.max_unindexed_lookups:
+                self._build_index()
+
+            if self._sites is not None:
+                i = self._sites.get(kmer, -1)
+                if i < 0 and junction:
+                    i = self._junction_sites.get(kmer, -1)
+                return i
+
+        # Sequences that aren't the same length as the k-mers can't be looked 
+        # up in the index.
+        i = self.seq.find(kmer)
+        if i < 0 and junction and self.is_circular and len(kmer) <= len(self.seq):
+            i = (self.seq + self.seq[:len(kmer) - 1]).find(kmer)
+        return i
+
+    def _build_index(self):
+        seq, k = self.seq, self.k
+        n = len(seq)
+
+        # Iterate backwards so that each k-mer ends up mapped to its first 
+        # occurrence, like `str.find()`.
+        self._sites = {
+                seq[i:i+k]: i
+                for i in range(n - k, -1, -1)
+        }
+        self._junction_sites = {}
+
+        if self.is_circular and n >= k:
+            junction = seq[n-k+1:] + seq[:k-1]
+            self._junction_sites = {
+                    junction[i:i+k]: n - k + 1 + i
+                    for i in range(k - 2, -1, -1)
+            }
+
+@lru_cache(maxsize=128)
+def load_template_index(template, is_circular=False):
+    """
+    Return a (cached) index for the given template sequence.
+    """
+    return TemplateIndex(template, is_circular)
+
 def parse_amplicons_from_docopt(args):
+    if path := args.get('--plate'):
+        return parse_amplicons_from_csv(path)
     return [parse_amplicon(x) for x in args['<amplicons>']]
 
+def parse_amplicons_from_csv(path):
+    """
+    Read amplicons from a CSV file with one row per well.
+
+    The file must have a header row naming the "template", "fwd", and "rev" 
+    columns.  A "well" column is optional.  Any amplicons without a well are 
+    assigned to the wells not used by any other row in order (A1, A2, ...), on 
+    the smallest standard plate that can hold all of them.  Wells that are 
+    given explicitly must be on that plate, and no two rows can use the same 
+    well.  Well names are case-insensitive and may be zero-padded, e.g. "a1", 
+    "A01", and "A1" are all the same well.
+    """
+    import csv
+
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+
+    def get(row, col):
+        value = row.get(col)
+        if not value:
+            err = ConfigError(path=path, col=col, row=row)
+            err.brief = "{path}: missing {col!r} column"
+            err.info += "row: {row}"
+            raise err
+        return value.strip()
+
+    rows = [
+            {k.strip().lower(): v for k, v in row.items() if k}
+            for row in rows
+    ]
+
+    # Rows that are shorter than the header have `None` for the missing 
+    # columns, so don't assume that the "well" column is a string.
+    wells = [(row.get('well') or '').strip() for row in rows]
+    plate_wells = list(iter_wells(len(rows)))
+    given_wells = set()
+
+    for i, well in enumerate(wells):
+        if not well:
+            continue
+
+        try:
+            wells[i] = normalize_well(well)
+        except ValueError:
+            err = ConfigError(path=path, well=well)
+            err.brief = "{path}: can't parse well {well!r}"
+            err.hints += "expected a row letter followed by a column number, e.g. 'A1' or 'H12'"
+            raise err
+
+        if wells[i] not in plate_wells:
+            err = ConfigError(path=path, well=well, n=len(plate_wells))
+            err.brief = "{path}: well {well!r} isn't on a {n}-well plate"
+            err.info += "the plate is the smallest standard plate (96, 384, or 1536 wells) that can hold every row"
+            raise err
+
+        if wells[i] in given_wells:
+            err = ConfigError(path=path, well=well)
+            err.brief = "{path}: well {well!r} used more than once"
+            raise err
+
+        given_wells.add(wells[i])
+
+    free_wells = (x for x in plate_wells if x not in given_wells)
+
+    return [
+            Pcr.Amplicon.from_tags(
+                get(row, 'template'),
+                get(row, 'fwd'),
+                get(row, 'rev'),
+                well=well or next(free_wells),
+            )
+            for row, well in zip(rows, wells)
+    ]
+
+def normalize_well(well):
+    """
+    Return the given well name in the same form used by `iter_wells()`, e.g.
+    "a01" becomes "A1".  Raise `ValueError` if the name can't be parsed.
+    """
+    m = re.fullmatch(r'([A-Za-z]{1,2})0*([1-9][0-9]*)', well.strip())
+    if not m:
+        raise ValueError(f"can't parse well: {well!r}")
+
+    row, col = m.groups()
+    return f'{row.upper()}{col}'
+
+def iter_wells(n):
+    """
+    Yield the names of the wells on the smallest standard plate (96, 384, or 
+    1536 wells) that can hold *n* samples, in row-major order.
+    """
+    for num_rows, num_cols in [(8, 12), (16, 24), (32, 48)]:
+        if n <= num_rows * num_cols:
+            break
+    else:
+        err = ConfigError(n=n)
+        err.brief = "can't fit {n} reactions on a 1536-well plate"
+        raise err
+
+    for i in range(num_rows):
+        row = chr(ord('A') + i) if i < 26 else 'A' + chr(ord('A') + i - 26)
+        for j in range(num_cols):
+            yield f'{row}{j+1}'
+
 def parse_amplicons_from_freezerbox(fields):
     template = fields['template']
     fwd, rev = parse_primers(fields['primers'])
@@ -118,6 +352,87 @@ def temp(x):
 def time(x):
     return float(x)
 
+@lru_cache
+def compile_pcr_program(
+        *,
+        num_cycles,
+        initial_denature_temp_C,
+        initial_denature_time_s,
+        denature_temp_C,
+        denature_time_s,
+        anneal_time_s,
+        extend_temp_C=None,
+        final_extend_temp_C=None,
+        final_extend_time_s=None,
+        melt_curve_low_temp_C=None,
+        melt_curve_high_temp_C=None,
+        melt_curve_temp_step_C=None,
+        melt_curve_time_step_s=None,
+        hold_temp_C=None,
+        qpcr=False,
+):
+    """
+    Return the thermocycler program for the given PCR parameters.
+
+    The annealing temperature and extension time are left unspecified, 
+    because they depend on the primers and the amplicons.  Fill them in with 
+    `ThermocyclerProgram.replace()`.  The extension step is only included if 
+    *extend_temp_C* is given, i.e. for three-step PCR.  Programs are cached, 
+    so each preset is only compiled once.
+    """
+    cycle = [
+            Incubation(denature_temp_C, denature_time_s, name='denature'),
+            Incubation(None, anneal_time_s, name='anneal'),
+    ]
+    if extend_temp_C is not None:
+        cycle += [
+            Incubation(extend_temp_C, None, name='extend'),
+        ]
+    if qpcr:
+        cycle += [
+            MeasureFluorescence(),
+        ]
+
+    steps = [
+            Incubation(
+                initial_denature_temp_C,
+                initial_denature_time_s,
+                name='initial_denature',
+            ),
+            Repeat(num_cycles, tuple(cycle), name='cycles'),
+    ]
+
+    if final_extend_temp_C is not None and final_extend_time_s is not None:
+        steps += [
+            Incubation(
+                final_extend_temp_C,
+                final_extend_time_s,
+                name='final_extend',
+            ),
+        ]
+
+    melt_curve = (
+            melt_curve_low_temp_C,
+            melt_curve_high_temp_C,
+            melt_curve_temp_step_C,
+            melt_curve_time_step_s,
+    )
+    if all(x is not None for x in melt_curve):
+        steps += [
+            MeltCurve(
+                *melt_curve,
+                steps=(MeasureFluorescence(),) if qpcr else (),
+                name='melt_curve',
+            ),
+        ]
+
+    if hold_temp_C:
+        steps += [
+            Hold(hold_temp_C, name='hold'),
+        ]
+
+    return ThermocyclerProgram(steps)
+
 @autoprop.cache
 class Pcr(Main):
     """\
@@ -126,6 +441,7 @@ Amplify a DNA template using polymerase chain reaction (PCR).
 Usage:
     pcr <amplicons>... [-a <°C>] [-x <sec> | -l <kb>] [options]
     pcr (-u <product>) [-a <°C>] [-x <sec> | -l <kb>] [options]
+    pcr (--plate <csv>) [-a <°C>] [-x <sec> | -l <kb>] [options]
 
 Arguments:
     <amplicons>
@@ -151,6 +467,14 @@ Options:
         FreezerBox database.  In this form of the command, all default settings 
         will be taken from the reaction used to synthesize the given product.
 
+    --plate <csv>
+        Read the amplicons from a CSV file with one row per well, e.g. to set 
+        up a whole 96- or 384-well plate.  The file must have a header row 
+        naming the "template", "fwd", and "rev" columns.  A "well" column (e.g. 
+        A1, B12) is optional; if not given, wells are assigned in row-major 
+        order.  The protocol will include a table showing what to add to each 
+        well, in addition to the master mix.
+
     -l --amplicon-length <bp>
         The length of the amplicon in base pairs (bp).  This can be used to 
         calculate an appropriate extension time.
@@ -214,6 +538,12 @@ Options:
         primer mix would've been shown previously with `--only-primer-mix`.  
         This option implies `--force-primer-mix`.
 
+    --skip-primer-check
+        Don't warn about primers that could form dimers with any of the other 
+        primers in the same reaction, or hairpins with themselves.  When 
+        primers are included in the master mix, every primer in the master mix 
+        is checked against every other.
+
     -y --num-cycles <n>
         The number of denature/anneal/extend cycles to perform, e.g. 35.
 
@@ -239,6 +569,30 @@ Options:
         temperature, and the protocol will indicate the corresponding high and 
         low temperatures.
 
+    --gradient-runs
+        If the amplicons need different annealing temperatures, work out how 
+        to run them on as few gradient thermocycler runs as possible.  Each 
+        reaction is assigned to a column of the gradient block whose 
+        temperature is within `--gradient-tolerance` of the reaction's own 
+        annealing temperature, and a separate thermocycler protocol and column 
+        map is shown for each run.  The columns are assumed to be evenly spaced 
+        across the gradient.  The default block geometry can be configured via 
+        the `gradient_block` setting, e.g. `{num_columns=12, num_rows=8, 
+        max_span_C=20}`.
+
+    --gradient-tolerance <°C>
+        How far the temperature of a gradient column can be from the ideal 
+        annealing temperature of the reactions in that column.  The default 
+        is 1°C.
+
+    --gradient-columns <n>
+        The number of columns in the gradient block, i.e. the number of 
+        different annealing temperatures that can be used in one run.
+
+    --gradient-span <°C>
+        The largest temperature difference that the gradient block can 
+        maintain between its first and last columns.
+
     --anneal-time <sec>
         The duration of the annealing step in seconds, e.g. 20.
 
@@ -310,6 +664,8 @@ Options:
     class Amplicon(Bindable, use_app_configs=True):
 
         def _calc_seq(self):
+            from ._primers import load_primer_site_finder
+
             try:
                 return find_amplicon(
                         self.template.seq,
@@ -317,6 +673,18 @@ Options:
                         self.rev.seq,
                         self.template.is_circular,
                 )
+            except ValueError:
+                pass
+
+            # If the primers don't perfectly match the template (e.g. 
+            # mutagenic primers), look for sites where they could anneal with 
+            # a few mismatches.
+            try:
+                finder = load_primer_site_finder(
+                        self.template.seq,
+                        self.template.is_circular,
+                )
+                return finder.find_amplicon(self.fwd.seq, self.rev.seq).seq
             except ValueError:
                 err = ConfigError(
                         template=self.template,
@@ -348,6 +716,10 @@ Options:
                     **kwargs,
             )
 
+        # The well that this amplicon will be set up in, if the reactions are 
+        # being set up in a plate.
+        well = None
+
         def __init__(self, template, fwd, rev, **kwargs):
             self.template = template
             self.fwd = fwd
@@ -379,11 +751,22 @@ Options:
         is_circular = byoc.param('is_circular')
 
     class Primer(BindableReagent, use_app_configs=True):
+
+        def _calc_melting_temp_C(self):
+            return calc_melting_temp_C(self.seq, self.melting_temp_conditions)
+
         seq = byoc.param(
                 Key(ReagentConfig, 'seq'),
         )
         melting_temp_C = byoc.param(
                 Key(ReagentConfig, 'melting_temp_C'),
+                Method(_calc_melting_temp_C, skip=ValueError),
+        )
+        melting_temp_conditions = byoc.param(
+                Key(PresetConfig, 'melting_temp'),
+                Key(StepwiseConfig, 'melting_temp'),
+                cast=MeltingTempConditions.from_config,
+                default=MeltingTempConditions(),
         )
         stock_uM = byoc.param(
                 Key(DocoptConfig, '--primer-stock', cast=float),
@@ -393,6 +776,10 @@ Options:
         )
 
     def _calc_anneal_temp_C(self):
+        # If any melting temperatures need to be calculated, calculate them 
+        # all at once rather than one primer at a time.
+        precalc_melting_temps(flatten(x.primers for x in self.amplicons))
+
         return [
                 self.anneal_temp_func(
                     amplicon.fwd.melting_temp_C,
@@ -506,6 +893,11 @@ Options:
             Key(DocoptConfig, '--only-primer-mix'),
             default=False,
     )
+    check_primers = byoc.param(
+            Key(DocoptConfig, '--skip-primer-check', cast=not_),
+            Key(StepwiseConfig, 'check_primers'),
+            default=True,
+    )
     num_cycles = byoc.param(
             Key(DocoptConfig, '--num-cycles'),
             Key(PresetConfig, 'num_cycles'),
@@ -546,6 +938,29 @@ Options:
             Key(PresetConfig, 'anneal_temp_gradient_C'),
             cast=float,
     )
+    pack_gradient = byoc.param(
+            Key(DocoptConfig, '--gradient-runs'),
+            default=False,
+    )
+    gradient_tolerance_C = byoc.param(
+            Key(DocoptConfig, '--gradient-tolerance'),
+            Key(StepwiseConfig, 'gradient_tolerance_C'),
+            cast=float,
+            default=1,
+    )
+    gradient_block = byoc.param(
+            Key(StepwiseConfig, 'gradient_block'),
+            cast=GradientBlock.from_config,
+            default=GradientBlock(),
+    )
+    gradient_columns = byoc.param(
+            Key(DocoptConfig, '--gradient-columns', cast=int),
+            Method(lambda self: self.gradient_block.num_columns),
+    )
+    gradient_span_C = byoc.param(
+            Key(DocoptConfig, '--gradient-span', cast=float),
+            Method(lambda self: self.gradient_block.max_span_C),
+    )
     anneal_time_s = byoc.param(
             Key(DocoptConfig, '--anneal-time'),
             Key(PresetConfig, 'anneal_time_s'),
@@ -637,8 +1052,8 @@ Options:
     )
 
     group_by = {
-        'preset': group_by_identity,
-        'reaction_volume_uL': group_by_identity,
+        'preset': group_by_fingerprint,
+        'reaction_volume_uL': group_by_fingerprint,
     }
     merge_by = {
         'amplicons': join_lists,
@@ -666,6 +1081,9 @@ Options:
         if not self.only_thermocycler:
             pcr, primer_mix = self.reaction
 
+            if self.check_primers:
+                self._warn_primer_interactions()
+
             # Primer mix (if applicable):
 
             if not self.skip_primer_mix:
@@ -708,6 +1126,12 @@ Options:
                     instructions,
             )
 
+            if self.plate_layout:
+                protocol += pl(
+                        "Add the following to each well:",
+                        pre(self.format_plate_layout(pcr, primer_mix)),
+                )
+
             if self.num_duplicates > 1:
                 instructions += f"Split into {self.num_duplicates} identical {pcr.true_volume} reactions."
             if pcr.true_volume > '50 µL':
@@ -718,97 +1142,157 @@ Options:
         # Thermocycler protocol:
 
         if not self.skip_thermocycler:
-            thermocycler = self.thermocycler_protocol
-            protocol += pl(
-                    "Run the following thermocycler protocol:",
-                    thermocycler,
-            )
+            if self.pack_gradient:
+                runs = self.gradient_runs
+
+                for i, run in enumerate(runs, 1):
+                    title = "Run the following thermocycler protocol"
+                    if len(runs) > 1:
+                        title += f" ({i} of {len(runs)})"
+
+                    if run.is_gradient:
+                        anneal_temp = f'{run.low_temp_C:g}-{run.high_temp_C:g}'
+                    else:
+                        anneal_temp = run.low_temp_C
+
+                    step = pl(
+                            f"{title}:",
+                            self._get_thermocycler_protocol(anneal_temp),
+                    )
+                    if run.is_gradient or len(runs) > 1:
+                        step += pre(self.format_gradient_run(run))
+
+                    protocol += step
+
+            else:
+                thermocycler = self.thermocycler_protocol
+                protocol += pl(
+                        "Run the following thermocycler protocol:",
+                        thermocycler,
+                )
 
         protocol.renumber_footnotes()
         return protocol
 
     def get_thermocycler_protocol(self):
+        return self._get_thermocycler_protocol()
+
+    def get_anneal_temps_C(self):
+        """
+        Return the annealing temperature of each amplicon.
+        """
+        temps = list(collapse([self.anneal_temp_C]))
+        n = len(self.amplicons)
+
+        if len(temps) == 1:
+            temps *= n
+
+        if len(temps) != n:
+            raise UsageError(f"expected {n} annealing temperatures, not {len(temps)}: {temps}")
+
+        try:
+            return [float(x) for x in temps]
+        except ValueError:
+            raise UsageError(f"expected numeric annealing temperatures, not: {temps}") from None
+
+    def get_gradient_runs(self):
+        """
+        Return the thermocycler runs needed to anneal every amplicon within 
+        the gradient tolerance of its ideal temperature.
+
+        See `pack_gradient_runs()` for details.
+        """
+        block = GradientBlock(
+                num_columns=self.gradient_columns,
+                num_rows=self.gradient_block.num_rows,
+                max_span_C=self.gradient_span_C,
+        )
+        try:
+            return pack_gradient_runs(
+                    self.anneal_temps_C,
+                    block=block,
+                    tolerance_C=self.gradient_tolerance_C,
+            )
+        except ValueError as err:
+            raise UsageError(str(err)) from None
+
+    def format_gradient_run(self, run):
+        """
+        Return a table showing which reactions go in each column of the given 
+        gradient run.
+        """
+        def label(amplicon):
+            if amplicon.well:
+                return amplicon.well
+            return f'{amplicon.template.tag}:{amplicon.fwd.tag},{amplicon.rev.tag}'
+
+        temps = self.anneal_temps_C
+        rows = [
+                [
+                    j + 1,
+                    f'{run.column_temps_C[j]:.1f}',
+                    ' '.join(
+                        label(self.amplicons[i]) for i in run.columns[j]
+                    ),
+                    ' '.join(f'{temps[i]:.1f}' for i in run.columns[j]),
+                ]
+                for j in sorted(run.columns)
+        ]
+        header = ['column', 'Ta (°C)', 'reactions', 'ideal Ta (°C)']
+        return stepwise.tabulate(rows, header, align='>><<')
+
+    def get_thermocycler_program(self):
+        """
+        Return the thermocycler program for these reactions.
+
+        The steps are named "initial_denature", "cycles", "denature", 
+        "anneal", "extend", "final_extend", "melt_curve", and "hold", although 
+        some of these will be absent depending on the preset.
+        """
+        def optional(attr):
+            return getattr(self, attr, None)
+
+        program = compile_pcr_program(
+                num_cycles=self.num_cycles,
+                initial_denature_temp_C=self.initial_denature_temp_C,
+                initial_denature_time_s=self.initial_denature_time_s,
+                denature_temp_C=self.denature_temp_C,
+                denature_time_s=self.denature_time_s,
+                anneal_time_s=self.anneal_time_s,
+                extend_temp_C=None if self.two_step else self.extend_temp_C,
+                final_extend_temp_C=optional('final_extend_temp_C'),
+                final_extend_time_s=optional('final_extend_time_s'),
+                melt_curve_low_temp_C=optional('melt_curve_low_temp_C'),
+                melt_curve_high_temp_C=optional('melt_curve_high_temp_C'),
+                melt_curve_temp_step_C=optional('melt_curve_temp_step_C'),
+                melt_curve_time_step_s=optional('melt_curve_time_step_s'),
+                hold_temp_C=self.hold_temp_C,
+                qpcr=self.qpcr,
+        )
 
-        def temp(x):
-            if isinstance(x, Iterable) and not isinstance(x, str):
-                return merge_names(map(temp, x))
-            elif isinstance(x, Real):
-                return f'{x:g}°C'
-            elif x[-1].isdigit():
-                return f'{x}°C'
-            else:
-                return x
-
-        def time(x):
-            if isinstance(x, Iterable):
-                return ','.join(map(temp, x))
-            elif isinstance(x, str):
-                return x
-            elif x < 60:
-                return f'{x:.0f}s'
-            elif x % 60:
-                return f'{x//60:.0f}m{x%60:02.0f}'
-            else:
-                return f'{x//60:.0f} min'
+        changes = {'anneal': {'temp_C': self._get_anneal_step_temp_C()}}
+        if 'extend' in program:
+            changes['extend'] = {'time_s': self.extend_time_s}
 
-        def has_step(step, params=['temp_C', 'time_s']):
-            return all(
-                hasattr(self, f'{step}_{param}')
-                for param in params
-            )
+        return program.replace(**changes)
 
-        def step(step):
-            if not hasattr(self, f'{step}_temp_gradient_C'):
-                t = getattr(self, f'{step}_temp_C')
-            else:
-                t_mid = getattr(self, f'{step}_temp_C')
-                t_mid = mean(always_iterable(t_mid))
-                t_range = getattr(self, f'{step}_temp_gradient_C')
-                t_low = round(t_mid - t_range / 2)
-                t_high = round(t_low + t_range)
-                t = f'{t_low}-{t_high}'
-
-            return f"{temp(t)} for {time(getattr(self, f'{step}_time_s'))}"
-
-        three_step = not self.two_step
-
-        thermocycler_steps = [
-                f"- {step('initial_denature')}",
-                f"- Repeat {getattr(self, 'num_cycles')}x:",
-                f"  - {step('denature')}",
-                f"  - {step('anneal')}",
-        ]
-        if three_step:
-            thermocycler_steps += [
-                f"  - {step('extend')}",
-            ]
-
-        if self.qpcr:
-            thermocycler_steps += [
-                f"  - Measure fluorescence",
-            ]
-
-        if has_step('final_extend'):
-            thermocycler_steps += [
-                f"- {step('final_extend')}",
-            ]
-
-        if has_step('melt_curve', 'low_temp_C high_temp_C temp_step_C time_step_s'.split()):
-            thermocycler_steps += [
-                f"- {self.melt_curve_low_temp_C}-{self.melt_curve_high_temp_C}°C in {time(self.melt_curve_time_step_s)} steps of {self.melt_curve_temp_step_C}°C:",
-            ]
-
-        if self.qpcr:
-            thermocycler_steps += [
-                f"  - Measure fluorescence",
-            ]
-
-        if self.hold_temp_C:
-            thermocycler_steps += [
-                f"- {temp(self.hold_temp_C)} hold",
-            ]
-
-        return pre('\n'.join(thermocycler_steps))
+    def _get_anneal_step_temp_C(self):
+        if not hasattr(self, 'anneal_temp_gradient_C'):
+            return self.anneal_temp_C
+
+        t_mid = mean(always_iterable(self.anneal_temp_C))
+        t_range = self.anneal_temp_gradient_C
+        t_low = round(t_mid - t_range / 2)
+        t_high = round(t_low + t_range)
+        return f'{t_low}-{t_high}'
+
+    def _get_thermocycler_protocol(self, anneal_temp_C=None):
+        program = self.thermocycler_program
+
+        if anneal_temp_C is not None:
+            program = program.replace(anneal={'temp_C': anneal_temp_C})
+
+        return program.format_pre(PCR_FORMAT)
 
     def get_reaction(self):
 
@@ -893,6 +1377,103 @@ Options:
 
         return pcr, primer_mix
 
+    def get_primer_groups(self):
+        """
+        Return a list of the primers that will be in each reaction.
+
+        Primers that are added via the master mix will be in every reaction.
+        """
+        pcr, primer_mix = self.reaction
+
+        def is_shared(key):
+            if key not in pcr:
+                key = 'primer mix'
+            return pcr[key].master_mix
+
+        fwd_shared = is_shared('forward primer')
+        rev_shared = is_shared('reverse primer')
+        all_fwd = [x.fwd for x in self.amplicons]
+        all_rev = [x.rev for x in self.amplicons]
+
+        return [
+                list(unique_everseen([
+                    *(all_fwd if fwd_shared else [amplicon.fwd]),
+                    *(all_rev if rev_shared else [amplicon.rev]),
+                ]))
+                for amplicon in self.amplicons
+        ]
+
+    def get_primer_interactions(self):
+        """
+        Return any primer dimers and hairpins that could form in any of the 
+        reactions, as a tuple of two lists.
+
+        Primers with unknown sequences are skipped.  See `screen_primers()` 
+        for details.
+        """
+        # When the primers are in the master mix, every reaction has the same 
+        # primers, so only check each distinct group once.
+        groups = list(unique_everseen(self.primer_groups, key=tuple))
+        primers = []
+
+        for primer in unique_everseen(flatten(groups)):
+            try:
+                primer.seq
+            except AttributeError:
+                continue
+            else:
+                primers.append(primer)
+
+        indices = {x: i for i, x in enumerate(primers)}
+        pairs = {
+                (indices[a], indices[b])
+                for group in groups
+                for a, b in combinations(group, 2)
+                if a in indices and b in indices
+        }
+        return screen_primers(primers, pairs)
+
+    def get_plate_layout(self):
+        """
+        Return a list of (well, amplicon) tuples, or an empty list if the 
+        reactions aren't being set up in a plate.
+        """
+        if all(x.well is None for x in self.amplicons):
+            return []
+        return [(x.well, x) for x in self.amplicons]
+
+    def format_plate_layout(self, pcr, primer_mix):
+        """
+        Return a table of the reagents that need to be added to each well, 
+        i.e. those that aren't in the master mix.
+        """
+        def get_primer_mix(amplicon):
+            primers = []
+            if 'forward primer' in primer_mix:
+                primers.append(amplicon.fwd.tag)
+            if 'reverse primer' in primer_mix:
+                primers.append(amplicon.rev.tag)
+            return ','.join(primers)
+
+        getters = {
+                'template DNA': lambda x: x.template.tag,
+                'primer mix': get_primer_mix,
+                'forward primer': lambda x: x.fwd.tag,
+                'reverse primer': lambda x: x.rev.tag,
+        }
+        columns = [
+                (f'{key} ({pcr[key].volume})', getter)
+                for key, getter in getters.items()
+                if key in pcr and not pcr[key].master_mix
+        ]
+
+        header = ['well'] + [name for name, _ in columns]
+        rows = [
+                [well] + [getter(amplicon) for _, getter in columns]
+                for well, amplicon in self.plate_layout
+        ]
+        return stepwise.tabulate(rows, header)
+
     def get_templates(self):
         return [x.template for x in self.amplicons]
 
@@ -921,6 +1502,16 @@ Options:
         return set(flatten(x.reagent_tags for x in self.amplicons))
 
 
+    def _warn_primer_interactions(self):
+        dimers, hairpins = self.primer_interactions
+
+        for dimer in dimers:
+            partner = 'itself' if dimer.partner == dimer.primer else dimer.partner
+            warn(f"{dimer.primer}: 3' end may anneal to {partner} ({dimer.length_bp} bp, ΔG = {dimer.dg_kcal_mol:.1f} kcal/mol)")
+
+        for hairpin in hairpins:
+            warn(f"{hairpin.primer}: 3' end may form a hairpin ({hairpin.length_bp} bp, ΔG = {hairpin.dg_kcal_mol:.1f} kcal/mol)")
+
     def _add_template_to_reaction(self, rxn, eval_master_mix):
         tags = [x.tag for x in self.templates]
         rxn['template DNA'].name = merge_names(tags)
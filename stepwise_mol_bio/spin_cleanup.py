@@ -4,8 +4,10 @@ import stepwise, byoc, autoprop
 from inform import warn
 from byoc import Key, Method, DocoptConfig
 from stepwise import StepwiseConfig, PresetConfig, Quantity, oxford_comma
-from stepwise_mol_bio import Cleanup, format_sec, round_down_to_1_sig_fig
-from freezerbox import MakerConfig, group_by_identity, parse_volume_uL, unanimous
+from stepwise_mol_bio import (
+        Cleanup, format_sec, round_down_to_1_sig_fig, group_by_fingerprint,
+)
+from freezerbox import MakerConfig, parse_volume_uL, unanimous
 from more_itertools import always_iterable
 from tidyexc import only_raise
 
@@ -320,10 +322,10 @@ Database:
     )
 
     group_by = {
-            'preset': group_by_identity,
-            'elute_buffer': group_by_identity,
-            'elute_volume_uL': group_by_identity,
-            'expected_yield': group_by_identity,
+            'preset': group_by_fingerprint,
+            'elute_buffer': group_by_fingerprint,
+            'elute_volume_uL': group_by_fingerprint,
+            'expected_yield': group_by_fingerprint,
     }
 
     def __init__(self, preset=None):
@@ -1,28 +1,26 @@
 #!/usr/bin/env python3
 
+"""\
+Describe thermocycler programs.
+
+Programs are made of step objects (e.g. `Incubation`, `Repeat`), which can be 
+named so that protocols like PCR can customize specific steps (e.g. the 
+annealing temperature) of an otherwise preconfigured program.
+"""
+
 import stepwise
 import autoprop
 import byoc
 
-from stepwise import pl, ul
-from stepwise_mol_bio import Main, UsageError
+from stepwise import pl, ul, pre
+from stepwise_mol_bio import Main, UsageError, merge_names
 from freezerbox import parse_temp_C, parse_time_s, format_time_s
 from byoc import Key, DocoptConfig
-from more_itertools import first
-
-# I thought of a way for this code to accommodate arbitrary user-configured 
-# thermocycler protocols in the context of PCR.  This issue is that the PCR 
-# protocol needs to tweak certain parts of the thermocycler protocol, e.g. 
-# setting the annealing temperature and extension time.  That would be hard to 
-# do now, but easy to do if a name could be associated with each step.  Here's 
-# specifically what I'm thinking:
-#
-# - Allow each step dictionary to have a name.
-# - Replace the dictionaries with actual objects, than abstract the process of 
-#   setting temperatures etc.  This is important because there's no point 
-#   accessing individual steps if you can't easily mutate them.  The API can 
-#   stay the same: just convert the dicts into these objects on intake.
-# - Save a mapping between names and these objects.
+from dataclasses import dataclass, replace
+from collections.abc import Callable, Iterable
+from numbers import Real
+from math import floor
+from copy import copy
 
 def parse_thermocycler_steps(step_strs):
     # The command-line interface only supports "regular" incubation steps.
@@ -51,68 +49,436 @@ def parse_thermocycler_step(step_str):
             'time_s': parse_time_s(time_str, default_unit='s'),
     }
 
-def format_thermocycler_steps(given, *, incubate_prefix=False):
-    normalize_temp_time(given)
+@dataclass(frozen=True)
+class Incubation:
+    """
+    Hold the reactions at the given temperature for the given amount of time.
 
-    match given:
-        case list():
-            return ul.from_iterable(
-                    format_thermocycler_steps(
-                        x,
-                        incubate_prefix=incubate_prefix,
-                    )
-                    for x in given if x is not None
+    Either value can also be a string, which will be displayed as-is, e.g. a 
+    temperature gradient like '55-65'.  The temperature can also be a list, 
+    if different reactions need different temperatures.
+    """
+    temp_C: object
+    time_s: object
+    name: str = None
+
+@dataclass(frozen=True)
+class Hold:
+    """
+    Hold the reactions at the given temperature until they're removed from 
+    the thermocycler.
+    """
+    temp_C: object
+    name: str = None
+
+@dataclass(frozen=True)
+class Repeat:
+    """
+    Repeat the given steps the given number of times.
+    """
+    num_cycles: int
+    steps: tuple
+    name: str = None
+
+@dataclass(frozen=True)
+class MeltCurve:
+    """
+    Raise the temperature in small increments, performing the given steps 
+    (e.g. measuring fluorescence) at each one.
+    """
+    low_temp_C: float
+    high_temp_C: float
+    temp_step_C: float
+    time_step_s: float
+    steps: tuple = ()
+    name: str = None
+
+@dataclass(frozen=True)
+class MeasureFluorescence:
+    name: str = None
+
+def format_temp_C(x):
+    if isinstance(x, str):
+        return x
+    if isinstance(x, Iterable):
+        return ','.join(map(format_temp_C, x))
+    return f'{x:g}°C'
+
+def format_time(x):
+    if isinstance(x, str):
+        return x
+    return format_time_s(int(x))
+
+def format_pcr_temp_C(x):
+    if isinstance(x, Iterable) and not isinstance(x, str):
+        return merge_names(map(format_pcr_temp_C, x))
+    elif isinstance(x, Real):
+        return f'{x:g}°C'
+    elif x[-1].isdigit():
+        return f'{x}°C'
+    else:
+        return x
+
+def format_pcr_time(x):
+    if isinstance(x, str):
+        return x
+    elif x < 60:
+        return f'{x:.0f}s'
+    elif x % 60:
+        return f'{x//60:.0f}m{x%60:02.0f}'
+    else:
+        return f'{x//60:.0f} min'
+
+@dataclass(frozen=True)
+class ThermocyclerFormat:
+    """
+    How to describe each kind of thermocycler step.
+    """
+    format_temp: Callable = format_temp_C
+    format_time: Callable = format_time
+    incubation: str = '{temp} for {time}'
+    hold: str = 'Hold at {temp}'
+    repeat: str = 'Repeat {num_cycles}x:'
+    melt_curve: str = '{low_temp_C}-{high_temp_C}°C in {time_step} steps of {temp_step_C}°C:'
+    measure_fluorescence: str = 'Measure fluorescence'
+
+DEFAULT_FORMAT = ThermocyclerFormat()
+PCR_FORMAT = ThermocyclerFormat(
+        format_temp=format_pcr_temp_C,
+        format_time=format_pcr_time,
+        hold='{temp} hold',
+)
+
+@autoprop
+class ThermocyclerProgram:
+    """
+    A thermocycler program, i.e. a sequence of steps like incubations, 
+    repeats, and holds.
+
+    Any step can be given a name, which makes it possible to cheaply make a 
+    copy of the program with different parameters for that step, see 
+    `replace()`.  This way a program can be built once (e.g. for each 
+    preset), and then customized for each reaction.  The text describing the 
+    program is likewise compiled once per format, and reused thereafter.
+    """
+
+    def __init__(self, steps):
+        self.steps = tuple(steps)
+        self._paths = _index_steps(self.steps)
+        self._compiled = {}
+
+    @classmethod
+    def from_dicts(cls, given):
+        """
+        Create a program from a list of dictionaries, e.g. from a preset.
+
+        Incubations are dictionaries with temperature (`temp_C` or `temp`) and 
+        time (`time_s`, `time_m`, `time_h`, or `time`) keys.  The keys without 
+        units take strings, which are displayed as-is.  Holds are dictionaries 
+        with a `hold_C` key, and repeats are dictionaries with `repeat` (the 
+        number of cycles) and `steps` keys.  Melt curves are dictionaries with 
+        `low_temp_C`, `high_temp_C`, `temp_step_C`, `time_step_s`, and 
+        optionally `steps` keys.  The string 'fluorescence' indicates that 
+        fluorescence should be measured.  Any dictionary can also have a 
+        `name` key.
+        """
+        if isinstance(given, cls):
+            return given
+        return cls(_parse_steps(given))
+
+    def __iter__(self):
+        yield from self.steps
+
+    def __len__(self):
+        return len(self.steps)
+
+    def __contains__(self, name):
+        return name in self._paths
+
+    def __getitem__(self, name):
+        step = None
+        steps = self.steps
+        for i in self._find_path(name):
+            step = steps[i]
+            steps = getattr(step, 'steps', ())
+        return step
+
+    def __eq__(self, other):
+        if not isinstance(other, ThermocyclerProgram):
+            return NotImplemented
+        return self.steps == other.steps
+
+    def __repr__(self):
+        return f'{self.__class__.__qualname__}({list(self.steps)!r})'
+
+    def replace(self, **changes):
+        """
+        Return a copy of this program where the named steps have the given 
+        parameters, e.g. `program.replace(anneal={'temp_C': 60})`.
+
+        Only the named steps (and the steps that contain them) are copied.
+        """
+        steps = self.steps
+        for name, params in changes.items():
+            steps = _replace_step(steps, self._find_path(name), params)
+
+        program = copy(self)
+        program.steps = steps
+        program._compiled = {}
+
+        if any('name' in x for x in changes.values()):
+            program._paths = _index_steps(steps)
+
+        return program
+
+    def compile(self, format=DEFAULT_FORMAT):
+        """
+        Return a tuple with the depth, step, and text of each line needed to 
+        describe this program.
+        """
+        try:
+            return self._compiled[format]
+        except KeyError:
+            lines = self._compiled[format] = tuple(
+                    _compile_steps(self.steps, format)
             )
+            return lines
 
-        case {'temp': temp_str, 'time': time_str}:
-            step = f'{temp_str} for {time_str}'
-            return f'Incubate at {step}.' if incubate_prefix else step
+    def format_ul(self, format=DEFAULT_FORMAT, *, incubate_prefix=False):
+        """
+        Describe this program as a bulleted list.
 
-        case {'hold_C': hold_C}:
-            return f'Hold at {hold_C:g}°C'
+        If *incubate_prefix* is true, top-level incubations are written as 
+        complete sentences, e.g. "Incubate at 37°C for 5m."
+        """
+        return ul(*self._format_items(format, incubate_prefix=incubate_prefix))
 
+    def format_pre(self, format=PCR_FORMAT):
+        """
+        Describe this program as preformatted text, which is more compact 
+        than a nested list.
+        """
+        return pre('\n'.join(
+                f"{'  ' * depth}- {text}"
+                for depth, _, text in self.compile(format)
+        ))
+
+    def get_run_time_s(self):
+        return self.calc_run_time_s()
+
+    def calc_run_time_s(self, ramp_rate_C_s=None):
+        """
+        Return the amount of time needed to run this program, in seconds.
+
+        Holds don't count, since they last until the reactions are removed 
+        from the thermocycler.  By default, the time spent changing 
+        temperature isn't counted either.  To include it, specify how quickly 
+        the thermocycler can heat and cool the block, in °C/s.  Gradients are 
+        counted using their highest temperature.
+        """
+        run_time_s = 0
+        prev_temp_C = None
+
+        for temp_C, time_s in _iter_incubations(self.steps):
+            run_time_s += time_s
+
+            if ramp_rate_C_s and temp_C is not None:
+                if prev_temp_C is not None:
+                    run_time_s += abs(temp_C - prev_temp_C) / ramp_rate_C_s
+                prev_temp_C = temp_C
+
+        return run_time_s
+
+    def _find_path(self, name):
+        try:
+            return self._paths[name]
+        except KeyError:
+            raise UsageError(f"no thermocycler step named {name!r}") from None
+
+    def _format_items(self, format, *, incubate_prefix=False):
+        lines = self.compile(format)
+
+        def nest(i, depth):
+            items = []
+            while i < len(lines) and lines[i][0] == depth:
+                _, step, text = lines[i]
+                i += 1
+
+                if depth == 0 and incubate_prefix and isinstance(step, Incubation):
+                    text = f'Incubate at {text}.'
+
+                if i < len(lines) and lines[i][0] > depth:
+                    children, i = nest(i, depth + 1)
+                    text = pl(text, ul(*children), br='\n')
+
+                items.append(text)
+
+            return items, i
+
+        items, _ = nest(0, 0)
+        return items
+
+def format_thermocycler_steps(given, *, incubate_prefix=False):
+    """
+    Describe the given thermocycler steps as a bulleted list.
+
+    The steps can be a `ThermocyclerProgram` or a list of steps, in which case 
+    a `ul` is returned.  Alternatively, a single step can be given, in which 
+    case just the description of that step is returned.  Steps can be either 
+    step objects (e.g. `Incubation`) or dictionaries, see 
+    `ThermocyclerProgram.from_dicts()`.
+    """
+    if isinstance(given, (list, ThermocyclerProgram)):
+        return ThermocyclerProgram.from_dicts(given).format_ul(
+                incubate_prefix=incubate_prefix,
+        )
+
+    program = ThermocyclerProgram([_parse_step(given)])
+    item, = program._format_items(DEFAULT_FORMAT, incubate_prefix=incubate_prefix)
+    return item
+
+def _parse_steps(given):
+    return tuple(_parse_step(x) for x in given if x is not None)
+
+def _parse_step(given):
+    if isinstance(given, _STEP_TYPES):
+        return given
+
+    name = given.get('name') if isinstance(given, dict) else None
+
+    match given:
         case {'repeat': n, 'steps': steps}:
-            return pl(
-                    f'Repeat {n}x:',
-                    format_thermocycler_steps(steps),
-                    br='\n',
-            )
-        # Melt curves...
+            return Repeat(n, _parse_steps(steps), name=name)
+
+        case {'hold_C': hold_C}:
+            return Hold(hold_C, name=name)
+
+        case {
+                'low_temp_C': low, 'high_temp_C': high,
+                'temp_step_C': step, 'time_step_s': time_step,
+        }:
+            steps = _parse_steps(given.get('steps', []))
+            return MeltCurve(low, high, step, time_step, steps, name=name)
+
         case 'fluorescence':
-            return "Measure fluorescence"
+            return MeasureFluorescence()
 
-        case err:
-            raise UsageError("unexpected step in thermocycler protocol: {err!r}", err=err)
+        case dict():
+            temp = _pick_one(given, {
+                    'temp': lambda x: x,
+                    'temp_C': lambda x: x,
+            })
+            time = _pick_one(given, {
+                    'time': lambda x: x,
+                    'time_s': lambda x: x,
+                    'time_m': lambda x: 60 * x,
+                    'time_h': lambda x: 3600 * x,
+            })
+            if temp is not None and time is not None:
+                return Incubation(temp, time, name=name)
 
-def normalize_temp_time(given):
-    if not isinstance(given, dict):
-        return
+    raise UsageError("unexpected step in thermocycler protocol: {err!r}", err=given)
 
-    time_formatters = {
-            'time': lambda x: x,
-            'time_s': lambda x: format_time_s(int(x)),
-            'time_m': lambda x: format_time_s(int(60 * x)),
-            'time_h': lambda x: format_time_m(int(60 * x)),
-    }
-    temp_formatters = {
-            'temp': lambda x: x,
-            'temp_C': lambda x: f'{x:g}°C'
-    }
+def _pick_one(given, converters):
+    keys = [k for k in converters if k in given]
+
+    if not keys:
+        return None
+    if len(keys) > 1:
+        raise UsageError(f"found multiple values for single thermocycler parameter: {', '.join(map(repr, keys))}")
+
+    key, = keys
+    return converters[key](given[key])
+
+def _index_steps(steps, path=()):
+    paths = {}
+
+    for i, step in enumerate(steps):
+        if step.name is not None:
+            if step.name in paths:
+                raise UsageError(f"found multiple thermocycler steps named {step.name!r}")
+            paths[step.name] = path + (i,)
 
-    def normalize(given, formatters):
-        keys = set(given) & set(formatters)
+        for name, subpath in _index_steps(getattr(step, 'steps', ()), path + (i,)).items():
+            if name in paths:
+                raise UsageError(f"found multiple thermocycler steps named {name!r}")
+            paths[name] = subpath
 
-        if not keys:
-            return
-        if len(keys) > 1:
-            raise UsageError(f"found multiple values for single thermocycler parameter: {repr_join(k for k in formatters if k in params)}")
+    return paths
 
-        key = keys.pop()
-        normalized_key = first(formatters)
-        given[normalized_key] = formatters[key](given.pop(key))
-    
-    normalize(given, time_formatters)
-    normalize(given, temp_formatters)
+def _replace_step(steps, path, params):
+    i, *path = path
+
+    if path:
+        step = replace(steps[i], steps=_replace_step(steps[i].steps, path, params))
+    else:
+        step = replace(steps[i], **params)
+
+    return steps[:i] + (step,) + steps[i+1:]
+
+def _compile_steps(steps, format, depth=0):
+    for step in steps:
+        match step:
+            case Incubation():
+                text = format.incubation.format(
+                        temp=format.format_temp(step.temp_C),
+                        time=format.format_time(step.time_s),
+                )
+            case Hold():
+                text = format.hold.format(temp=format.format_temp(step.temp_C))
+            case Repeat():
+                text = format.repeat.format(num_cycles=step.num_cycles)
+            case MeltCurve():
+                text = format.melt_curve.format(
+                        low_temp_C=step.low_temp_C,
+                        high_temp_C=step.high_temp_C,
+                        temp_step_C=step.temp_step_C,
+                        time_step=format.format_time(step.time_step_s),
+                )
+            case MeasureFluorescence():
+                text = format.measure_fluorescence
+
+        yield depth, step, text
+        yield from _compile_steps(getattr(step, 'steps', ()), format, depth + 1)
+
+def _iter_incubations(steps):
+    # Yield the temperature and duration of every incubation, in the order 
+    # they happen.  Holds are included (with no duration) because the block 
+    # still has to reach the hold temperature.
+    for step in steps:
+        match step:
+            case Incubation():
+                yield _parse_run_temp_C(step.temp_C), _parse_run_time_s(step.time_s)
+            case Hold():
+                yield _parse_run_temp_C(step.temp_C), 0
+            case Repeat():
+                for _ in range(step.num_cycles):
+                    yield from _iter_incubations(step.steps)
+            case MeltCurve():
+                n = floor((step.high_temp_C - step.low_temp_C) / step.temp_step_C + 1e-6)
+                for i in range(n + 1):
+                    yield step.low_temp_C + i * step.temp_step_C, step.time_step_s
+                    yield from _iter_incubations(step.steps)
+
+def _parse_run_temp_C(x):
+    if isinstance(x, Real):
+        return x
+    if isinstance(x, str):
+        x = x.replace('°C', '').split('-')
+    try:
+        return max(float(xi) for xi in x)
+    except ValueError:
+        return None
+
+def _parse_run_time_s(x):
+    if isinstance(x, Real):
+        return x
+    try:
+        return parse_time_s(x, default_unit='s')
+    except Exception:
+        raise UsageError(f"can't calculate thermocycler run time: unknown duration {x!r}") from None
+
+_STEP_TYPES = Incubation, Hold, Repeat, MeltCurve, MeasureFluorescence
 
 @autoprop
 class Thermocycler(Main):
@@ -142,15 +508,23 @@ Arguments:
 
     def get_protocol(self):
         p = stepwise.Protocol()
-        if len(self.steps) == 1:
-            p += format_thermocycler_steps(self.steps[0], incubate_prefix=True)
+        program = self.program
+
+        if len(program) == 1:
+            p += format_thermocycler_steps(program.steps[0], incubate_prefix=True)
         else:
             p += pl(
                     'Run the following thermocycler protocol:',
-                    format_thermocycler_steps(self.steps),
+                    program.format_ul(),
             )
         return p
 
+    def get_program(self):
+        return ThermocyclerProgram.from_dicts(self.steps)
+
+    def get_run_time_s(self):
+        return self.program.run_time_s
+
     __config__ = [DocoptConfig]
     steps = byoc.param(
             Key(DocoptConfig, '<steps>', cast=parse_thermocycler_steps),
@@ -7,11 +7,11 @@ from stepwise import (
 )
 from stepwise_mol_bio import (
         Main, Bindable, BindableReagent, UsageError,
-        bind, comma_list,
+        bind, comma_list, group_by_fingerprint,
 )
 from freezerbox import (
         MakerConfig, ProductConfig, ReagentConfig, Plasmid, Strain,
-        parse_bool, join_lists, group_by_identity, unanimous,
+        parse_bool, join_lists, unanimous,
 )
 from byoc import Key, Method, DocoptConfig
 from itertools import combinations
@@ -416,7 +416,7 @@ Options:
     )
 
     group_by = {
-            'preset': group_by_identity,
+            'preset': group_by_fingerprint,
     }
     merge_by = {
             'transformations': join_lists,
@@ -5,7 +5,7 @@ import freezerbox
 def ignore_external_freezerbox_db(monkeypatch):
     mock_db = freezerbox.Database({})
     mock_db.name = "WARNING: ACCESSING EXTERNAL DATABASE"
-    mock_db_factory = lambda: mock_db
+    mock_db_factory = lambda *args, **kwargs: mock_db
 
     monkeypatch.setattr(freezerbox, 'load_db', mock_db_factory)
     monkeypatch.setattr(freezerbox.model, 'load_db', mock_db_factory)
@@ -0,0 +1,63 @@
+import pytest
+from stepwise_mol_bio._batch import *
+from stepwise_mol_bio import UsageError
+
+def test_parse_commands():
+    lines = [
+            '# comment\n',
+            'pcr p1,o1,o2\n',
+            '\n',
+            "stepwise thermocycler '95/30' # trailing comment\n",
+    ]
+    assert list(parse_commands(lines)) == [
+            (2, ['pcr', 'p1,o1,o2']),
+            (4, ['thermocycler', '95/30']),
+    ]
+
+def test_parse_commands_err():
+    lines = [
+            'pcr p1,o1,o2\n',
+            "thermocycler '95/30\n",
+    ]
+    with pytest.raises(UsageError) as err:
+        list(parse_commands(lines, 'commands.txt'))
+
+    assert err.match(r"commands.txt:2: can't parse command")
+    assert err.match(r"line: thermocycler '95/30")
+    assert err.match(r"No closing quotation")
+
+    with pytest.raises(UsageError, match=r"<stdin>:1: can't parse command"):
+        list(parse_commands(['pcr "p1\n']))
+
+def test_run_batch(tmp_path):
+    commands = [
+            (1, ['thermocycler', '95/30']),
+            (2, ['not_a_protocol']),
+            (3, ['thermocycler', '60/30']),
+    ]
+    out_dir = tmp_path / 'out'
+    results = run_batch(commands, cwd=tmp_path, out_dir=out_dir)
+
+    assert [x.status for x in results] == [0, 1, 0]
+    assert [x.line_num for x in results] == [1, 2, 3]
+    assert "unknown protocol: 'not_a_protocol'" in results[1].stderr
+    assert all(x.time_s > 0 for x in results)
+
+    assert results[0].path == out_dir / '01_thermocycler.txt'
+    assert results[0].path.read_text() == '1. Incubate at 95°C for 30s.\n'
+    assert results[1].path is None
+    assert results[2].path == out_dir / '03_thermocycler.txt'
+    assert results[2].path.read_text() == '1. Incubate at 60°C for 30s.\n'
+
+def test_format_summary():
+    results = [
+            BatchResult(1, ['pcr', 'p1,o1,o2'], 0, b'', '', 0.010),
+            BatchResult(3, ['digest', 'p1', 'XmnI'], 1, b'', '', 0.005),
+    ]
+    summary = format_summary(results)
+
+    assert 'pcr p1,o1,o2' in summary
+    assert 'digest p1 XmnI' in summary
+    assert '2 commands' in summary
+    assert '1 errors' in summary
+    assert '15' in summary.splitlines()[-1]
@@ -0,0 +1,294 @@
+import pytest
+import autoprop
+import stepwise
+import freezerbox
+import stepwise_mol_bio
+
+from inform import warn, display
+from stepwise_mol_bio import Main, iter_maker_protocols
+from stepwise_mol_bio._cache import *
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = ProtocolCache(tmp_path / 'protocols.sqlite')
+    monkeypatch.setattr(ProtocolCache, 'from_config', lambda: cache)
+    return cache
+
+def make_db(seq='ATGC'):
+    from freezerbox.loaders.excel import _defer
+
+    db = freezerbox.Database({})
+    db['p1'] = freezerbox.Plasmid(seq=seq, ready=_defer(bool, 'yes'))
+    db['p2'] = freezerbox.Plasmid(seq='GATTACA')
+    return db
+
+@autoprop
+class MockApp(Main):
+
+    def __init__(self, db=None, uses_db=False, warning=None):
+        super().__init__()
+        if db is not None:
+            self.db = db
+        self.uses_db = uses_db
+        self.warning = warning
+        self.num_renders = 0
+        self.products = []
+
+    def get_protocol(self):
+        if self.uses_db:
+            self.db
+        if self.warning:
+            warn(self.warning, culprit=self.__class__.__name__)
+
+        self.num_renders += 1
+        return stepwise.Protocol(steps=[f"render {self.num_renders}"])
+
+def test_get_put(cache):
+    assert cache.get('a') is None
+
+    cache.put('a', stepwise.Protocol(steps=['A']))
+    assert cache.get('a').protocol.steps == ['A']
+    assert cache.get('a').db_fingerprint is None
+    assert cache.get('b') is None
+
+    cache.clear()
+    assert cache.get('a') is None
+
+def test_evict_size(cache):
+    cache.max_size_MB = 1e-6 * 600
+    cache.EVICT_INTERVAL = 1
+
+    for i in range(5):
+        cache.put(str(i), stepwise.Protocol(steps=[str(i) * 100]))
+
+    # Only the most recently used entries should remain.
+    keys = [str(i) for i in range(5) if cache.get(str(i))]
+    assert 0 < len(keys) < 5
+    assert keys == [str(i) for i in range(5 - len(keys), 5)]
+
+def test_evict_interval(cache, monkeypatch):
+    num_evictions = 0
+
+    def evict():
+        nonlocal num_evictions
+        num_evictions += 1
+
+    monkeypatch.setattr(cache, 'evict', evict)
+    cache.EVICT_INTERVAL = 3
+
+    for i in range(7):
+        cache.put(str(i), stepwise.Protocol(steps=[str(i)]))
+
+    assert num_evictions == 3
+
+def test_evict_age(cache):
+    cache.put('a', stepwise.Protocol(steps=['A']))
+    assert cache.get('a')
+
+    cache.max_age_days = -1
+    cache.evict()
+    assert cache.get('a') is None
+
+def test_stable_repr():
+    db1, db2 = make_db(), make_db()
+    assert db1['p1']._attrs['ready'] is not db2['p1']._attrs['ready']
+    assert stable_repr(db1['p1']._attrs) == stable_repr(db2['p1']._attrs)
+    assert ' at 0x' not in stable_repr(db1['p1']._attrs)
+
+def test_fingerprint_db():
+    assert fingerprint_db(make_db()) == fingerprint_db(make_db())
+    assert fingerprint_db(make_db()) != fingerprint_db(make_db('ATGCATGC'))
+
+def test_load_protocol(cache):
+    db = make_db()
+    app = MockApp(db)
+
+    assert load_protocol(app, ['a']).steps == ['render 1']
+    assert load_protocol(app, ['a']).steps == ['render 1']
+    assert load_protocol(app, ['b']).steps == ['render 2']
+
+    # Reloading the database shouldn't invalidate the cache...
+    app.db = make_db()
+    assert load_protocol(app, ['a']).steps == ['render 1']
+
+    # ...unless the database changed.
+    app.db = make_db('ATGCATGC')
+    assert load_protocol(app, ['a']).steps == ['render 3']
+
+def test_load_protocol_lazy_db(cache, tmp_path, monkeypatch):
+    db_path = tmp_path / 'db.xlsx'
+    db_path.write_text('a')
+
+    config = {'use': 'test', 'database': {'test': [{'path': str(db_path)}]}}
+    num_loads = 0
+
+    def load_db():
+        nonlocal num_loads
+        num_loads += 1
+        return freezerbox.Database(config)
+
+    monkeypatch.setattr(freezerbox, 'load_db', load_db)
+    monkeypatch.setattr('freezerbox.config.load_config', lambda: config)
+
+    # The database isn't loaded to check the cache, unless the protocol uses 
+    # it.
+    app = MockApp()
+    assert load_protocol(app, ['a']).steps == ['render 1']
+    assert load_protocol(app, ['a']).steps == ['render 1']
+    assert num_loads == 0
+
+    app = MockApp(uses_db=True)
+    assert load_protocol(app, ['b']).steps == ['render 1']
+    assert num_loads == 1
+
+    app = MockApp(uses_db=True)
+    assert load_protocol(app, ['b']).steps == ['render 1']
+    assert app.num_renders == 0
+    assert num_loads == 1
+
+    # Protocols that used the database are rendered again if any of the 
+    # database files change.
+    db_path.write_text('ab')
+    app = MockApp(uses_db=True)
+    assert load_protocol(app, ['b']).steps == ['render 1']
+    assert app.num_renders == 1
+    assert num_loads == 2
+
+def test_load_protocol_warnings(cache, capsys):
+    app = MockApp(make_db(), warning="primers may dimerize")
+    assert load_protocol(app, ['a']).steps == ['render 1']
+    assert 'MockApp: primers may dimerize' in capsys.readouterr().err
+
+    # The warnings are shown again when the protocol is taken from the cache.
+    app = MockApp(make_db(), warning="primers may dimerize")
+    assert load_protocol(app, ['a']).steps == ['render 1']
+    assert app.num_renders == 0
+    assert 'MockApp: primers may dimerize' in capsys.readouterr().err
+
+def test_record_warnings(capsys):
+    with record_warnings() as outer:
+        warn("a")
+        with record_warnings() as inner:
+            warn("b", culprit='x')
+        display("c")
+
+    assert outer == [(("a",), {}), (("b",), {'culprit': 'x'})]
+    assert inner == [(("b",), {'culprit': 'x'})]
+
+    err = capsys.readouterr().err
+    assert "a" in err
+    assert "x: b" in err
+
+def test_load_protocol_bypass(cache, monkeypatch):
+    monkeypatch.undo()
+    monkeypatch.setenv('STEPWISE_MOL_BIO_NO_CACHE', '1')
+
+    app = MockApp(make_db())
+    assert load_protocol(app, ['a']).steps == ['render 1']
+    assert load_protocol(app, ['a']).steps == ['render 2']
+
+def test_load_protocol_argv_files(cache, tmp_path):
+    path = tmp_path / 'plate.csv'
+    path.write_text('a')
+
+    app = MockApp(make_db())
+    assert load_protocol(app, [str(path)]).steps == ['render 1']
+    assert load_protocol(app, [str(path)]).steps == ['render 1']
+
+    # Files named on the command line are part of the key.
+    path.write_text('ab')
+    assert load_protocol(app, [str(path)]).steps == ['render 2']
+    assert load_protocol(app, [f'--plate={path}']).steps == ['render 3']
+
+    # Protocols that read directories or stdin aren't cached.
+    assert load_protocol(app, [str(tmp_path)]).steps == ['render 4']
+    assert load_protocol(app, [str(tmp_path)]).steps == ['render 5']
+    assert load_protocol(app, ['-']).steps == ['render 6']
+    assert load_protocol(app, ['-']).steps == ['render 7']
+
+def test_fingerprint_argv(tmp_path):
+    path = tmp_path / 'plate.csv'
+    path.write_text('a')
+
+    fp = fingerprint_argv(['p1', str(path)])
+    assert fp == fingerprint_argv(['p1', str(path)])
+    assert fp != fingerprint_argv(['p1'])
+
+    path.write_text('ab')
+    assert fp != fingerprint_argv(['p1', str(path)])
+
+    # Arguments that can't be paths are ignored.
+    assert fingerprint_argv(['A' * 10000, 'a\0b']) == ()
+
+    assert fingerprint_argv([str(tmp_path)]) is None
+    assert fingerprint_argv([f'--dir={tmp_path}']) is None
+    assert fingerprint_argv(['-']) is None
+
+def test_from_config_opt_in(monkeypatch):
+    monkeypatch.delenv('STEPWISE_MOL_BIO_NO_CACHE', raising=False)
+    assert ProtocolCache.from_config() is None
+
+def test_main_no_cache(cache, monkeypatch):
+    from stepwise_mol_bio import Aliquot
+
+    printed = []
+    monkeypatch.setattr(stepwise.Protocol, 'print', lambda self: printed.append(self))
+
+    def count_rows():
+        return cache._connect().execute(
+                'SELECT COUNT(*) FROM protocols'
+        ).fetchone()[0]
+
+    monkeypatch.setattr('sys.argv', ['aliquot', '5 µL', '--no-cache'])
+    Aliquot.main()
+    assert count_rows() == 0
+
+    monkeypatch.setattr('sys.argv', ['aliquot', '5 µL'])
+    Aliquot.main()
+    assert count_rows() == 1
+
+    assert len(printed) == 2
+    assert printed[0].steps == printed[1].steps
+
+def test_iter_maker_protocols(cache):
+    db = make_db()
+    makers = [MockApp(db), MockApp(db)]
+    makers[0].products = [db['p1']]
+    makers[1].products = [db['p2']]
+
+    results = list(iter_maker_protocols(makers, workers=1, cache=cache))
+    assert [x[0] for x in results] == makers
+    assert [x[1].steps for x in results] == [['render 1'], ['render 1']]
+
+    db = make_db()
+    makers = [MockApp(db), MockApp(db), MockApp(db)]
+    makers[0].products = [db['p1']]
+    makers[1].products = [db['p2']]
+    makers[2].products = [db['p1'], db['p2']]
+
+    results = list(iter_maker_protocols(makers, workers=1, cache=cache))
+    assert [x[0] for x in results] == makers
+    assert [x.num_renders for x in makers] == [0, 0, 1]
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_iter_maker_protocols_warnings(cache, capfd, workers):
+    db = make_db()
+
+    def make_makers():
+        makers = [MockApp(db, warning=f"warning {i}") for i in range(2)]
+        makers[0].products = [db['p1']]
+        makers[1].products = [db['p2']]
+        return makers
+
+    list(iter_maker_protocols(make_makers(), workers=workers, cache=cache))
+    err = capfd.readouterr().err
+    assert 'warning 0' in err
+    assert 'warning 1' in err
+
+    makers = make_makers()
+    list(iter_maker_protocols(makers, workers=workers, cache=cache))
+    assert [x.num_renders for x in makers] == [0, 0]
+
+    err = capfd.readouterr().err
+    assert 'warning 0' in err
+    assert 'warning 1' in err
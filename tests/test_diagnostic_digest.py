@@ -0,0 +1,218 @@
+import pytest
+import random
+import numpy as np
+import freezerbox
+
+from freezerbox import Database, Plasmid
+from stepwise_mol_bio import ConfigError, UsageError
+from stepwise_mol_bio._diagnostic_digest import *
+from stepwise_mol_bio._diagnostic_digest import (
+        _find_cuts, _combine_cuts, _calc_fragment_sizes, _calc_bands,
+        _calc_log_separations, _simulate_digest,
+)
+from stepwise_mol_bio.digest import get_restriction_batch
+
+SITES = ['GAATTC', 'AAGCTT', 'GGATCC', 'CTCGAG', 'GCGGCCGC']
+
+def random_seq(n, seed=0):
+    rng = random.Random(seed)
+    seq = ''.join(rng.choice('ACGT') for _ in range(n))
+
+    # Remove any sites for the enzymes used in these tests, so that the only
+    # sites are the ones that are deliberately added.
+    while any(x in seq for x in SITES):
+        for site in SITES:
+            seq = seq.replace(site, 'A' * len(site))
+
+    return seq
+
+PARENT = random_seq(4000)
+INSERT = 'GAATTC' + random_seq(1200, seed=1) + 'GAATTC'
+EXPECTED = PARENT[:1000] + INSERT + PARENT[1000:]
+MISASSEMBLY = PARENT[:1000] + INSERT[:600] + PARENT[1000:]
+
+def neb_enzyme(name, buffers, stars=(), recomm='rCutSmart Buffer'):
+    return {
+            'name': name,
+            'recommBuffer': recomm,
+            **{f'buf{k}': buffers[k-1] for k in range(1, 6)},
+            **{f'star{k}': k in stars for k in range(1, 6)},
+    }
+
+ENZYME_DB = {
+        'EcoRI-HF': neb_enzyme('EcoRI-HF', [10, 100, 10, 100, 0]),
+        'HindIII-HF': neb_enzyme('HindIII-HF', [10, 100, 10, 100, 0]),
+        'BamHI-HF': neb_enzyme('BamHI-HF', [100, 50, 10, 100, 0]),
+        'XhoI': neb_enzyme('XhoI', [0, 0, 100, 0, 0], recomm='NEBuffer r3.1'),
+}
+
+@pytest.mark.parametrize(
+        'cuts, is_circular, expected', [
+            ([[2, 5, np.inf]], True, [[3, 7, 0]]),
+            ([[2, 5, np.inf]], False, [[2, 3, 5, 0]]),
+            ([[np.inf, np.inf]], True, [[10, 0]]),
+            ([[np.inf, np.inf]], False, [[10, 0, 0]]),
+            ([[0, 0, 7]], True, [[0, 7, 3]]),
+        ],
+)
+def test_calc_fragment_sizes(cuts, is_circular, expected):
+    sizes = _calc_fragment_sizes(np.array(cuts, dtype=float), 10, is_circular)
+    np.testing.assert_array_equal(sizes, expected)
+
+def test_calc_fragment_sizes_vs_calc_digest_products():
+    # The vectorized fragment sizes should agree with the full simulation,
+    # including for enzymes that cut many times or not at all.
+    seq = random_seq(3000, seed=2)
+    enzymes = ['EcoRI', 'HindIII', 'BsaI', 'MspI', 'NotI', 'PvuII', 'SmaI']
+    batch, bio_names = get_restriction_batch(tuple(enzymes))
+    combos = np.array([
+            (i, j)
+            for i in range(len(enzymes))
+            for j in range(-1, len(enzymes))
+    ])
+
+    for is_circular in [True, False]:
+        cuts = _combine_cuts(_find_cuts(seq, batch, bio_names), combos)
+        sizes = _calc_fragment_sizes(cuts, len(seq), is_circular)
+
+        for combo, row in zip(combos, sizes):
+            names = [enzymes[i] for i in combo if i >= 0]
+            simulated = _simulate_digest(seq, names, is_circular)
+
+            # Uncut sequences are treated as a single fragment.
+            if not simulated:
+                simulated = (len(seq),)
+
+            assert tuple(sorted(row[row > 0], reverse=True)) == simulated
+
+def test_calc_log_separations():
+    sizes = np.array([
+            [1000, 2000, 0],
+            [1000, 2000, 0],
+            [1000, 2000, 0],
+            [1000, 2000, 0],
+    ])
+    a = _calc_bands(sizes, 250, 10000)
+    b = _calc_bands(np.array([
+            [1000, 2000, 0],     # Same bands.
+            [2000, 1000, 100],   # Same visible bands.
+            [1000, 2200, 0],     # One band 10% bigger.
+            [0, 0, 0],           # No visible bands.
+    ]), 250, 10000)
+
+    seps = _calc_log_separations(a, b, 1.5)
+    np.testing.assert_allclose(seps, [0, 0, np.log10(1.1), 1.5])
+
+def test_design_diagnostic_digests():
+    digests = design_diagnostic_digests(
+            [EXPECTED, PARENT, MISASSEMBLY],
+            enzymes=['EcoRI', 'HindIII', 'BamHI', 'XhoI', 'NotI'],
+    )
+    assert digests
+
+    # Only EcoRI distinguishes these plasmids, because the sites for the
+    # other enzymes were removed.
+    for digest in digests:
+        assert 'EcoRI' in digest.enzymes
+        assert digest.buffer is None
+        assert digest.separation >= RESOLUTION
+
+    best = digests[0]
+    assert best.enzymes == ('EcoRI',)
+    assert best.fragments_bp == (
+            _simulate_digest(EXPECTED, ['EcoRI'], True),
+            (),
+            _simulate_digest(MISASSEMBLY, ['EcoRI'], True),
+    )
+    assert best.fragments_bp[0] == (4006, 1206)
+
+    # The digests are sorted from best to worst.
+    seps = [x.separation for x in digests]
+    assert seps == sorted(seps, reverse=True)
+
+def test_design_diagnostic_digests_single():
+    digests = design_diagnostic_digests(
+            [EXPECTED, PARENT],
+            enzymes=['EcoRI', 'NotI'],
+            max_enzymes=1,
+    )
+    assert [x.enzymes for x in digests] == [('EcoRI',)]
+
+def test_design_diagnostic_digests_resolution():
+    # A 10 bp insertion can't be seen on a gel.
+    parent = random_seq(3000, seed=3)
+    parent = parent[:1000] + 'GAATTC' + parent[1000:]
+    expected = parent[:2000] + 'A' * 10 + parent[2000:]
+
+    assert design_diagnostic_digests(
+            [expected, parent],
+            enzymes=['EcoRI'],
+    ) == []
+
+def test_design_diagnostic_digests_enzyme_db():
+    expected = EXPECTED[:3000] + 'CTCGAG' + EXPECTED[3000:4500] + 'GGATCC' + EXPECTED[4500:]
+    digests = design_diagnostic_digests(
+            [expected, PARENT],
+            enzymes=pick_neb_enzyme_names(ENZYME_DB),
+            enzyme_db=ENZYME_DB,
+    )
+    enzymes = {x.enzymes: x for x in digests}
+
+    # XhoI only works in r3.1, where the other enzymes have too little 
+    # activity, so it can't be used in any double digests.  HindIII doesn't 
+    # cut any of the plasmids, so it isn't used at all.
+    assert set(enzymes) == {
+            ('BamHI-HF',),
+            ('EcoRI-HF',),
+            ('XhoI',),
+            ('BamHI-HF', 'EcoRI-HF'),
+    }
+    assert enzymes['EcoRI-HF',].buffer == 'rCutSmart Buffer'
+    assert enzymes['XhoI',].buffer == 'NEBuffer r3.1'
+    assert enzymes['BamHI-HF', 'EcoRI-HF'].buffer == 'rCutSmart Buffer'
+
+def test_design_diagnostic_digests_err():
+    with pytest.raises(UsageError):
+        design_diagnostic_digests([EXPECTED])
+
+def test_pick_neb_enzyme_names():
+    db = {'EcoRI': {}, 'EcoRI-HF': {}, 'XhoI': {}, 'BsaI-HFv2': {}}
+    assert pick_neb_enzyme_names(db) == ['BsaI-HFv2', 'EcoRI-HF', 'XhoI']
+
+def test_diagnostic_digest_app():
+    db = Database({})
+    db['p1'] = Plasmid(seq=PARENT, circular=True)
+    db['p2'] = Plasmid(seq=EXPECTED, circular=True)
+    db['p3'] = Plasmid(seq=MISASSEMBLY, circular=True)
+
+    app = DiagnosticDigestDesign(db, 'p2', ['p1', 'p3'], ENZYME_DB)
+    app.max_enzymes = 1
+
+    digests = app.design_digests()
+    assert digests[0].enzymes == ('EcoRI-HF',)
+
+    table = app.format_digests(digests)
+    assert 'p2 (kb)' in table
+    assert 'p1 (kb)' in table
+    assert '4.0, 1.2' in table
+    assert 'uncut' in table
+    assert 'rCutSmart Buffer' in table
+
+    app.enzymes = ['HindIII-HF']
+    with pytest.raises(ConfigError, match="no digest can distinguish 'p2'"):
+        app.design_digests()
+
+    app.alternatives = []
+    with pytest.raises(UsageError):
+        app.design_digests()
+
+def test_main_load_error(monkeypatch, capsys):
+    def load_db():
+        raise freezerbox.LoadError("no database configured")
+
+    monkeypatch.setattr(freezerbox, 'load_db', load_db)
+    monkeypatch.setattr('sys.argv', ['molbio-diagnostic-digest', 'p1', 'p2'])
+
+    # The error is reported like any other, rather than with a traceback.
+    DiagnosticDigestDesign.main()
+    assert "no database configured" in capsys.readouterr().err
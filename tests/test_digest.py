@@ -1,7 +1,12 @@
 import pytest
 import parametrize_from_file
+import json
+import os
+import time
+import threading
 
 from stepwise_mol_bio.digest import *
+from stepwise_mol_bio import match_len
 from more_itertools import one
 from warnings import catch_warnings, simplefilter
 from param_helpers import *
@@ -34,9 +39,44 @@ def test_calc_digest_products(seq, enzymes, is_circular, target_size, product, p
                 target_size=target_size,
         )
 
+def test_calc_digest_products_batch():
+    seqs = ['GAATTCAAGCTT', 'AAGCTTGAATTCAAGCTT', 'GAATTCAAGCTT']
+    enzymes = ['EcoRI', 'HindIII-HF']
+
+    for is_circular in [True, False, [True, False, False]]:
+        expected = [
+                calc_digest_products(seq, enzymes, is_circular=circ)
+                for seq, circ in zip(seqs, match_len(is_circular, len(seqs)))
+        ]
+        assert calc_digest_products_batch(
+                seqs, enzymes,
+                is_circular=is_circular,
+        ) == expected
+
+    assert calc_digest_products_batch(
+            [], enzymes,
+            is_circular=True,
+    ) == []
+
+    assert get_restriction_batch(('HindIII-HF',)) is \
+           get_restriction_batch(('HindIII-HF',))
+
+    with pytest.raises(ConfigError, match="'EcoRI' does not cut template"):
+        calc_digest_products_batch(
+                ['GAATTC', 'AAGCTT'], ['EcoRI'],
+                is_circular=True,
+        )
+
+    with pytest.raises(ConfigError, match="unknown enzyme"):
+        calc_digest_products_batch(['GAATTC'], ['EcoRJ'], is_circular=True)
+
+    with pytest.raises(ValueError):
+        calc_digest_products_batch(seqs, enzymes, is_circular=[True])
+
 def test_neb_restriction_enzyme_database(tmp_path):
     cache_path = tmp_path / 'cache.json'
     db = NebRestrictionEnzymeDatabase(cache_path)
+    db.refresh_thread.join()
 
     # This doesn't test the case where the internet is inaccessible.
 
@@ -87,18 +127,318 @@ def test_neb_restriction_enzyme_database(tmp_path):
         db['EcoRJ']
 
     assert err.match(r"no such enzyme 'EcoRJ'")
-    assert err.match(r"successfully downloaded the most recent restriction enzyme data from NEB \(in case 'EcoRJ' is a new enzyme\)")
+    assert err.match(r"downloading the most recent restriction enzyme data from NEB in the background \(in case 'EcoRJ' is a new enzyme\)")
     assert err.match(r"did you mean: 'EcoRI'")
 
 @requests_testing.activate
 def test_neb_restriction_enzyme_database_offline(tmp_path):
     cache_path = tmp_path / 'cache.json'
 
+    # Without a cache or a snapshot, the download happens in the background.  
+    # Lookups fail until it succeeds.
+    db = NebRestrictionEnzymeDatabase(cache_path, snapshot_path=None)
+    db.refresh_thread.join()
+
+    with pytest.raises(ConfigError) as err:
+        db['EcoRI']
+
+    assert err.match("can't look up 'EcoRI': no restriction enzyme data available")
+    assert err.match("already tried downloading restriction enzyme data from NEB recently")
+
+def make_neb_enzyme(name, concentration=10_000, **kwargs):
+    return {
+            'name': name,
+            'concentration': concentration,
+            'recommBuffer': 'rCutSmart Buffer',
+            **{f'buf{k}': 100 * (k == 4) for k in range(1, 6)},
+            **{f'star{k}': False for k in range(1, 6)},
+            'supplement': {'atp': 0.0, 'bsa': 0.0, 'sam': 0.0},
+            **kwargs,
+    }
+
+def write_neb_cache(path, *enzymes):
+    path.write_text(json.dumps({x['name']: x for x in enzymes}))
+
+def touch_later(path):
+    # Make sure the modification time changes, even if the filesystem doesn't 
+    # have very good time resolution.
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+def test_neb_restriction_enzyme_database_index(tmp_path):
+    cache_path = tmp_path / 'cache.json'
+    write_neb_cache(
+            cache_path,
+            make_neb_enzyme('EcoRI', 20_000, star2=True),
+            make_neb_enzyme('BsaI-HFv2', supplement={'atp': 0.0, 'bsa': 100.0}),
+    )
+
+    db = NebRestrictionEnzymeDatabase(cache_path)
+    assert db.index_path.exists()
+    assert 'ecori' in db
+    assert 'EcoRV' not in db
+    assert len(db) == 2
+
+    assert db['ECORI']['concentration'] == 20_000
+    assert db.get_enzyme('ecori') == NebRestrictionEnzyme(
+            name='EcoRI',
+            concentration_U_uL=20,
+            recommended_buffer='rCutSmart Buffer',
+            buffer_activity={'1': 0, '2': 0, '3': 0, '4': 100, '5': 0},
+            star_activity={'1': False, '2': True, '3': False, '4': False, '5': False},
+            supplements={},
+    )
+    assert db.get_enzyme('bsai-hfv2').supplements == {'bsa': 100.0}
+
+    # The index is used instead of the JSON file, as long as the JSON file 
+    # hasn't changed.
+    index_mtime = db.index_path.stat().st_mtime_ns
+    db = NebRestrictionEnzymeDatabase(cache_path)
+    assert db.index_path.stat().st_mtime_ns == index_mtime
+    assert db['EcoRI']['concentration'] == 20_000
+
+    # If the JSON file changes, the index is rebuilt.
+    write_neb_cache(cache_path, make_neb_enzyme('EcoRI', 100_000))
+    touch_later(cache_path)
+
+    db = NebRestrictionEnzymeDatabase(cache_path)
+    assert db['EcoRI']['concentration'] == 100_000
+    assert 'BsaI-HFv2' not in db
+
+def test_neb_restriction_enzyme_database_incomplete_enzyme(tmp_path):
+    cache_path = tmp_path / 'cache.json'
+    enzyme = make_neb_enzyme('EcoRI')
+    del enzyme['recommBuffer']
+    write_neb_cache(cache_path, enzyme, make_neb_enzyme('XhoI', supplement=None))
+
+    # Enzymes with missing parameters can still be looked up, but they can't 
+    # be summarized.
+    db = NebRestrictionEnzymeDatabase(cache_path)
+    assert db['EcoRI']['concentration'] == 10_000
+
+    with pytest.raises(ConfigError, match="missing 'recommBuffer' parameter for enzyme 'EcoRI'"):
+        db.get_enzyme('EcoRI')
+
+    with pytest.raises(ConfigError, match="malformed parameters for enzyme 'XhoI'"):
+        db.get_enzyme('XhoI')
+
+def test_neb_restriction_enzyme_database_corrupt_index(tmp_path):
+    cache_path = tmp_path / 'cache.json'
+    write_neb_cache(cache_path, make_neb_enzyme('EcoRI'))
+
+    db = NebRestrictionEnzymeDatabase(cache_path)
+    db.index_path.write_bytes(b'not a pickle')
+
+    db = NebRestrictionEnzymeDatabase(cache_path)
+    assert db['EcoRI']['name'] == 'EcoRI'
+
+def test_get_neb_restriction_enzyme_db(tmp_path):
+    cache_path = tmp_path / 'cache.json'
+    write_neb_cache(cache_path, make_neb_enzyme('EcoRI'))
+
+    db = get_neb_restriction_enzyme_db(cache_path)
+    assert get_neb_restriction_enzyme_db(cache_path) is db
+    assert db['EcoRI']['concentration'] == 10_000
+
+    # The shared database notices when the data is updated.
+    write_neb_cache(cache_path, make_neb_enzyme('EcoRI', 20_000))
+    touch_later(cache_path)
+
+    assert get_neb_restriction_enzyme_db(cache_path) is db
+    assert db['EcoRI']['concentration'] == 20_000
+
+class MockNeb:
+
+    def __init__(self, *enzymes, error=False, wait=None):
+        self.data = {x['name']: x for x in enzymes}
+        self.error = error
+        self.wait = wait
+        self.num_calls = 0
+
+    def __call__(self, url, timeout_s):
+        self.num_calls += 1
+        if self.wait:
+            self.wait.wait(timeout_s)
+        if self.error:
+            raise ConfigError("failed to download restriction enzyme data from NEB")
+        return self.data
+
+def make_neb_db(tmp_path, fetch_json, **kwargs):
+    kwargs = {'snapshot_path': None, 'timeout_s': 1, **kwargs}
+    return NebRestrictionEnzymeDatabase(
+            tmp_path / 'cache.json',
+            fetch_json=fetch_json,
+            **kwargs,
+    )
+
+def test_neb_restriction_enzyme_database_local_server(tmp_path):
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from threading import Thread
+
+    body = json.dumps({'EcoRI': make_neb_enzyme('EcoRI')}).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    try:
+        db = NebRestrictionEnzymeDatabase(
+                tmp_path / 'cache.json',
+                snapshot_path=None,
+                url=f'http://127.0.0.1:{server.server_port}/reprop.json',
+        )
+        db.refresh_thread.join()
+
+        assert db['EcoRI']['name'] == 'EcoRI'
+        assert db.source_path == db.cache_path
+
+    finally:
+        server.shutdown()
+
+def test_neb_restriction_enzyme_database_no_data(tmp_path):
+    wait = threading.Event()
+    fetch_json = MockNeb(make_neb_enzyme('EcoRI'), wait=wait)
+
+    # Neither the constructor nor lookups wait for the download.
+    t0 = time.monotonic()
+    db = make_neb_db(tmp_path, fetch_json, timeout_s=10)
+
+    assert db.source_path is None
+    assert db.is_refreshing
+    assert db.refresh_thread.daemon
+    assert len(db) == 0
+
     with pytest.raises(ConfigError) as err:
-        NebRestrictionEnzymeDatabase(cache_path)
+        db['EcoRI']
+
+    assert time.monotonic() - t0 < 1
+    assert err.match("can't look up 'EcoRI': no restriction enzyme data available")
+    assert err.match("downloading restriction enzyme data from NEB in the background")
+
+    # Once the download finishes, the data is used right away.
+    wait.set()
+    db.refresh_thread.join()
+
+    assert db['EcoRI']['name'] == 'EcoRI'
+    assert db.source_path == db.cache_path
+    assert fetch_json.num_calls == 1
+
+def test_neb_restriction_enzyme_database_snapshot(tmp_path):
+    snapshot_path = tmp_path / 'snapshot.json'
+    write_neb_cache(snapshot_path, make_neb_enzyme('EcoRI'))
+
+    fetch_json = MockNeb(make_neb_enzyme('EcoRI'), make_neb_enzyme('HindIII'))
+    db = make_neb_db(tmp_path, fetch_json, snapshot_path=snapshot_path)
+
+    # The snapshot is used right away, and the cache is updated in the 
+    # background.
+    assert db.source_path == snapshot_path
+    assert db['EcoRI']['name'] == 'EcoRI'
+
+    db.refresh_thread.join()
+    assert fetch_json.num_calls == 1
+    assert db.cache_path.exists()
+
+    assert db['HindIII']['name'] == 'HindIII'
+    assert db.source_path == db.cache_path
+    assert not db.is_stale
+
+def test_neb_restriction_enzyme_database_unwritable_cache(tmp_path, monkeypatch):
+    snapshot_path = tmp_path / 'snapshot.json'
+    write_neb_cache(snapshot_path, make_neb_enzyme('EcoRI'))
+
+    # The cache directory can't be created, because there's a file in the 
+    # way.
+    (tmp_path / 'neb').write_text('')
+
+    thread_errors = []
+    monkeypatch.setattr(threading, 'excepthook', thread_errors.append)
+
+    fetch_json = MockNeb(make_neb_enzyme('EcoRI'))
+    db = NebRestrictionEnzymeDatabase(
+            tmp_path / 'neb' / 'cache.json',
+            snapshot_path=snapshot_path,
+            fetch_json=fetch_json,
+    )
+    db.refresh_thread.join()
+
+    assert fetch_json.num_calls == 1
+    assert thread_errors == []
+    assert db['EcoRI']['name'] == 'EcoRI'
+    assert db.source_path == snapshot_path
+
+def test_neb_restriction_enzyme_database_unknown_name(tmp_path):
+    write_neb_cache(tmp_path / 'cache.json', make_neb_enzyme('EcoRI'))
+
+    wait = threading.Event()
+    fetch_json = MockNeb(make_neb_enzyme('EcoRI'), wait=wait)
+    db = make_neb_db(tmp_path, fetch_json, timeout_s=10)
+
+    # The lookup fails right away, even though the download is still in 
+    # progress.
+    for i in range(3):
+        t0 = time.monotonic()
+        with pytest.raises(ConfigError, match="no such enzyme 'EcoRJ'"):
+            db['EcoRJ']
+        assert time.monotonic() - t0 < 1
+
+    assert db.is_refreshing
+    wait.set()
+    db.refresh_thread.join()
+
+    # The same name is only ever looked up once.
+    assert fetch_json.num_calls == 1
+    assert 'ecorj' in db.unknown_names
+
+def test_neb_restriction_enzyme_database_new_enzyme(tmp_path):
+    write_neb_cache(tmp_path / 'cache.json', make_neb_enzyme('EcoRI'))
+
+    fetch_json = MockNeb(make_neb_enzyme('EcoRI'), make_neb_enzyme('EcoRJ'))
+    db = make_neb_db(tmp_path, fetch_json)
+
+    with pytest.raises(ConfigError, match="no such enzyme 'EcoRJ'"):
+        db['EcoRJ']
+
+    db.refresh_thread.join()
+
+    # The new data replaces the negative cache.
+    assert db['EcoRJ']['name'] == 'EcoRJ'
+
+def test_neb_restriction_enzyme_database_retry_interval(tmp_path):
+    write_neb_cache(tmp_path / 'cache.json', make_neb_enzyme('EcoRI'))
+    os.utime(tmp_path / 'cache.json', ns=(0, 0))
+
+    fetch_json = MockNeb(error=True)
+    db = make_neb_db(tmp_path, fetch_json)
+
+    # The cache is stale, so a refresh is started right away.  It fails, and 
+    # isn't tried again until the retry interval elapses.
+    assert db.is_stale
+    db.refresh_thread.join()
+    assert fetch_json.num_calls == 1
+    assert db['EcoRI']['name'] == 'EcoRI'
+
+    with pytest.raises(ConfigError):
+        db['EcoRJ']
+    with pytest.raises(ConfigError):
+        db['EcoRK']
+
+    assert not db.is_refreshing
+    assert fetch_json.num_calls == 1
 
-    assert err.match("failed to download")
-    assert err.match("URL: http://nebcloner.neb.com/data/reprop.json")
+    db.retry_interval_s = 0
+    db.refresh_in_background()
+    db.refresh_thread.join()
+    assert fetch_json.num_calls == 2
 
 @parametrize_from_file(schema=cast(enzymes=with_py.eval))
 def test_pick_compatible_buffer(enzymes, expected):
@@ -0,0 +1,83 @@
+import pytest
+import numpy as np
+
+from Bio.Seq import reverse_complement
+from stepwise_mol_bio._dimers import *
+
+FWD = 'TATAACAGGCTGCTGAGACC'
+REV = 'CCTCCGGTGATAGTCCTAGA'
+
+def test_dimer_lengths():
+    seqs = [FWD, 'AAAAAAAAAAAAAAAA' + reverse_complement(FWD[-7:])]
+    matrix = ComplementarityMatrix(seqs)
+
+    assert matrix.dimer_lengths[0, 1] == 7
+    assert matrix.dimer_lengths[1, 0] == 7
+
+    # Runs of complementarity longer than the window aren't distinguished.
+    seqs = [FWD, reverse_complement(FWD)]
+    matrix = ComplementarityMatrix(seqs, window=10)
+    assert matrix.dimer_lengths[0, 1] == 10
+
+def test_dimer_lengths_3prime_only():
+    # Complementarity that doesn't include the very last base of the primer 
+    # can't be extended by the polymerase.
+    seqs = [FWD, 'AAAAAAAAAAAAAAAA' + reverse_complement(FWD[-8:-1])]
+    matrix = ComplementarityMatrix(seqs)
+    assert matrix.dimer_lengths[0, 1] < 2
+
+def test_dimer_lengths_unknown_bases():
+    seqs = ['AAAAAAAAAANNNN', 'NNNNTTTTTTTTT']
+    matrix = ComplementarityMatrix(seqs)
+    assert matrix.dimer_lengths[0, 1] == 0
+
+def test_hairpin_lengths():
+    seqs = [
+            'GCGCCGTTTTTTTTTTCGGCGC',
+            'GCGCCGCGGCGC',
+            'AAAAAAAAAAAA',
+    ]
+    matrix = ComplementarityMatrix(seqs)
+
+    # The stem of the second hairpin is limited by the minimum loop size.
+    assert list(matrix.get_hairpin_lengths(min_loop=3)) == [6, 4, 0]
+    assert list(matrix.get_hairpin_lengths(min_loop=4)) == [6, 4, 0]
+    assert list(matrix.get_hairpin_lengths(min_loop=5)) == [6, 3, 0]
+
+def test_dgs():
+    matrix = ComplementarityMatrix(['AAAAGCGC', 'AAAAATAT'])
+    dgs = matrix.get_dgs([[0, 2, 4], [0, 2, 4]])
+
+    assert (dgs[:, 0] == 0).all()
+
+    # GC-rich duplexes are more stable than AT-rich ones, and longer duplexes 
+    # are more stable than shorter ones.
+    assert dgs[0, 1] < dgs[1, 1]
+    assert dgs[0, 2] < dgs[1, 2] < 0
+    assert dgs[0, 2] < dgs[0, 1]
+
+def test_screen_primers():
+    dimer = 'AAAAAAAAAAAAAAAA' + reverse_complement(FWD[-8:])
+    dimers, hairpins = screen_primers([FWD, REV, dimer])
+
+    assert [(x.primer, x.partner) for x in dimers] == [
+            (FWD, dimer),
+            (dimer, FWD),
+    ]
+    assert dimers[0].length_bp == 8
+    assert dimers[0].dg_kcal_mol < MAX_DIMER_DG_KCAL_MOL
+    assert hairpins == []
+
+    # Only the given pairs of primers are compared to each other.
+    dimers, hairpins = screen_primers([FWD, REV, dimer], pairs=[(0, 1)])
+    assert dimers == []
+
+def test_screen_primers_hairpin():
+    hairpin = 'GCGCCGTTTTTTTTTTCGGCGC'
+    dimers, hairpins = screen_primers([hairpin], max_dimer_dg_kcal_mol=-100)
+
+    assert dimers == []
+    assert [(x.primer, x.length_bp) for x in hairpins] == [(hairpin, 6)]
+
+def test_screen_primers_empty():
+    assert screen_primers([]) == ([], [])
@@ -0,0 +1,83 @@
+import pytest
+import numpy as np
+
+from stepwise_mol_bio._gradient import *
+
+def summarize(runs):
+    return [
+            (run.low_temp_C, run.high_temp_C, run.columns)
+            for run in runs
+    ]
+
+def check_runs(runs, temps, block, tolerance_C):
+    packed = sorted(i for run in runs for i in run.reactions)
+    assert packed == list(range(len(temps)))
+
+    for run in runs:
+        assert len(run.column_temps_C) == block.num_columns
+        assert run.column_temps_C[0] == run.low_temp_C
+        assert run.column_temps_C[-1] == run.high_temp_C
+        assert run.high_temp_C - run.low_temp_C <= block.max_span_C
+
+        for j, reactions in run.columns.items():
+            assert len(reactions) <= block.num_rows
+            for i in reactions:
+                assert abs(run.column_temps_C[j] - temps[i]) <= tolerance_C + 1e-9
+
+def test_pack_gradient_runs_same_temp():
+    runs = pack_gradient_runs([60, 60, 60])
+    assert summarize(runs) == [(60, 60, {0: [0, 1, 2]})]
+    assert not runs[0].is_gradient
+
+def test_pack_gradient_runs_one_run():
+    block = GradientBlock(num_columns=3, num_rows=8, max_span_C=10)
+    runs = pack_gradient_runs([64, 54, 59.5], block, tolerance_C=0.5)
+
+    assert summarize(runs) == [(54, 64, {0: [1], 1: [2], 2: [0]})]
+    assert runs[0].is_gradient
+    assert runs[0].reactions == [0, 1, 2]
+
+def test_pack_gradient_runs_span():
+    # The temperatures are too far apart to fit in one gradient.
+    block = GradientBlock(num_columns=2, num_rows=8, max_span_C=10)
+    runs = pack_gradient_runs([50, 70], block, tolerance_C=1)
+    assert summarize(runs) == [(50, 50, {0: [0]}), (70, 70, {0: [1]})]
+
+    # The tolerance lets the gradient reach a little further.
+    runs = pack_gradient_runs([50, 61], block, tolerance_C=1)
+    assert summarize(runs) == [(50, 60, {0: [0], 1: [1]})]
+
+def test_pack_gradient_runs_capacity():
+    block = GradientBlock(num_columns=2, num_rows=2, max_span_C=0)
+    runs = pack_gradient_runs([60] * 5, block)
+    assert [run.reactions for run in runs] == [[0, 1, 2, 3], [4]]
+
+@pytest.mark.parametrize('tolerance_C', [0.25, 1, 3])
+def test_pack_gradient_runs_random(tolerance_C):
+    rng = np.random.default_rng(0)
+    temps = rng.uniform(50, 72, 200)
+    block = GradientBlock()
+
+    runs = pack_gradient_runs(temps, block, tolerance_C)
+    check_runs(runs, temps, block, tolerance_C)
+
+    # Every run but the last should be full, because the temperatures are 
+    # dense enough that capacity is the limiting factor.
+    if tolerance_C >= 1:
+        assert len(runs) == 3
+
+@pytest.mark.parametrize(
+        'temps, kwargs, error', [
+            ([np.nan], {}, "NaN"),
+            ([60], {'tolerance_C': -1}, "negative"),
+            ([60], {'block': GradientBlock(num_columns=0)}, "at least one well"),
+        ],
+)
+def test_pack_gradient_runs_err(temps, kwargs, error):
+    with pytest.raises(ValueError, match=error):
+        pack_gradient_runs(temps, **kwargs)
+
+def test_gradient_block_from_config():
+    block = GradientBlock.from_config({'num_columns': '8', 'max_span_C': 24})
+    assert block == GradientBlock(num_columns=8, num_rows=8, max_span_C=24)
+    assert GradientBlock.from_config(block) is block
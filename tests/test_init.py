@@ -0,0 +1,46 @@
+import sys
+import subprocess
+import pytest
+import stepwise_mol_bio
+
+def test_lazy_imports():
+    for name, module in stepwise_mol_bio._LAZY_IMPORTS.items():
+        cls = getattr(stepwise_mol_bio, name)
+        assert cls.__module__ == f'stepwise_mol_bio{module}'
+
+    with pytest.raises(AttributeError, match="no attribute 'NotAProtocol'"):
+        stepwise_mol_bio.NotAProtocol
+
+def test_import_cost():
+    # Importing the package shouldn't import any of the protocols, or any of 
+    # their dependencies.
+    code = """\
+import sys
+import stepwise_mol_bio
+print('\\n'.join(sys.modules))
+"""
+    p = subprocess.run(
+            [sys.executable, '-c', code],
+            capture_output=True,
+            text=True,
+            check=True,
+    )
+    modules = set(p.stdout.splitlines())
+
+    assert 'stepwise_mol_bio' in modules
+    assert not {
+            f'stepwise_mol_bio{x}'
+            for x in stepwise_mol_bio._LAZY_IMPORTS.values()
+    } & modules
+    assert 'stepwise_mol_bio._utils' not in modules
+    assert 'requests' not in modules
+    assert 'freezerbox' not in modules
+    assert 'stepwise' not in modules
+
+def test_star_import():
+    ns = {}
+    exec('from stepwise_mol_bio import *', ns)
+
+    assert ns['Main'] is stepwise_mol_bio.Main
+    assert ns['Pcr'] is stepwise_mol_bio.Pcr
+    assert ns['group_samples'] is stepwise_mol_bio.group_samples
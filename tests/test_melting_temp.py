@@ -0,0 +1,66 @@
+import pytest
+import numpy as np
+
+from pytest import approx
+from Bio.SeqUtils import MeltingTemp
+from stepwise_mol_bio._melting_temp import *
+
+SEQS = [
+        'tataacaggctgctgagacc',
+        'tctaggactatcaccggagg',
+        'GATTACA',
+        'AAAAAAAAAAAAAAAAAAAA',
+        'GCGCGCGCGCGCGCGCGCGC',
+        'ACGTACGTACGTACGTACGTACGTACGTACGTACGTACGT',
+]
+
+def biopython_melting_temp_C(seq, conditions):
+    return MeltingTemp.Tm_NN(
+            seq.upper(),
+            nn_table=MeltingTemp.DNA_NN3,
+            Na=conditions.monovalent_mM,
+            Mg=conditions.mg_mM,
+            dNTPs=conditions.dntp_mM,
+            dnac1=conditions.primer_nM,
+            dnac2=0,
+            saltcorr=7,
+    )
+
+@pytest.mark.parametrize(
+        'conditions', [
+            MeltingTempConditions(),
+            MeltingTempConditions(mg_mM=2, dntp_mM=0.8),
+            MeltingTempConditions(monovalent_mM=0, mg_mM=2, primer_nM=250),
+            MeltingTempConditions(monovalent_mM=10, mg_mM=5),
+        ],
+)
+def test_calc_melting_temps_C(conditions):
+    expected = [biopython_melting_temp_C(x, conditions) for x in SEQS]
+    assert calc_melting_temps_C(SEQS, conditions) == approx(expected)
+
+    for seq, tm in zip(SEQS, expected):
+        assert calc_melting_temp_C(seq, conditions) == approx(tm)
+
+def test_calc_melting_temps_C_invalid():
+    tms = calc_melting_temps_C(['GATTACA', 'GATNACA', 'A', ''])
+
+    assert not np.isnan(tms[0])
+    assert np.isnan(tms[1:]).all()
+
+    with pytest.raises(ValueError, match="can't calculate melting temperature"):
+        calc_melting_temp_C('GATNACA')
+
+def test_calc_melting_temps_C_conditions():
+    seq = 'tataacaggctgctgagacc'
+    low_salt = MeltingTempConditions(monovalent_mM=10)
+    high_salt = MeltingTempConditions(monovalent_mM=100)
+    high_mg = MeltingTempConditions(monovalent_mM=10, mg_mM=2)
+
+    # The cache must not confuse different conditions.
+    assert calc_melting_temp_C(seq, low_salt) < calc_melting_temp_C(seq, high_salt)
+    assert calc_melting_temp_C(seq, low_salt) < calc_melting_temp_C(seq, high_mg)
+
+def test_melting_temp_conditions_from_config():
+    conditions = MeltingTempConditions.from_config({'mg_mM': '2', 'primer_nM': 250})
+    assert conditions == MeltingTempConditions(mg_mM=2, primer_nM=250)
+    assert MeltingTempConditions.from_config(conditions) is conditions
@@ -0,0 +1,145 @@
+import pytest
+import freezerbox
+
+from freezerbox import Database, Plasmid, NucleicAcid, Oligo, Protein
+from Bio.Seq import reverse_complement
+from stepwise_mol_bio import Pcr, ConfigError
+from stepwise_mol_bio.pcr import find_amplicon
+from stepwise_mol_bio._offtarget import *
+
+TEMPLATE = 'cctccggtgatagtcctagaAAAAAAAAAAtataacaggctgctgagaccGATTACA'.upper()
+FWD = 'tataacaggctgctgagacc'.upper()
+REV = 'tctaggactatcaccggagg'.upper()
+
+def make_db(**templates):
+    db = Database({})
+    for tag, template in templates.items():
+        db[tag] = template
+    return db
+
+def summarize(amplicons):
+    return [(x.template, x.start, x.end, x.length_bp) for x in amplicons]
+
+def test_encode_kmers():
+    seq = 'ACGTACGTACGTACGT'
+
+    kmers = encode_kmers(seq, is_circular=False)
+    assert len(kmers) == 2
+    assert kmers[0] == encode_kmers(seq[:15], False)[0]
+    assert kmers[1] == encode_kmers(seq[1:], False)[0]
+
+    kmers = encode_kmers(seq, is_circular=True)
+    assert len(kmers) == 16
+    assert kmers[2] == encode_kmers(seq[2:] + seq[:1], False)[0]
+
+    kmers = encode_kmers('ACGTACGNACGTACGTA', is_circular=False)
+    assert list(kmers) == [INVALID_KMER] * 3
+
+    assert len(encode_kmers('ACGT', is_circular=False)) == 0
+
+@pytest.mark.parametrize(
+        'template, is_circular', [
+            (TEMPLATE[30:] + TEMPLATE[:30], False),
+            (TEMPLATE, True),
+
+            # Both primers span the origin.
+            (TEMPLATE[25:] + TEMPLATE[:25], True),
+            (TEMPLATE[45:] + TEMPLATE[:45], True),
+        ],
+)
+def test_find_amplicons(template, is_circular):
+    db = make_db(p1=Plasmid(seq=template, circular=is_circular))
+    index = OffTargetIndex()
+    index.update(db)
+
+    amplicon, = index.find_amplicons(FWD, REV)
+    expected = find_amplicon(template, FWD, REV, is_circular)
+
+    assert amplicon.template == 'p1'
+    assert amplicon.fwd == FWD
+    assert amplicon.rev == REV
+    assert amplicon.length_bp == len(expected)
+
+def test_find_amplicons_off_target():
+    db = make_db(
+            p1=Plasmid(seq=TEMPLATE, circular=True),
+            f1=NucleicAcid(seq='GG' + FWD + 'TTTTT' + reverse_complement(FWD)),
+            f2=NucleicAcid(seq='A' * 100),
+    )
+    index = OffTargetIndex()
+    index.update(db)
+
+    # The amplicon made from f1 only requires the forward primer.
+    assert summarize(index.find_amplicons(FWD, REV)) == [
+            ('f1', 7, 42, 45),
+            ('p1', 35, 15, 47),
+    ]
+    assert summarize(index.find_amplicons(FWD, REV, max_length_bp=46)) == [
+            ('f1', 7, 42, 45),
+    ]
+
+def test_find_amplicons_pcr_primer():
+    db = make_db(
+            p1=Plasmid(seq=TEMPLATE, circular=True),
+            o1=Oligo(seq=FWD),
+            o2=Oligo(seq=REV),
+    )
+    index = OffTargetIndex()
+    index.update(db)
+
+    fwd = Pcr.Primer('o1', db=db)
+    rev = Pcr.Primer('o2', db=db)
+
+    amplicon, = index.find_amplicons(fwd, rev)
+    assert amplicon.fwd is fwd
+    assert amplicon.rev is rev
+
+def test_find_amplicons_err():
+    index = OffTargetIndex()
+    index.update(make_db())
+
+    with pytest.raises(ConfigError, match="primer too short"):
+        index.find_amplicons('ACGT', REV)
+
+def test_update(tmp_path):
+    db = make_db(
+            p1=Plasmid(seq=TEMPLATE, circular=True),
+            p2=Plasmid(seq='A' * 100),
+    )
+    index = OffTargetIndex(tmp_path)
+    index.update(db)
+    assert index.num_indexed == 2
+
+    # Nothing needs to be indexed again, even in a new process.
+    index = OffTargetIndex(tmp_path)
+    index.update(db)
+    assert index.num_indexed == 0
+    assert summarize(index.find_amplicons(FWD, REV)) == [('p1', 35, 15, 47)]
+
+    # Only new sequences need to be indexed.
+    db = make_db(
+            p1=Plasmid(seq='A' * 100),
+            p3=Plasmid(seq=TEMPLATE, circular=True),
+            p4=Plasmid(seq='C' * 100),
+    )
+    index = OffTargetIndex(tmp_path)
+    index.update(db)
+    assert index.num_indexed == 1
+    assert summarize(index.find_amplicons(FWD, REV)) == [('p3', 35, 15, 47)]
+
+    # Sequences that aren't used anymore are removed from the cache.
+    assert len(list((tmp_path / 'kmers').glob('*.npy'))) == 3
+    assert len(list(tmp_path.glob('index-*'))) == 1
+
+    # Templates that are removed from the database are removed from the index.
+    db = make_db()
+    index = OffTargetIndex(tmp_path)
+    index.update(db)
+    assert index.find_amplicons(FWD, REV) == []
+
+def test_is_template():
+    assert is_template(Plasmid(seq=TEMPLATE))
+    assert is_template(NucleicAcid(seq=TEMPLATE))
+    assert not is_template(NucleicAcid())
+    assert not is_template(Oligo(seq=FWD))
+    assert not is_template(Protein(seq='MSKGEELFT'))
@@ -83,3 +83,303 @@ def test_protocol_products(db, tags, expected):
 
     assert match_protocol(app.protocol, expected)
 
+
+def test_template_index():
+    import random
+    random.seed(0)
+
+    for k in [2, 3, 4]:
+        seq = ''.join(random.choices('ACGT', k=50))
+        index = TemplateIndex(seq, is_circular=True, k=k)
+        doubled = seq + seq[:k-1]
+
+        for i in range(len(seq)):
+            kmer = doubled[i:i+k]
+            assert index.find(kmer) == seq.find(kmer)
+            assert index.find(kmer, junction=True) == doubled.find(kmer)
+
+        for n in [0, 1, k + 1]:
+            kmer = doubled[-n:] if n else ''
+            assert index.find(kmer) == seq.find(kmer)
+
+def test_load_template_index():
+    a = load_template_index('ATGC' * 10)
+    b = load_template_index('ATGC' * 10)
+    c = load_template_index('ATGC' * 10, True)
+
+    assert a is b
+    assert a is not c
+    assert c.is_circular
+
+@pytest.mark.parametrize(
+        'master_mix, expected', [
+            (None, [['f1', 'r1'], ['f2', 'r2']]),
+            ({'fwd'}, [['f1', 'f2', 'r1'], ['f1', 'f2', 'r2']]),
+            ({'fwd', 'rev'}, [['f1', 'f2', 'r1', 'r2'], ['f1', 'f2', 'r1', 'r2']]),
+        ],
+)
+def test_primer_groups(master_mix, expected):
+    def primer(tag):
+        return Pcr.Primer(tag, stock_uM=10)
+
+    app = Pcr([
+        Pcr.Amplicon(Pcr.Template('t'), primer('f1'), primer('r1')),
+        Pcr.Amplicon(Pcr.Template('t'), primer('f2'), primer('r2')),
+    ])
+    app.master_mix = master_mix
+    app.reaction_volume_uL = 50
+
+    groups = [[x.tag for x in group] for group in app.primer_groups]
+    assert groups == expected
+
+def test_primer_interactions():
+    def make_app(master_mix):
+        app = Pcr([
+            Pcr.Amplicon(
+                Pcr.Template('t'),
+                Pcr.Primer('f1', seq='tataacaggctgctgagacc', stock_uM=10),
+                Pcr.Primer('r1', seq='cctccggtgatagtcctaga', stock_uM=10),
+            ),
+            Pcr.Amplicon(
+                Pcr.Template('t'),
+                Pcr.Primer('f2', seq='ttttttttttttttggtctcagc', stock_uM=10),
+                Pcr.Primer('r2', stock_uM=10),
+            ),
+        ])
+        app.master_mix = master_mix
+        app.reaction_volume_uL = 50
+        return app
+
+    # The 3' ends of f1 and f2 are complementary, but the two primers aren't 
+    # in the same tube unless the forward primers are in the master mix.
+    dimers, hairpins = make_app(None).primer_interactions
+    assert dimers == []
+    assert hairpins == []
+
+    dimers, hairpins = make_app({'fwd'}).primer_interactions
+    assert [(x.primer.tag, x.partner.tag, x.length_bp) for x in dimers] == [
+            ('f1', 'f2', 9),
+            ('f2', 'f1', 9),
+    ]
+    assert hairpins == []
+
+def test_parse_amplicons_from_csv(tmp_path):
+    path = tmp_path / 'plate.csv'
+    path.write_text("""\
+Template, Fwd, Rev
+p1, f1, r1
+p2, f2, r2
+""")
+
+    amplicons = parse_amplicons_from_docopt({'--plate': path})
+    assert [
+            (x.well, x.template.tag, x.fwd.tag, x.rev.tag)
+            for x in amplicons
+    ] == [
+            ('A1', 'p1', 'f1', 'r1'),
+            ('A2', 'p2', 'f2', 'r2'),
+    ]
+
+    path.write_text("""\
+well,template,fwd,rev
+B3,p1,f1,r1
+""")
+    amplicon, = parse_amplicons_from_csv(path)
+    assert amplicon.well == 'B3'
+
+    path.write_text("""\
+template,fwd
+p1,f1
+""")
+    with pytest.raises(ConfigError, match="missing 'rev' column"):
+        parse_amplicons_from_csv(path)
+
+    # Rows shorter than the header are missing the trailing columns.
+    path.write_text("""\
+template,fwd,rev,well
+p1,f1,r1
+""")
+    amplicon, = parse_amplicons_from_csv(path)
+    assert amplicon.well == 'A1'
+
+def test_parse_amplicons_from_csv_wells(tmp_path):
+    path = tmp_path / 'plate.csv'
+    path.write_text("""\
+well,template,fwd,rev
+A1,p1,f1,r1
+,p2,f2,r2
+,p3,f3,r3
+A3,p4,f4,r4
+""")
+
+    # Wells that are given explicitly are skipped when assigning the others.
+    amplicons = parse_amplicons_from_csv(path)
+    assert [x.well for x in amplicons] == ['A1', 'A2', 'A4', 'A3']
+
+    path.write_text("""\
+well,template,fwd,rev
+A1,p1,f1,r1
+A1,p2,f2,r2
+""")
+    with pytest.raises(ConfigError, match="well 'A1' used more than once"):
+        parse_amplicons_from_csv(path)
+
+    # Well names are normalized before being compared.
+    path.write_text("""\
+well,template,fwd,rev
+a01,p1,f1,r1
+,p2,f2,r2
+B2,p3,f3,r3
+""")
+    amplicons = parse_amplicons_from_csv(path)
+    assert [x.well for x in amplicons] == ['A1', 'A2', 'B2']
+
+    path.write_text("""\
+well,template,fwd,rev
+A1,p1,f1,r1
+a01,p2,f2,r2
+""")
+    with pytest.raises(ConfigError, match="well 'a01' used more than once"):
+        parse_amplicons_from_csv(path)
+
+    path.write_text("""\
+well,template,fwd,rev
+1A,p1,f1,r1
+""")
+    with pytest.raises(ConfigError, match="can't parse well '1A'"):
+        parse_amplicons_from_csv(path)
+
+    # Wells have to be on the plate that would be picked automatically.
+    path.write_text("""\
+well,template,fwd,rev
+M5,p1,f1,r1
+""")
+    with pytest.raises(ConfigError, match="well 'M5' isn't on a 96-well plate"):
+        parse_amplicons_from_csv(path)
+
+    path.write_text("""\
+well,template,fwd,rev
+A13,p1,f1,r1
+""")
+    with pytest.raises(ConfigError, match="well 'A13' isn't on a 96-well plate"):
+        parse_amplicons_from_csv(path)
+
+@pytest.mark.parametrize(
+        'given, expected', [
+            ('A1', 'A1'),
+            ('a1', 'A1'),
+            ('A01', 'A1'),
+            ('h012', 'H12'),
+            (' B3 ', 'B3'),
+            ('af48', 'AF48'),
+        ],
+)
+def test_normalize_well(given, expected):
+    assert normalize_well(given) == expected
+
+@pytest.mark.parametrize('given', ['', 'A', '1', 'A0', '1A', 'A1B', 'ABC1'])
+def test_normalize_well_err(given):
+    with pytest.raises(ValueError):
+        normalize_well(given)
+
+@pytest.mark.parametrize(
+        'n, expected', [
+            (1, ['A1']),
+            (13, ['A1', 'A12', 'B1']),
+            (96, ['A1', 'A12', 'B1', 'H12']),
+            (97, ['A1', 'A24', 'B1', 'P24']),
+            (1536, ['A1', 'A48', 'B1', 'AF48']),
+        ],
+)
+def test_iter_wells(n, expected):
+    wells = list(iter_wells(n))
+    assert len(set(wells)) == len(wells) >= n
+    assert [x for x in wells if x in expected] == expected
+
+def test_iter_wells_err():
+    with pytest.raises(ConfigError, match="can't fit 1537 reactions"):
+        next(iter_wells(1537))
+
+def test_plate_layout():
+    def primer(tag):
+        return Pcr.Primer(tag, stock_uM=10)
+
+    app = Pcr([
+        Pcr.Amplicon(Pcr.Template('t1'), primer('f1'), primer('r'), well='A1'),
+        Pcr.Amplicon(Pcr.Template('t2'), primer('f2'), primer('r'), well='A2'),
+    ])
+    app.anneal_temp_C = 60
+    app.extend_time_s = 30
+    app.check_primers = False
+
+    pcr, primer_mix = app.reaction
+    layout = app.format_plate_layout(pcr, primer_mix)
+
+    assert app.plate_layout == [
+            ('A1', app.amplicons[0]),
+            ('A2', app.amplicons[1]),
+    ]
+    # The reverse primer is the same in every well, so it goes in the master 
+    # mix.  The forward primers go in the primer mix, because they're too 
+    # dilute to pipet directly.
+    assert layout.splitlines()[0].split() == [
+            'well', 'template', 'DNA', '(0.5', 'µL)', 'primer', 'mix', '(0.5', 'µL)',
+    ]
+    assert layout.splitlines()[2].split() == ['A1', 't1', 'f1']
+    assert layout.splitlines()[3].split() == ['A2', 't2', 'f2']
+    assert 'Add the following to each well:' in app.protocol.format_text()
+
+def test_plate_layout_no_wells():
+    app = Pcr([Pcr.Amplicon.from_tags('t1', 'f1', 'r1')])
+    assert app.plate_layout == []
+
+def test_gradient_runs():
+    def primer(tag):
+        return Pcr.Primer(tag, stock_uM=10)
+
+    app = Pcr([
+        Pcr.Amplicon(Pcr.Template(f't{i}'), primer(f'f{i}'), primer(f'r{i}'))
+        for i in range(4)
+    ])
+    app.anneal_temp_C = [55, 58, 66, 80]
+    app.extend_time_s = 30
+    app.pack_gradient = True
+    app.only_thermocycler = True
+
+    assert app.anneal_temps_C == [55, 58, 66, 80]
+    assert [run.reactions for run in app.gradient_runs] == [[0, 1, 2], [3]]
+
+    text = app.protocol.format_text()
+    assert "Run the following thermocycler protocol (1 of 2):" in text
+    assert "55-66°C for 20s" in text
+    assert "80°C for 20s" in text
+    assert "t1:f1,r1" in text
+
+def test_gradient_runs_err():
+    app = Pcr([Pcr.Amplicon.from_tags('t1', 'f1', 'r1')] * 2)
+    app.anneal_temp_C = [55, 58, 66]
+
+    with pytest.raises(UsageError, match="expected 2 annealing temperatures"):
+        app.anneal_temps_C
+
+def test_thermocycler_program():
+    app = Pcr([Pcr.Amplicon.from_tags('t1', 'f1', 'r1')])
+    app.anneal_temp_C = 60
+    app.extend_time_s = 90
+
+    program = app.thermocycler_program
+    assert program['anneal'].temp_C == 60
+    assert program['extend'].time_s == 90
+    assert program['hold'].temp_C == 4
+
+    # Q5: 30s + 35 × (10s + 20s + 90s) + 2 min
+    assert program.run_time_s == 30 + 35 * 120 + 120
+
+    # The parts of the program that don't depend on the amplicons are only 
+    # compiled once.
+    app2 = Pcr([Pcr.Amplicon.from_tags('t2', 'f2', 'r2')])
+    app2.anneal_temp_C = 65
+    app2.extend_time_s = 30
+
+    assert app2.thermocycler_program['anneal'].temp_C == 65
+    assert app2.thermocycler_program.steps[0] is program.steps[0]
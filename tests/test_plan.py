@@ -0,0 +1,108 @@
+import pytest
+import freezerbox
+
+from freezerbox import Oligo, Plasmid, NucleicAcid, parse_fields
+from stepwise_mol_bio import ConfigError
+from stepwise_mol_bio._plan import *
+
+def order():
+    return parse_fields('order vendor=IDT')
+
+def pcr(template):
+    return parse_fields(f'pcr template={template} primers=o1,o2')
+
+def make_db():
+    db = freezerbox.Database({})
+    db['o1'] = Oligo(seq='ATGCATGCATGCATGCATGC', synthesis=order(), ready=False)
+    db['o2'] = Oligo(seq='GCATGCATGCATGCATGCAT', synthesis=order(), ready=False)
+    db['o3'] = Oligo(seq='GCATGCATGCATGCATGCAT', synthesis=order())
+    db['p1'] = Plasmid(seq='ATGCATGCATGCATGCATGCAAAAATGCATGCATGCATGCATGC')
+    db['f1'] = NucleicAcid(synthesis=pcr('p1'), ready=False)
+    db['f2'] = NucleicAcid(synthesis=pcr('p1'), ready=False)
+    db['p2'] = Plasmid(synthesis=parse_fields('gibson f1,f2'), ready=False)
+    return db
+
+def tags(stages):
+    return [[x.tag for x in stage] for stage in stages]
+
+def test_stages():
+    db = make_db()
+    plan = BuildPlan(db, ['p2'])
+
+    assert tags(plan.stages) == [['o1', 'o2'], ['f1', 'f2'], ['p2']]
+    assert plan.get_depth('o1') == 0
+    assert plan.get_depth('f1') == 1
+    assert plan.get_depth('p2') == 2
+    assert plan.get_dependencies('p2') == ('f1', 'f2')
+    assert plan.get_dependencies('f1') == ('o1', 'o2')
+
+def test_stages_no_recurse():
+    plan = BuildPlan(make_db(), ['p2', 'f1'])
+    plan.recurse_deps = False
+    assert tags(plan.stages) == [['p2', 'f1']]
+
+def test_stages_exclude():
+    plan = BuildPlan(make_db(), ['p2'])
+    plan.exclude_deps = {'o1', 'f2'}
+    assert tags(plan.stages) == [['o2'], ['f1'], ['p2']]
+
+def test_add_targets():
+    plan = BuildPlan(make_db(), ['f1'])
+    assert tags(plan.stages) == [['o1', 'o2'], ['f1']]
+
+    deps = plan._deps.copy()
+
+    plan.add_targets(['p2'])
+    assert tags(plan.stages) == [['o1', 'o2'], ['f1', 'f2'], ['p2']]
+
+    # The dependencies that were already known shouldn't be recalculated.
+    for tag in deps:
+        assert plan._deps[tag] is deps[tag]
+
+def test_long_chain():
+    # Long enough to hit the recursion limit, if the graph were traversed
+    # recursively.
+    n = 1100
+    db = make_db()
+    db['f0'] = NucleicAcid(synthesis=pcr('p1'), ready=False)
+    for i in range(1, n):
+        db[f'g{i}'] = NucleicAcid(synthesis=pcr(f'g{i-1}' if i > 1 else 'f0'), ready=False)
+
+    plan = BuildPlan(db, [f'g{n-1}'])
+    assert len(plan.stages) == n + 1
+    assert plan.get_depth(f'g{n-1}') == n
+
+def test_cycle():
+    db = freezerbox.Database({})
+    db['o1'] = Oligo(seq='ATGCATGCATGCATGCATGC', synthesis=order(), ready=False)
+    db['o2'] = Oligo(seq='GCATGCATGCATGCATGCAT', synthesis=order(), ready=False)
+    db['f1'] = NucleicAcid(synthesis=pcr('f2'), ready=False)
+    db['f2'] = NucleicAcid(synthesis=pcr('f1'), ready=False)
+
+    plan = BuildPlan(db, ['f1'])
+    with pytest.raises(ConfigError, match='dependency cycle: f1 → f2 → f1'):
+        plan.stages
+
+def test_protocol():
+    db = make_db()
+    db['o4'] = Oligo(synthesis=parse_fields('order vendor=Genewiz'), ready=False)
+
+    plan = BuildPlan(db, ['o1', 'o2', 'o4'])
+    assert tags(plan.stages) == [['o1', 'o2', 'o4']]
+
+    protocol = plan.protocol
+    assert protocol.steps == [
+            'Order the following from IDT: o1, o2',
+            'Order o4 from Genewiz.',
+    ]
+
+def test_main_load_error(monkeypatch, capsys):
+    def load_db():
+        raise freezerbox.LoadError("no database configured")
+
+    monkeypatch.setattr(freezerbox, 'load_db', load_db)
+    monkeypatch.setattr('sys.argv', ['molbio-plan', 'p1'])
+
+    # The error is reported like any other, rather than with a traceback.
+    BuildPlan.main()
+    assert "no database configured" in capsys.readouterr().err
@@ -0,0 +1,147 @@
+import pytest
+import random
+import freezerbox
+
+from freezerbox import Database, Plasmid
+from stepwise_mol_bio import Pcr, UsageError
+from stepwise_mol_bio.pcr import find_amplicon
+from stepwise_mol_bio._primer_design import *
+
+def random_seq(n, seed=0):
+    rng = random.Random(seed)
+    return ''.join(rng.choice('ACGT') for _ in range(n))
+
+TEMPLATE = random_seq(3000)
+
+def check_pairs(pairs, template, start, end, is_circular=False):
+    assert pairs
+
+    for pair in pairs:
+        amplicon = find_amplicon(template, pair.fwd, pair.rev, is_circular)
+        assert len(amplicon) == pair.length_bp
+
+        # The amplicon must include the whole target.
+        target = (template + template)[start:end if end > start else end + len(template)]
+        assert target in amplicon
+
+        assert MIN_MELTING_TEMP_C <= pair.fwd_melting_temp_C <= MAX_MELTING_TEMP_C
+        assert MIN_MELTING_TEMP_C <= pair.rev_melting_temp_C <= MAX_MELTING_TEMP_C
+        assert abs(pair.fwd_melting_temp_C - pair.rev_melting_temp_C) <= MAX_MELTING_TEMP_DIFF_C
+
+        for primer in [pair.fwd, pair.rev]:
+            assert MIN_PRIMER_LEN <= len(primer) <= MAX_PRIMER_LEN
+            assert 1 <= sum(x in 'GC' for x in primer[-5:]) <= 3
+
+    penalties = [x.penalty for x in pairs]
+    assert penalties == sorted(penalties)
+
+def test_design_primers():
+    pairs = design_primers(TEMPLATE, 1000, 1500, num_pairs=3)
+    assert len(pairs) == 3
+    check_pairs(pairs, TEMPLATE, 1000, 1500)
+
+    for pair in pairs:
+        assert TEMPLATE[pair.start:pair.end] == find_amplicon(
+                TEMPLATE, pair.fwd, pair.rev,
+        )
+        assert 750 <= pair.start <= 1000 - MIN_PRIMER_LEN
+        assert 1500 + MIN_PRIMER_LEN <= pair.end <= 1750
+
+def test_design_primers_circular():
+    # The target spans the origin.
+    pairs = design_primers(TEMPLATE, 2900, 100, is_circular=True)
+    check_pairs(pairs, TEMPLATE, 2900, 100, is_circular=True)
+    assert all(x.end < x.start for x in pairs)
+
+    # Linear templates can't be amplified across the origin.
+    with pytest.raises(ValueError, match="empty"):
+        design_primers(TEMPLATE, 2900, 100)
+
+def test_design_primers_circular_small_gap():
+    # There are fewer than `MAX_FLANK_BP` bases outside the target, so they 
+    # have to be shared between the two primers.
+    pairs = design_primers(TEMPLATE, 100, 2900, is_circular=True)
+    check_pairs(pairs, TEMPLATE, 100, 2900, is_circular=True)
+
+    for pair in pairs:
+        assert 0 <= pair.start <= 100 - MIN_PRIMER_LEN
+        assert 2900 + MIN_PRIMER_LEN <= pair.end <= 3000
+
+    # There's no room for primers outside a target that covers the whole 
+    # template.
+    with pytest.raises(ValueError, match="whole template"):
+        design_primers(TEMPLATE, 100, 100, is_circular=True)
+
+def test_design_primers_unique():
+    # Copy the sequences flanking the target to another part of the template.  
+    # Primers that anneal there would give two products, so none of the 
+    # primers should come from the copied regions.
+    fwd_flank = TEMPLATE[750:1000]
+    rev_flank = TEMPLATE[1500:1750]
+    template = TEMPLATE[:2000] + fwd_flank[:125] + rev_flank[125:] + TEMPLATE[2250:]
+
+    pairs = design_primers(template, 1000, 1500)
+    check_pairs(pairs, template, 1000, 1500)
+
+    for pair in pairs:
+        assert pair.start >= 750 + 125 - MAX_PRIMER_LEN
+        assert pair.end <= 1500 + 125 + MAX_PRIMER_LEN
+
+def test_design_primers_not_found():
+    assert design_primers('A' * 1000, 400, 600) == []
+
+@pytest.mark.parametrize(
+        'start, end', [
+            (-1, 100),
+            (100, 3001),
+            (100, 100),
+        ],
+)
+def test_design_primers_err(start, end):
+    with pytest.raises(ValueError):
+        design_primers(TEMPLATE, start, end)
+
+def test_primer_design_app():
+    db = Database({})
+    db['p1'] = Plasmid(seq=TEMPLATE, circular=True)
+
+    app = PrimerDesign(db, 'p1', 1001, 1500)
+    app.num_pairs = 2
+    app.preset = 'q5'
+
+    pairs = app.design_primers()
+    assert len(pairs) == 2
+    check_pairs(pairs, TEMPLATE, 1000, 1500, is_circular=True)
+
+    pcr = app.get_pcr(pairs[0])
+    assert pcr.amplicons[0].fwd.seq == pairs[0].fwd
+    assert pcr.amplicons[0].rev.seq == pairs[0].rev
+    assert pcr.anneal_temp_C == [pytest.approx(
+        min(pairs[0].fwd_melting_temp_C, pairs[0].rev_melting_temp_C) + 1
+    )]
+    assert pcr.extend_time_s > 0
+
+    table = app.format_pairs(pairs)
+    assert pairs[0].fwd in table
+    assert pairs[1].rev in table
+
+    app.melting_temp_range_C = 85, 90
+    assert app.format_pairs(app.design_primers()) == "No primer pairs found."
+
+    app.start = 5000
+    with pytest.raises(UsageError):
+        app.design_primers()
+
+@pytest.mark.parametrize(
+        'given, expected', [
+            ('55-65', (55, 65)),
+            ('60-60', (60, 60)),
+        ],
+)
+def test_parse_range(given, expected):
+    assert parse_range(given, float) == expected
+
+@pytest.mark.parametrize('given', ['55', '65-55', 'a-b'])
+def test_parse_range_err(given):
+    with pytest.raises(UsageError):
+        parse_range(given, float)
@@ -0,0 +1,84 @@
+import pytest
+from stepwise_mol_bio._primers import *
+from stepwise_mol_bio.pcr import find_amplicon
+
+TEMPLATE = 'cctccggtgatagtcctagaAAAAAAAAAAtataacaggctgctgagaccGATTACA'.upper()
+
+def mutate(seq, i):
+    return seq[:i] + ('A' if seq[i] != 'A' else 'C') + seq[i+1:]
+
+def test_encode_seq():
+    assert list(encode_seq('ACGTX', unknown=4)) == [0, 1, 2, 3, 4]
+    assert list(encode_seq('ACGTX', unknown=5)) == [0, 1, 2, 3, 5]
+
+def test_find_sites():
+    finder = PrimerSiteFinder(TEMPLATE)
+    fwd = 'tataacaggctgctgagacc'
+    rev = 'tgtaatcggtctcagcagcc'
+
+    (fwd_site,), (rev_site,) = finder.find_sites([fwd, rev])
+
+    assert fwd_site == PrimerSite(start=30, end=50, strand=1, mismatches=0)
+    assert rev_site == PrimerSite(start=37, end=57, strand=-1, mismatches=0)
+
+def test_find_sites_mismatches():
+    finder = PrimerSiteFinder(TEMPLATE)
+    fwd = 'tataacaggctgctgagacc'.upper()
+
+    # Mismatches are tolerated, up to the limit.
+    sites, = finder.find_sites([mutate(fwd, 5)])
+    assert sites == [PrimerSite(start=30, end=50, strand=1, mismatches=1)]
+
+    sites, = finder.find_sites([mutate(mutate(fwd, 5), 8)], max_mismatches=1)
+    assert sites == []
+
+    # Mismatches at the 3' end are not tolerated.
+    sites, = finder.find_sites([mutate(fwd, 19)])
+    assert sites == []
+
+    # Mismatches outside the annealing region don't count.
+    sites, = finder.find_sites([mutate(fwd, 0)], anneal_len=15)
+    assert sites == [PrimerSite(start=35, end=50, strand=1, mismatches=0)]
+
+def test_find_sites_circular():
+    finder = PrimerSiteFinder(TEMPLATE, is_circular=True)
+    primer = TEMPLATE[-10:] + TEMPLATE[:10]
+
+    sites, = finder.find_sites([primer])
+    assert sites == [PrimerSite(start=47, end=67, strand=1, mismatches=0)]
+
+    finder = PrimerSiteFinder(TEMPLATE, is_circular=False)
+    sites, = finder.find_sites([primer])
+    assert sites == []
+
+@pytest.mark.parametrize('is_circular', [False, True])
+def test_find_amplicon_exact(is_circular):
+    fwd = 'tataacaggctgctgagacc'
+    rev = 'tctaggactatcaccggagg'
+
+    finder = PrimerSiteFinder(TEMPLATE, is_circular)
+
+    try:
+        expected = find_amplicon(TEMPLATE, fwd, rev, is_circular)
+    except ValueError:
+        with pytest.raises(ValueError):
+            finder.find_amplicon(fwd, rev)
+    else:
+        assert finder.find_amplicon(fwd, rev).seq == expected
+
+def test_find_amplicon_mutagenic():
+    template = 'AAAAAtataacaggctgctgagaccGATTACAcctccggtgatagtcctagaAAAAA'.upper()
+    fwd = mutate('tataacaggctgctgagacc'.upper(), 10)
+    rev = 'tctaggactatcaccggagg'.upper()
+
+    with pytest.raises(ValueError):
+        find_amplicon(template, fwd, rev)
+
+    match = load_primer_site_finder(template).find_amplicon(fwd, rev)
+    assert match.seq == fwd + 'GATTACA' + 'cctccggtgatagtcctaga'.upper()
+    assert match.mismatches == 1
+
+def test_find_amplicon_err():
+    finder = PrimerSiteFinder('A' * 40)
+    with pytest.raises(ValueError, match="no amplicon found"):
+        finder.find_amplicon('tataacaggctgctgagacc', 'tctaggactatcaccggagg')
@@ -0,0 +1,121 @@
+import pytest
+from stepwise_mol_bio._sample_utils import *
+
+class MockSample:
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.accesses = 0
+        self._attrs = attrs
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+
+        self.accesses += 1
+        try:
+            return self._attrs[attr]
+        except KeyError:
+            raise AttributeError(attr) from None
+
+def names(groups):
+    return [[x.name for x in group] for group in groups]
+
+def test_group_samples():
+
+    @group_samples('a')
+    def f(group, suffix=''):
+        return [x.name + suffix for x in group], group.a
+
+    samples = [
+            MockSample('x', a=1),
+            MockSample('y', a=2),
+            MockSample('z', a=1),
+    ]
+
+    assert f(samples[0]) == (['x'], 1)
+    assert f(samples[0], '!') == (['x!'], 1)
+    assert f(samples[0], suffix='!') == (['x!'], 1)
+    assert f(group=samples[0], suffix='!') == (['x!'], 1)
+
+    assert list(f.for_group_in(samples)) == [
+            (['x', 'z'], 1),
+            (['y'], 2),
+    ]
+    assert list(f.for_group_in(samples, suffix='!')) == [
+            (['x!', 'z!'], 1),
+            (['y!'], 2),
+    ]
+
+def test_group_samples_annotation():
+
+    @group_samples('a')
+    def f(suffix, group: Group):
+        return [x.name + suffix for x in group]
+
+    samples = [MockSample('x', a=1), MockSample('y', a=2)]
+
+    assert f('!', samples[0]) == ['x!']
+    assert list(f.for_group_in('!', group=samples)) == [['x!'], ['y!']]
+
+def test_group_samples_err():
+    with pytest.raises(TypeError, match="at most one"):
+        @group_samples
+        def f(a: Group, b: Group):
+            pass
+
+def test_grouping_cache():
+    samples = [
+            MockSample('x', a=1, b=1),
+            MockSample('y', a=1, b=2),
+            MockSample('z', a=2, b=1),
+    ]
+
+    @group_samples('a', 'b')
+    def inner(group):
+        return [x.name for x in group]
+
+    @group_samples('a')
+    def outer(group):
+        return list(inner.for_group_in(group))
+
+    with grouping_cache() as cache:
+        assert list(outer.for_group_in(samples)) == [
+                [['x'], ['y']],
+                [['z']],
+        ]
+
+        # Each attribute should only be looked up once per sample, even though
+        # `a` is used by both the inner and outer groupings.
+        assert [x.accesses for x in samples] == [2, 2, 2]
+
+        groups = list(group_by_attrs(samples, {'a'}))
+        assert names(groups) == [['x', 'y'], ['z']]
+        assert cache.hits == 1
+
+        assert list(group_by_attrs(samples, {'a'})) == groups
+        assert cache.hits == 2
+
+    # The cache only lasts as long as the context manager.
+    list(group_by_attrs(samples, {'a'}))
+    assert [x.accesses for x in samples] == [3, 3, 3]
+
+def test_grouping_cache_nested():
+    with grouping_cache() as cache_1:
+        with grouping_cache() as cache_2:
+            assert cache_1 is cache_2
+
+    with grouping_cache() as cache_3:
+        assert cache_3 is not cache_1
+
+def test_group_by_attrs_parent():
+    samples = [
+            MockSample('x', a=1, b=1),
+            MockSample('y', a=1, b=2),
+    ]
+    group, = group_by_attrs(samples, {'a'})
+    subgroups = list(group_by_attrs(group, {'b'}))
+
+    assert names(subgroups) == [['x'], ['y']]
+    assert subgroups[0].b == 1
+    assert subgroups[0].a == 1
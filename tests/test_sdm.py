@@ -0,0 +1,149 @@
+import pytest
+import random
+
+from freezerbox import Database, Plasmid
+from stepwise_mol_bio import ConfigError, UsageError
+from stepwise_mol_bio.pcr import find_amplicon
+from stepwise_mol_bio._sdm import *
+
+def random_seq(n, seed=0):
+    rng = random.Random(seed)
+    return ''.join(rng.choice('ACGT') for _ in range(n))
+
+TEMPLATE = random_seq(3000)
+
+def check_primers(template, primers):
+    for x in primers:
+        # After circularization, the PCR product should be the mutated 
+        # plasmid.  The product is rotated relative to the template, and its 
+        # ends overlap by however many bases the two primers share.
+        amplicon = find_amplicon(template, x.fwd, x.rev, True)
+        product = x.mutation.apply(template)
+
+        assert len(amplicon) == x.length_bp == len(product)
+        assert amplicon in product + product
+
+        assert MIN_ANNEAL_LEN <= x.fwd_anneal_len <= MAX_ANNEAL_LEN
+        assert MIN_ANNEAL_LEN <= x.rev_anneal_len <= MAX_ANNEAL_LEN
+        assert x.fwd_melting_temp_C >= MIN_MELTING_TEMP_C
+        assert x.rev_melting_temp_C >= MIN_MELTING_TEMP_C
+
+@pytest.mark.parametrize(
+        'given, expected', [
+            ('123A>G', Mutation('123A>G', 122, 123, 'G')),
+            ('123a>g', Mutation('123a>g', 122, 123, 'G')),
+            ('123del', Mutation('123del', 122, 123)),
+            ('123_125del', Mutation('123_125del', 122, 125)),
+            ('123_124insGGC', Mutation('123_124insGGC', 123, 123, 'GGC')),
+            ('123delinsTT', Mutation('123delinsTT', 122, 123, 'TT')),
+            ('123_125delinsTT', Mutation('123_125delinsTT', 122, 125, 'TT')),
+        ],
+)
+def test_mutation_from_hgvs(given, expected):
+    assert Mutation.from_hgvs(given) == expected
+
+@pytest.mark.parametrize(
+        'given', [
+            '', 'A123G', '123A>', '0A>G', '123_124A>G', '125_123del',
+            '123_125ins', '123_125insG', '123delG', '123delins',
+        ],
+)
+def test_mutation_from_hgvs_err(given):
+    with pytest.raises(ConfigError):
+        Mutation.from_hgvs(given)
+
+def test_mutation_from_hgvs_ref():
+    Mutation.from_hgvs('2C>T', 'ACGT')
+
+    with pytest.raises(ConfigError, match="expected 'A' at position 2, found 'C'"):
+        Mutation.from_hgvs('2A>T', 'ACGT')
+
+def test_mutation_apply():
+    assert Mutation('x', 1, 2, 'TT').apply('ACGT') == 'ATTGT'
+    assert Mutation('x', 1, 3).apply('ACGT') == 'AT'
+    assert Mutation('x', 2, 2, 'AA').apply('ACGT') == 'ACAAGT'
+
+def test_design_mutagenic_primers():
+    mutations = [
+            Mutation.from_hgvs(x, TEMPLATE) for x in [
+                f'1001{TEMPLATE[1000]}>{"A" if TEMPLATE[1000] != "A" else "C"}',
+                '1500_1599del',
+                '2000_2001insGGATCC',
+                '2500_2502delinsT',
+
+                # Near the origin.
+                '1_3del',
+                '2999_3000insAAA',
+
+                # Long enough to be split between both primers.
+                '500_501ins' + 'GGTTC' * 10,
+            ]
+    ]
+    primers = design_mutagenic_primers(TEMPLATE, mutations)
+
+    assert [x.mutation for x in primers] == mutations
+    check_primers(TEMPLATE, primers)
+
+    *_, long_insert = primers
+    assert long_insert.fwd.startswith('GGTTC' * 5)
+    assert long_insert.rev.startswith('GAACC' * 5)
+
+def test_design_mutagenic_primers_tm():
+    # Every primer should be as short as possible while still melting above 
+    # the minimum temperature.
+    primers = design_mutagenic_primers(
+            TEMPLATE,
+            [Mutation('x', i, i + 1, 'A') for i in range(0, 3000, 100)],
+    )
+    check_primers(TEMPLATE, primers)
+
+    for x in primers:
+        assert abs(x.fwd_melting_temp_C - x.rev_melting_temp_C) < 5
+
+def test_design_mutagenic_primers_err():
+    with pytest.raises(ConfigError, match="not in template"):
+        design_mutagenic_primers(TEMPLATE, [Mutation('x', 3000, 3001)])
+
+    with pytest.raises(ConfigError, match="insert too long"):
+        design_mutagenic_primers(TEMPLATE, [Mutation('x', 10, 10, 'A' * 61)])
+
+    assert design_mutagenic_primers(TEMPLATE, []) == []
+
+def test_sdm_app(tmp_path):
+    db = Database({})
+    db['p1'] = Plasmid(seq=TEMPLATE, circular=True)
+
+    mutations = tmp_path / 'mutations.txt'
+    mutations.write_text('''\
+# Comments and blank lines are ignored.
+1500_1599del
+
+2000_2001insGGATCC
+''')
+
+    app = SiteDirectedMutagenesis(db, 'p1', read_mutations(mutations))
+    app.preset = 'q5'
+
+    primers = app.design_primers()
+    assert [x.mutation.name for x in primers] == [
+            '1500_1599del',
+            '2000_2001insGGATCC',
+    ]
+    check_primers(TEMPLATE, primers)
+
+    invpcr = app.get_inverse_pcr(primers)
+    assert len(invpcr.amplicons) == 2
+    assert invpcr.amplicons[1].fwd.tag == '2000_2001insGGATCC-F'
+    assert invpcr.amplicons[1].fwd.seq == primers[1].fwd
+
+    # All the reactions share a single annealing temperature.
+    assert isinstance(invpcr.anneal_temp_C, int)
+
+    protocol = app.protocol.format_text()
+    assert '2000_2001insGGATCC-R' in protocol
+    assert primers[0].rev in protocol
+    assert 'Setup 2 ligation reactions' in protocol
+
+    app.mutations = []
+    with pytest.raises(UsageError):
+        app.design_primers()
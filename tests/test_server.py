@@ -0,0 +1,161 @@
+import os
+import json
+import pickle
+import socket
+import threading
+import pytest
+import freezerbox
+import stepwise_mol_bio
+
+from stepwise_mol_bio._server import *
+
+@pytest.fixture
+def db_factory(monkeypatch):
+    calls = []
+
+    def load_db(use=None, config=None):
+        db = freezerbox.Database(config)
+        calls.append(db)
+        return db
+
+    monkeypatch.setattr(freezerbox, 'load_db', load_db)
+    return calls
+
+def exchange(argv, cwd, text=False):
+    db_cache = DatabaseCache()
+    client, server = socket.socketpair()
+
+    thread = threading.Thread(target=handle_connection, args=(server, db_cache))
+    thread.start()
+
+    with client:
+        status, stdout, stderr = send_request(
+                client, {'argv': argv, 'cwd': str(cwd), 'text': text},
+        )
+
+    thread.join()
+    return status, stdout, stderr
+
+def test_find_protocol():
+    assert find_protocol('pcr') is stepwise_mol_bio.Pcr
+    assert find_protocol('gels/gel.py') is stepwise_mol_bio.Gel
+    assert find_protocol('digest') is stepwise_mol_bio.RestrictionDigest
+
+    with pytest.raises(stepwise_mol_bio.UsageError, match='unknown protocol'):
+        find_protocol('not_a_protocol')
+
+def test_commands():
+    # Every protocol script should be reachable via the server.  Some modules
+    # just provide helper functions, and aren't protocols.
+    from pathlib import Path
+    root = Path(stepwise_mol_bio.__file__).parent
+    scripts = {
+            p.stem
+            for p in root.glob('**/*.py')
+            if not p.name.startswith('_')
+    }
+    scripts -= {'centrifuge'}
+    assert scripts == set(COMMANDS)
+
+def test_database_cache(tmp_path, db_factory):
+    db_path = tmp_path / 'db.xlsx'
+    rc_path = tmp_path / '.freezerboxrc'
+    rc_path.write_text(f'''\
+use = 'test'
+[[database.test]]
+format = 'excel'
+path = '{db_path}'
+''')
+    db_path.write_text('v1')
+
+    cache = DatabaseCache()
+    db1 = cache.load_db(tmp_path)
+    assert len(db_factory) == 1
+    assert db1.config['use'] == 'test'
+
+    db2 = cache.load_db(tmp_path)
+    assert db2 is db1
+    assert len(db_factory) == 1
+
+    # Modifying the database should trigger a reload.
+    db_path.write_text('version 2')
+    db3 = cache.load_db(tmp_path)
+    assert db3 is not db1
+    assert len(db_factory) == 2
+
+    # So should modifying the config file.
+    rc_path.write_text(rc_path.read_text() + '\n# comment\n')
+    db4 = cache.load_db(tmp_path)
+    assert db4 is not db3
+    assert len(db_factory) == 3
+
+    # Different directories may use different config files, so should get
+    # different databases.
+    subdir = tmp_path / 'subdir'
+    subdir.mkdir()
+    db5 = cache.load_db(subdir)
+    assert db5 is not db4
+    assert len(db_factory) == 4
+
+    # Creating a new config file should trigger a reload.
+    (subdir / '.freezerboxrc').write_text('')
+    db6 = cache.load_db(subdir)
+    assert db6 is not db5
+    assert len(db_factory) == 5
+
+def test_handle_connection(tmp_path, db_factory):
+    status, stdout, stderr = exchange(['thermocycler', '95/30'], tmp_path)
+
+    assert status == 0
+    assert stderr == ''
+
+    io = pickle.loads(stdout)
+    assert io.protocol.steps[0] == 'Incubate at 95°C for 30s.'
+
+def test_handle_connection_text(tmp_path, db_factory):
+    status, stdout, stderr = exchange(['thermocycler', '95/30'], tmp_path, True)
+
+    assert status == 0
+    assert stderr == ''
+    assert '95°C' in stdout.decode()
+
+def test_handle_connection_error(tmp_path, db_factory):
+    status, stdout, stderr = exchange(['not_a_protocol'], tmp_path)
+
+    assert status == 1
+    assert stdout == b''
+    assert "not_a_protocol:\n    unknown protocol: 'not_a_protocol'" in stderr
+
+def test_handle_connection_usage(tmp_path, db_factory):
+    status, stdout, stderr = exchange(['thermocycler', '-h'], tmp_path)
+
+    assert status == 0
+    assert stdout == b''
+    assert 'Usage:' in stderr
+
+def test_warm_configs(monkeypatch):
+    import stepwise.config
+    from byoc import TomlConfig
+
+    orig_do_load = TomlConfig._do_load
+    orig_load_plugins = stepwise.config.load_plugins
+
+    with warm_configs():
+        assert TomlConfig._do_load is not orig_do_load
+        assert stepwise.config.load_plugins is not orig_load_plugins
+
+        p1 = list(stepwise.config.load_plugins('stepwise.protocols'))
+        p2 = list(stepwise.config.load_plugins('stepwise.protocols'))
+        assert p1 == p2
+
+    assert TomlConfig._do_load is orig_do_load
+    assert stepwise.config.load_plugins is orig_load_plugins
+
+def test_request_without_server(tmp_path, db_factory):
+    status, stdout, stderr = request(
+            ['thermocycler', '95/30'],
+            cwd=tmp_path,
+            socket_path=tmp_path / 'no_server.sock',
+    )
+    assert status == 0
+    assert pickle.loads(stdout).protocol.steps
@@ -0,0 +1,150 @@
+import pytest
+import stepwise_mol_bio._site_index as site_index_module
+
+from stepwise_mol_bio._site_index import *
+from stepwise_mol_bio.digest import calc_digest_products, get_restriction_batch
+from Bio.Restriction import RestrictionBatch
+
+SEQ = 'GAATTCAAGCTTGGTCTCAGAATTC'
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    index = RestrictionSiteIndex(tmp_path / 'restriction_sites.sqlite')
+    monkeypatch.setattr(RestrictionSiteIndex, 'from_config', lambda: index)
+    return index
+
+def forbid_search(monkeypatch):
+    def search_sites(seq, enzymes):
+        raise AssertionError("site index not used")
+    monkeypatch.setattr(site_index_module, 'search_sites', search_sites)
+
+def test_get_sites(index):
+    batch = RestrictionBatch(['EcoRI', 'HindIII', 'BsaI'])
+    sites = index.get_sites(SEQ, batch)
+
+    assert {str(k): v for k, v in sites.items()} == {
+            'EcoRI': (1, 20),
+            'HindIII': (7,),
+            'BsaI': (19,),
+    }
+    assert index.get_sites(SEQ, batch) == sites
+
+def test_get_sites_every_neb_enzyme(index):
+    index.get_sites(SEQ, [])
+    record = index._records[index.key_from_seq(SEQ)]
+    assert set(record) == {str(x) for x in get_neb_enzymes()}
+
+def test_get_sites_non_neb_enzyme(index, monkeypatch):
+    enzyme = next(
+            x for x in RestrictionBatch(suppliers=['B'])
+            if x not in get_neb_enzymes()
+    )
+    expected = search_sites(SEQ, [enzyme])[str(enzyme)]
+
+    assert index.get_sites(SEQ, [enzyme]) == {enzyme: expected}
+
+    # The enzyme is added to the stored record.
+    forbid_search(monkeypatch)
+    index = RestrictionSiteIndex(index.path)
+    assert index.get_sites(SEQ, [enzyme]) == {enzyme: expected}
+
+def test_persistence(index, monkeypatch):
+    batch = RestrictionBatch(['EcoRI'])
+    expected = index.get_sites(SEQ, batch)
+
+    forbid_search(monkeypatch)
+    index = RestrictionSiteIndex(index.path)
+    assert index.get_sites(SEQ, batch) == expected
+
+    # A sequence that changed is searched again.
+    with pytest.raises(AssertionError, match="site index not used"):
+        index.get_sites(SEQ + 'A', batch)
+
+def test_key_from_seq():
+    assert RestrictionSiteIndex.key_from_seq(SEQ) == \
+           RestrictionSiteIndex.key_from_seq(SEQ)
+    assert RestrictionSiteIndex.key_from_seq(SEQ) != \
+           RestrictionSiteIndex.key_from_seq(SEQ + 'A')
+
+def test_evict(index):
+    index.max_size_MB = 0
+    index.get_sites(SEQ, [])
+
+    rows = index._connect().execute('SELECT key FROM sites').fetchall()
+    assert rows == []
+
+def test_evict_interval(index, monkeypatch):
+    num_evictions = 0
+
+    def evict():
+        nonlocal num_evictions
+        num_evictions += 1
+
+    monkeypatch.setattr(index, 'evict', evict)
+    monkeypatch.setattr(index, 'EVICT_INTERVAL', 3)
+    monkeypatch.setattr(site_index_module, 'search_sites', lambda seq, enzymes: {})
+
+    for i in range(7):
+        index.get_sites(SEQ + 'A' * i, [])
+
+    assert num_evictions == 3
+
+def test_fork(index):
+    import os
+
+    index.get_sites(SEQ, [])
+    parent_db = index._connect()
+
+    # The child process must not use the connection it inherited.
+    pid = os.fork()
+    if pid == 0:
+        ok = False
+        try:
+            ok = index._connect() is not parent_db and \
+                 index.get_sites(SEQ + 'A', []) is not None
+        finally:
+            os._exit(0 if ok else 1)
+
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+
+    # The parent keeps using its own connection, and sees the child's write.
+    assert index._connect() is parent_db
+    rows = parent_db.execute('SELECT key FROM sites').fetchall()
+    assert len(rows) == 2
+
+def test_unwritable(tmp_path):
+    # The index can't be created, because there's a file in the way.  The 
+    # sites should still be found.
+    (tmp_path / 'cache').write_text('')
+    index = RestrictionSiteIndex(tmp_path / 'cache' / 'restriction_sites.sqlite')
+
+    batch = RestrictionBatch(['EcoRI'])
+    assert {str(k): v for k, v in index.get_sites(SEQ, batch).items()} == {
+            'EcoRI': (1, 20),
+    }
+
+def test_clear(index):
+    index.get_sites(SEQ, [])
+    index.clear()
+
+    rows = index._connect().execute('SELECT key FROM sites').fetchall()
+    assert rows == []
+    assert index._records == {}
+
+def test_from_config_disabled(monkeypatch):
+    monkeypatch.setenv('STEPWISE_MOL_BIO_NO_CACHE', '1')
+    assert RestrictionSiteIndex.from_config() is None
+
+@pytest.mark.parametrize('is_circular', [True, False])
+@pytest.mark.parametrize('enzymes', [['EcoRI'], ['EcoRI', 'HindIII-HF']])
+def test_calc_digest_products(index, monkeypatch, enzymes, is_circular):
+    monkeypatch.setattr(RestrictionSiteIndex, 'from_config', lambda: None)
+    expected = calc_digest_products(SEQ, enzymes, is_circular=is_circular)
+
+    monkeypatch.setattr(RestrictionSiteIndex, 'from_config', lambda: index)
+    assert calc_digest_products(SEQ, enzymes, is_circular=is_circular) == expected
+
+    forbid_search(monkeypatch)
+    index._records = {}
+    assert calc_digest_products(SEQ, enzymes, is_circular=is_circular) == expected
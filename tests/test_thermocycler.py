@@ -1,3 +1,5 @@
+import pytest
+
 from param_helpers import *
 from stepwise_mol_bio.thermocycler import *
 
@@ -24,3 +26,102 @@ def test_format_thermocycler_steps(steps, expected, error):
     with error:
         assert format_thermocycler_steps(steps) == expected
 
+
+PCR_STEPS = [
+        {'temp_C': 98, 'time_s': 30},
+        {'repeat': 35, 'name': 'cycles', 'steps': [
+            {'temp_C': 98, 'time_s': 10},
+            {'temp_C': 60, 'time_s': 20, 'name': 'anneal'},
+            {'temp_C': 72, 'time_m': 1, 'name': 'extend'},
+        ]},
+        {'temp_C': 72, 'time_m': 2},
+        {'hold_C': 4, 'name': 'hold'},
+]
+
+def test_program_from_dicts():
+    program = ThermocyclerProgram.from_dicts(PCR_STEPS)
+
+    assert len(program) == 4
+    assert program['anneal'] == Incubation(60, 20, name='anneal')
+    assert program['hold'] == Hold(4, name='hold')
+    assert program['cycles'].num_cycles == 35
+    assert 'extend' in program
+    assert 'final_extend' not in program
+
+    with pytest.raises(UsageError, match="no thermocycler step named 'x'"):
+        program['x']
+
+def test_program_from_dicts_err():
+    with pytest.raises(UsageError, match="multiple values"):
+        ThermocyclerProgram.from_dicts([{'temp_C': 37, 'time_s': 1, 'time_m': 1}])
+
+    with pytest.raises(UsageError, match="multiple thermocycler steps named 'a'"):
+        ThermocyclerProgram.from_dicts([
+            {'temp_C': 37, 'time_s': 1, 'name': 'a'},
+            {'hold_C': 4, 'name': 'a'},
+        ])
+
+def test_program_replace():
+    program = ThermocyclerProgram.from_dicts(PCR_STEPS)
+    modified = program.replace(anneal={'temp_C': 55}, extend={'time_s': 90})
+
+    assert modified['anneal'].temp_C == 55
+    assert modified['extend'].time_s == 90
+
+    # The original program is unchanged, and unmodified steps are shared.
+    assert program['anneal'].temp_C == 60
+    assert modified.steps[0] is program.steps[0]
+    assert modified.steps[-1] is program.steps[-1]
+
+    renamed = program.replace(hold={'name': 'end'})
+    assert 'end' in renamed and 'hold' not in renamed
+
+def test_program_compile():
+    program = ThermocyclerProgram.from_dicts(PCR_STEPS)
+    lines = program.compile(PCR_FORMAT)
+
+    assert [(depth, text) for depth, _, text in lines] == [
+            (0, '98°C for 30s'),
+            (0, 'Repeat 35x:'),
+            (1, '98°C for 10s'),
+            (1, '60°C for 20s'),
+            (1, '72°C for 1 min'),
+            (0, '72°C for 2 min'),
+            (0, '4°C hold'),
+    ]
+    assert program.compile(PCR_FORMAT) is lines
+
+def test_program_format_pre():
+    program = ThermocyclerProgram([
+            Incubation(95, 30),
+            Repeat(40, (Incubation(95, 10), Incubation('55-65', 15), MeasureFluorescence())),
+            MeltCurve(65, 95, 0.5, 5, (MeasureFluorescence(),)),
+    ])
+    assert program.format_pre().content == """\
+- 95°C for 30s
+- Repeat 40x:
+  - 95°C for 10s
+  - 55-65°C for 15s
+  - Measure fluorescence
+- 65-95°C in 5s steps of 0.5°C:
+  - Measure fluorescence"""
+
+@pytest.mark.parametrize(
+        'steps, ramp_rate_C_s, expected', [
+            ([], None, 0),
+            ([{'temp_C': 37, 'time_m': 15}], None, 900),
+            ([{'temp_C': 37, 'time': '1m30'}], None, 90),
+            (PCR_STEPS, None, 30 + 35 * 90 + 120),
+            (PCR_STEPS, 2, 30 + 35 * 90 + 120 + (35 * 50 + 34 * 26 + 68) / 2),
+            ([MeltCurve(65, 66, 0.5, 5)], None, 15),
+            ([Incubation('55-65', 10), Incubation(95, 10)], 3, 30),
+        ],
+)
+def test_program_run_time_s(steps, ramp_rate_C_s, expected):
+    program = ThermocyclerProgram.from_dicts(steps)
+    assert program.calc_run_time_s(ramp_rate_C_s) == pytest.approx(expected)
+
+def test_program_run_time_s_err():
+    program = ThermocyclerProgram([Incubation(25, 'overnight')])
+    with pytest.raises(UsageError, match="unknown duration 'overnight'"):
+        program.run_time_s
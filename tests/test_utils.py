@@ -1,3 +1,6 @@
+import pytest
+import stepwise
+import freezerbox
 import parametrize_from_file
 
 from pytest import approx
@@ -33,3 +36,154 @@ def test_round_down_to_1_sig_fig(given, expected):
 @parametrize_from_file(schema=with_py.eval)
 def test_round_up_to_1_sig_fig(given, expected):
     assert round_up_to_1_sig_fig(given) == approx(expected)
+
+class MockMaker:
+
+    def __init__(self, i, fail=False):
+        self.i = i
+        self.fail = fail
+        self.num_renders = 0
+
+    @property
+    def protocol(self):
+        self.num_renders += 1
+        if self.fail:
+            raise ConfigError(f"maker {self.i} failed")
+        return stepwise.Protocol(steps=[f"step {self.i}"])
+
+@pytest.mark.parametrize('workers', [1, 2, 4])
+def test_iter_maker_protocols(workers):
+    makers = [MockMaker(i) for i in range(10)]
+    results = list(iter_maker_protocols(makers, workers=workers))
+
+    assert [x[0] for x in results] == makers
+    assert [x[1].steps for x in results] == [[f"step {i}"] for i in range(10)]
+
+def test_iter_maker_protocols_lazy():
+    consumed = []
+
+    def iter_makers():
+        for i in range(10):
+            consumed.append(i)
+            yield MockMaker(i)
+
+    results = iter_maker_protocols(iter_makers())
+
+    # Only one maker of lookahead is needed to decide whether to use parallel
+    # workers.
+    maker, protocol = next(results)
+    assert protocol.steps == ["step 0"]
+    assert consumed == [0, 1]
+
+    maker, protocol = next(results)
+    assert protocol.steps == ["step 1"]
+    assert consumed == [0, 1]
+
+    maker, protocol = next(results)
+    assert protocol.steps == ["step 2"]
+    assert consumed == [0, 1, 2]
+
+def test_iter_maker_protocols_err():
+    makers = [MockMaker(0), MockMaker(1, fail=True)]
+    results = iter_maker_protocols(makers, workers=2)
+
+    maker, protocol = next(results)
+    assert protocol.steps == ["step 0"]
+
+    # The error should be re-raised in the parent process.
+    with pytest.raises(ConfigError, match="maker 1 failed"):
+        next(results)
+
+    assert makers[0].num_renders == 0
+    assert makers[1].num_renders == 1
+
+def test_solo_maker_cache():
+    cache = SoloMakerCache()
+
+    class MockMain(Main):
+        solo_maker_cache = cache
+
+    def make_db(seq):
+        db = freezerbox.Database({})
+        db['p1'] = freezerbox.Plasmid(seq=seq)
+        db['p2'] = freezerbox.Plasmid(seq='GATTACA')
+        return db
+
+    db1 = make_db('ATGC')
+    app1 = MockMain.maker_from_reagent(db1, db1['p1'])
+    assert app1.products == [db1['p1']]
+    assert cache.stats == dict(hits=0, misses=1, hit_rate=0, size=1)
+
+    # Same database, same product:
+    app2 = MockMain.maker_from_reagent(db1, db1['p1'])
+    assert app2 is app1
+    assert cache.stats == dict(hits=1, misses=1, hit_rate=1/2, size=1)
+
+    # Equivalent database, e.g. after reloading.  The cached maker isn't 
+    # reused, because that would pull the old database out from under anyone 
+    # still using it.
+    db2 = make_db('ATGC')
+    app3 = MockMain.maker_from_reagent(db2, db2['p1'])
+    assert app3 is not app1
+    assert app3.db is db2
+    assert app3.products == [db2['p1']]
+    assert app1.db is db1
+    assert app1.products == [db1['p1']]
+    assert cache.stats == dict(hits=1, misses=2, hit_rate=1/3, size=1)
+
+    # Modified database:
+    db3 = make_db('ATGCATGC')
+    app4 = MockMain.maker_from_reagent(db3, db3['p1'])
+    assert app4 is not app3
+    assert app4.products == [db3['p1']]
+    assert app3.db is db2
+    assert cache.stats == dict(hits=1, misses=3, hit_rate=1/4, size=1)
+
+    # Different product:
+    app5 = MockMain.maker_from_reagent(db3, db3['p2'])
+    assert app5 is not app4
+    assert cache.stats == dict(hits=1, misses=4, hit_rate=1/5, size=2)
+
+    cache.clear()
+    assert cache.stats == dict(hits=0, misses=0, hit_rate=0, size=0)
+
+@pytest.mark.parametrize(
+        'keys', [
+            [],
+            [1, 2, 1, 3, 2],
+            [1, 1.0, True, '1'],
+            [[1, 2], (1, 2), [1, 2], [2, 1]],
+            [{'a': 1, 'b': 2}, {'b': 2, 'a': 1}, {'a': 2}],
+            [{1, 2}, frozenset({2, 1}), {1}],
+            [{'a': [1]}, {'a': [1]}, {'a': [2]}],
+            [bytearray(b'a'), 1, bytearray(b'a'), 1],
+        ],
+)
+def test_group_by_fingerprint(keys):
+    items = list(enumerate(keys))
+    key = lambda x: x[1]
+
+    expected = list(freezerbox.group_by_identity(items, key=key))
+    actual = list(group_by_fingerprint(items, key=key))
+
+    assert actual == expected
+
+def test_group_by_fingerprint_reactions():
+    def rxn(volume):
+        rxn = stepwise.Reaction()
+        rxn['water'].volume = volume, 'µL'
+        rxn['buffer'].volume = 2, 'µL'
+        rxn['buffer'].stock_conc = '10x'
+        return rxn
+
+    items = [rxn(8), rxn(7), rxn(8)]
+    groups = list(group_by_fingerprint(items))
+
+    assert [x[1] for x in groups] == [[items[0], items[2]], [items[1]]]
+
+def test_fingerprint_key():
+    assert fingerprint_key([1, 2]) != fingerprint_key((1, 2))
+    assert fingerprint_key({'a': [1]}) == fingerprint_key({'a': [1]})
+
+    with pytest.raises(TypeError):
+        fingerprint_key(bytearray(b'a'))